@@ -1,19 +1,79 @@
 import os
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import tool
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+import metrics
+from agent_context import SNIPPET_MAX_LINES, ContextCompactor, format_snippet
+from lexical_index import get_lexical_index
 from retrieval import get_retriever
+from manifest import index_version
+from symbol_index import get_symbol_index
+from tool_cache import get_tool_cache
 from tools_utils import get_directory_diag
 
 load_dotenv()
 
+# Keeps symbol tool output within a sensible context budget
+MAX_SYMBOL_RESULTS = 100
+# Tool calls requested in the same agent step run concurrently, up to this many
+TOOL_MAX_CONCURRENCY = int(os.getenv("AGENT_TOOL_CONCURRENCY", 8))
+# Most lines a single read_code call returns
+READ_CODE_MAX_LINES = 400
+# Most queries a single search_codebase_batch call runs
+MAX_BATCH_QUERIES = 8
+
+
+def _file_version(codebase_name: str, file_path: str):
+    """read_code results depend on the file itself, not only on the index."""
+    try:
+        mtime = os.stat(file_path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    return index_version(codebase_name), mtime
+
 
 def create_tools(codebase_name: str):
+    # Identical calls are answered from the shared cache until the codebase is re-ingested
+    cache = get_tool_cache()
+
+    def search_filters(file_path_filter: Optional[str], node_type_filter: Optional[str]) -> Optional[dict]:
+        filters = {}
+        if file_path_filter:
+            filters["file_path"] = file_path_filter
+        if node_type_filter:
+            filters["node_type"] = node_type_filter
+        return filters or None
+
+    def format_results(docs) -> str:
+        # Only the lines a snippet shows are decoded from the blob store
+        docs = get_retriever(codebase_name).hydrate(docs, max_lines=SNIPPET_MAX_LINES)
+        if not docs:
+            return "No relevant code found."
+        # Older vector records carry no line numbers; the lexical index knows every block's location
+        locations = get_lexical_index(codebase_name).docs
+        result = ""
+        for i, doc in enumerate(docs):
+            meta = doc.metadata
+            block_id = meta.get("id") or f"{meta.get('file_path')}::{meta.get('name')}"
+            location = locations.get(block_id, {})
+            result += format_snippet(
+                i + 1,
+                block_id,
+                meta.get("file_path", "unknown"),
+                meta.get("start_line") or location.get("start_line"),
+                meta.get("end_line") or location.get("end_line"),
+                meta.get("name", "unknown"),
+                meta.get("node_type", "unknown"),
+                doc.page_content,
+                matched_queries=meta.get("matched_queries"),
+                total_lines=meta.get("total_lines"),
+            )
+        return result
 
     @tool
+    @metrics.timed("tool_call", tool="search_codebase")
+    @cache.cached(codebase_name, "search_codebase")
     def search_codebase(query: str, file_path_filter: Optional[str] = None, node_type_filter: Optional[str] = None):
         """
         Search the codebase for relevant code snippets, functions, classes, or documentation.
@@ -24,33 +84,69 @@ def create_tools(codebase_name: str):
             node_type_filter: Optional. Filter by node type (e.g., 'function_definition', 'class_definition').
         """
         retriever = get_retriever(codebase_name)
-        
-        filters = {}
-        if file_path_filter:
-            filters["file_path"] = file_path_filter
-        if node_type_filter:
-            filters["node_type"] = node_type_filter
-        
-        docs = retriever.search(query, filters=filters if filters else None)
+        docs = retriever.search(query, filters=search_filters(file_path_filter, node_type_filter), hydrate=False)
         
         if not docs:
             return "No relevant code found."
-            
-        result = ""
-        for i, doc in enumerate(docs):
-            result += f"--- Result {i+1} ---\n"
-            meta = doc.metadata
-            file_path = meta.get("file_path", "unknown")
-            name = meta.get("name", "unknown")
-            node_type = meta.get("node_type", "unknown")
-            
-            result += f"File: {file_path}\n"
-            result += f"Element: {name} ({node_type})\n"
-            result += f"Context:\n{doc.page_content}\n\n"
-            
-        return result
+        return format_results(docs)
+
+    @tool
+    @metrics.timed("tool_call", tool="search_codebase_batch")
+    @cache.cached(codebase_name, "search_codebase_batch")
+    def search_codebase_batch(queries: List[str], file_path_filter: Optional[str] = None,
+                              node_type_filter: Optional[str] = None):
+        """
+        Run several searches at once and get one merged, de-duplicated list of results.
+        Prefer this over calling search_codebase repeatedly with different phrasings.
+
+        Args:
+            queries: Up to 8 search queries, e.g. different phrasings or related concepts.
+            file_path_filter: Optional. Filter every query to a specific file path (partial match allowed).
+            node_type_filter: Optional. Filter every query by node type (e.g., 'function_definition').
+        """
+        queries = [query for query in queries if query.strip()][:MAX_BATCH_QUERIES]
+        if not queries:
+            return "No queries given."
+        retriever = get_retriever(codebase_name)
+        docs = retriever.search_many(
+            queries, filters=search_filters(file_path_filter, node_type_filter), hydrate=False
+        )
+        if not docs:
+            return "No relevant code found."
+        return format_results(docs)
+
+    @tool
+    @metrics.timed("tool_call", tool="read_code")
+    @cache.cached(codebase_name, "read_code", version=lambda file_path, **_: _file_version(codebase_name, file_path))
+    def read_code(file_path: str, start_line: int, end_line: int):
+        """
+        Read a line range of an indexed file, e.g. to expand a truncated search result.
+
+        Args:
+            file_path: The file path exactly as shown in a result's "File:" line.
+            start_line: First line to read (1-based).
+            end_line: Last line to read (inclusive).
+        """
+        # Only files that were ingested for this codebase can be read
+        if file_path not in get_lexical_index(codebase_name).files():
+            return f"'{file_path}' is not an indexed file of this codebase."
+        start_line = max(start_line, 1)
+        end_line = min(end_line, start_line + READ_CODE_MAX_LINES - 1)
+        try:
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                lines = [line for number, line in enumerate(f, 1) if start_line <= number <= end_line]
+        except OSError as e:
+            return f"Error reading {file_path}: {e}"
+        if not lines:
+            return f"{file_path} has no lines {start_line}-{end_line}."
+        end_line = start_line + len(lines) - 1
+        return format_snippet(
+            1, f"{file_path}:{start_line}-{end_line}", file_path, start_line, end_line,
+            f"lines {start_line}-{end_line}", "file", "".join(lines).rstrip("\n"),
+        )
 
     @tool
+    @metrics.timed("tool_call", tool="list_directory_structure")
     def list_directory_structure(directory: str = ".", depth: int = 2):
         """
         List the directory structure of the codebase to understand the file organization.
@@ -64,13 +160,86 @@ def create_tools(codebase_name: str):
         except Exception as e:
             return f"Error listing directory: {e}"
 
-    return [search_codebase, list_directory_structure]
+    @tool
+    @metrics.timed("tool_call", tool="find_definition")
+    @cache.cached(codebase_name, "find_definition")
+    def find_definition(symbol: str):
+        """
+        Find where a function, class, method or type is defined.
+
+        Args:
+            symbol: The symbol name, optionally qualified (e.g. 'process_orders' or 'OrderService.process').
+        """
+        definitions = get_symbol_index(codebase_name).find_definitions(symbol)
+        if not definitions:
+            return f"No definition found for '{symbol}'."
+
+        result = ""
+        for entry in definitions[:MAX_SYMBOL_RESULTS]:
+            container = f" (in {entry['container']})" if entry.get("container") else ""
+            result += f"{entry['file_path']}:{entry['line']}-{entry['end_line']} {entry['kind']} {entry['name']}{container}\n"
+        return result
+
+    @tool
+    @metrics.timed("tool_call", tool="find_references")
+    @cache.cached(codebase_name, "find_references")
+    def find_references(symbol: str):
+        """
+        Find every place a symbol is used: call sites, imports and other references.
+
+        Args:
+            symbol: The symbol name to look up.
+        """
+        references = get_symbol_index(codebase_name).find_references(symbol)
+        if not references:
+            return f"No references found for '{symbol}'."
+
+        result = ""
+        for entry in references[:MAX_SYMBOL_RESULTS]:
+            lines = ", ".join(str(line) for line in entry["lines"])
+            detail = ""
+            if entry["kind"] == "call":
+                detail = f" from {entry['caller']}"
+            elif entry["kind"] == "import":
+                detail = f": {entry['text']}"
+            result += f"{entry['file_path']}:{lines} {entry['kind']}{detail}\n"
+        return result
+
+    @tool
+    @metrics.timed("tool_call", tool="call_graph")
+    @cache.cached(codebase_name, "call_graph")
+    def call_graph(symbol: str, depth: int = 1, direction: str = "both"):
+        """
+        Show which functions call a symbol and which functions it calls.
+
+        Args:
+            symbol: The function or method name.
+            depth: How many hops to follow (default 1).
+            direction: 'callers', 'callees' or 'both'.
+        """
+        graph = get_symbol_index(codebase_name).call_graph(symbol, depth=min(depth, 5), direction=direction)
+        if not graph["callers"] and not graph["callees"]:
+            return f"No call edges found for '{symbol}'."
+
+        result = ""
+        for key in ("callers", "callees"):
+            if graph[key]:
+                result += f"{key.capitalize()}:\n"
+                for caller, callee, file_path, line in graph[key][:MAX_SYMBOL_RESULTS]:
+                    result += f"  {caller} -> {callee} ({file_path}:{line})\n"
+        return result
+
+    return [search_codebase, search_codebase_batch, read_code, list_directory_structure, find_definition, find_references, call_graph]
 
 def get_agent(codebase_name: str):
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("GEMINI_API_KEY not found in environment variables")
     
+    # Deferred: the Gemini SDK and langgraph are the slowest imports in the app
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langgraph.prebuilt import create_react_agent
+
     llm = ChatGoogleGenerativeAI(
         model="gemini-1.5-flash", 
         google_api_key=api_key,
@@ -79,20 +248,91 @@ def get_agent(codebase_name: str):
     
     tools = create_tools(codebase_name)
     
-    system_prompt = SystemMessage(content="""You are an expert Senior Software Engineer assisting a user with their codebase.
+    system_prompt = """You are an expert Senior Software Engineer assisting a user with their codebase.
     
     Your capabilities:
     1.  **Search Codebase**: Find code snippets using semantic search. You can filter by file path or node type if you are sure.
-        - **Node Types**: `class_definition`, `function_definition`, `assignment` (for variables).
+        - **Node Types** (tree-sitter names, per language): Python `class_definition`, `function_definition`, `assignment` (for variables);
+          JavaScript `class_declaration`, `function_declaration`, `method_definition`; Java `class_declaration`, `method_declaration`;
+          C++ `class_specifier`, `function_definition`; Go `function_declaration`, `method_declaration`, `type_declaration`;
+          Rust `function_item`, `struct_item`, `impl_item`, `trait_item`; files without definitions are indexed as `file`.
+        - To look for several things (or several phrasings) at once, use **Search Codebase Batch** with a list of queries instead of repeated searches.
+        - Long results are cut short; use **Read Code** with the file and line range from the hint to see the rest.
     2.  **List Directory**: Explore the file structure to understand the project layout.
+    3.  **Find Definition / Find References / Call Graph**: Exact, index-backed lookups of where a symbol
+        is defined, where it is used, and who calls it. Prefer these over search when you know the name.
     
     Guidelines:
     -   Always verify your assumptions by searching the code.
     -   When asked about how something works, first search for the implementation.
     -   If the user asks about a specific file, try searching for that file's content or listing it.
     -   Be accurate and concise. Quote relevant code snippets in your explanation.
-    """)
-    
+    """
     
-    agent = create_react_agent(llm, tools, state_modifier=system_prompt)
+    # The compactor builds the system message itself, so it can append a
+    # summary of turns it had to drop
+    agent = create_react_agent(llm, tools, pre_model_hook=ContextCompactor(system_prompt))
     return agent
+
+
+def _message_text(content: Any) -> str:
+    """Flattens message content, which may be a string or a list of content parts."""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content or []:
+        if isinstance(part, str):
+            parts.append(part)
+        elif isinstance(part, dict) and part.get("type") == "text":
+            parts.append(part.get("text", ""))
+    return "".join(parts)
+
+
+def stream_agent(agent, messages: List[BaseMessage]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Runs the agent and yields UI events as they happen instead of blocking
+    until the whole ReAct loop is done.
+
+    Events:
+        ("token", {"text"}): a chunk of the model's answer.
+        ("tool_call", {"id", "name", "args"}): the model requested a tool.
+        ("tool_result", {"id", "name", "content"}): a tool finished.
+        ("final", {"message"}): the final AIMessage of the run.
+
+    Independent tool calls from one model step are executed concurrently by
+    the tool node's thread pool, bounded by TOOL_MAX_CONCURRENCY.
+    """
+    config = {"max_concurrency": TOOL_MAX_CONCURRENCY}
+    final_message = None
+    for mode, payload in agent.stream(
+        {"messages": messages}, config=config, stream_mode=["messages", "updates"]
+    ):
+        if mode == "messages":
+            chunk, metadata = payload
+            # Only stream model output; tool messages arrive via "updates"
+            if metadata.get("langgraph_node") == "agent":
+                text = _message_text(chunk.content)
+                if text:
+                    yield "token", {"text": text}
+            continue
+
+        for update in payload.values():
+            for message in (update or {}).get("messages", []):
+                if isinstance(message, AIMessage):
+                    for tool_call in message.tool_calls:
+                        yield "tool_call", {
+                            "id": tool_call.get("id"),
+                            "name": tool_call["name"],
+                            "args": tool_call["args"],
+                        }
+                    if not message.tool_calls:
+                        final_message = message
+                elif isinstance(message, ToolMessage):
+                    yield "tool_result", {
+                        "id": message.tool_call_id,
+                        "name": message.name,
+                        "content": _message_text(message.content),
+                    }
+
+    if final_message is not None:
+        yield "final", {"message": AIMessage(content=_message_text(final_message.content))}
@@ -0,0 +1,244 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+import metrics
+from manifest import content_hash
+
+# Rough prompt budget for everything sent to the model in one call
+AGENT_CONTEXT_TOKENS = int(os.getenv("AGENT_CONTEXT_TOKENS", 24000))
+# Code lines shown per snippet before it is cut with a read_code hint
+SNIPPET_MAX_LINES = int(os.getenv("AGENT_SNIPPET_LINES", 40))
+# Estimate used for budgeting; same ratio as chunking in ingestion_utils
+CHARS_PER_TOKEN = 4
+# Characters kept per side of a dropped turn in the running summary
+SUMMARY_CHARS = 300
+# Files listed per dropped turn in the running summary
+SUMMARY_FILES = 5
+
+SNIPPET_HEADER_RE = re.compile(r"^--- Result \d+ \[(?P<ref>[0-9a-f]+)\] ---$", re.M)
+FILE_LINE_RE = re.compile(r"^File: (?P<location>.+)$", re.M)
+
+
+def snippet_ref(key: str) -> str:
+    """Short stable reference for a snippet, used to spot repeats."""
+    return content_hash(key.encode("utf-8"))[:10]
+
+
+def format_snippet(position: int, key: str, file_path: str, start_line: Optional[int],
+                   end_line: Optional[int], name: str, node_type: str, code: str,
+                   matched_queries: Optional[Sequence[str]] = None,
+                   total_lines: Optional[int] = None) -> str:
+    """
+    Renders one code snippet for tool output. Long snippets are cut after
+    SNIPPET_MAX_LINES lines with a read_code() hint for the rest; pass
+    `total_lines` when `code` was already cut (e.g. hydrated with max_lines).
+    """
+    location = f"{file_path}:{start_line}-{end_line}" if start_line else file_path
+    lines = code.splitlines()
+    total_lines = max(total_lines or 0, len(lines))
+    if total_lines > SNIPPET_MAX_LINES:
+        shown = "\n".join(lines[:SNIPPET_MAX_LINES])
+        if start_line:
+            first_hidden = start_line + SNIPPET_MAX_LINES
+            hint = f'call read_code("{file_path}", {first_hidden}, {end_line}) to see them'
+        else:
+            hint = "search with file_path_filter to see them"
+        code = f"{shown}\n... {total_lines - SNIPPET_MAX_LINES} more lines; {hint}"
+    return (
+        f"--- Result {position} [{snippet_ref(key)}] ---\n"
+        f"File: {location}\n"
+        f"Element: {name} ({node_type})\n"
+        + (f"Matched: {'; '.join(matched_queries)}\n" if matched_queries else "")
+        + f"Context:\n{code}\n\n"
+    )
+
+
+def estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    total = 0
+    for message in messages:
+        content = message.content
+        total += len(content if isinstance(content, str) else str(content))
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            total += len(str(tool_call.get("args", "")))
+    return total // CHARS_PER_TOKEN
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in content or []
+        if isinstance(part, str) or (isinstance(part, dict) and part.get("type") == "text")
+    )
+
+
+def _split_snippets(text: str):
+    """Yields (prefix, [(ref, snippet text)]) for snippet-formatted tool output."""
+    matches = list(SNIPPET_HEADER_RE.finditer(text))
+    if not matches:
+        return text, []
+    snippets = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        snippets.append((match.group("ref"), text[match.start() : end]))
+    return text[: matches[0].start()], snippets
+
+
+def _reference_only(snippet: str, note: str) -> str:
+    """Keeps a snippet's header, File and Element lines and drops the code."""
+    head = snippet.split("Context:\n", 1)[0]
+    return f"{head}({note})\n\n"
+
+
+def _with_content(message: ToolMessage, content: str) -> ToolMessage:
+    return message.model_copy(update={"content": content})
+
+
+class ContextCompactor:
+    """
+    pre_model_hook for the ReAct agent that keeps each model call within
+    AGENT_CONTEXT_TOKENS without touching the stored conversation.
+
+    In order:
+      1. Tool output from previous turns is reduced to file/line references;
+         the answers built from it are kept.
+      2. Code snippets that are still visible earlier in the context are
+         replaced by a reference to that result.
+      3. If still over budget, the oldest turns are dropped and folded into a
+         short extractive summary in the system message.
+      4. Finally, older tool output inside the current turn is reduced too,
+         keeping the latest step intact.
+    """
+
+    def __init__(self, system_prompt: str, max_tokens: int = AGENT_CONTEXT_TOKENS):
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+
+    def __call__(self, state: Dict[str, Any]) -> Dict[str, List[BaseMessage]]:
+        return {"llm_input_messages": self.compact(state["messages"])}
+
+    @staticmethod
+    def _turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+        turns: List[List[BaseMessage]] = []
+        for message in messages:
+            if isinstance(message, HumanMessage) or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    @staticmethod
+    def _dedupe(turns: List[List[BaseMessage]]):
+        seen = set()
+        for turn in turns:
+            for i, message in enumerate(turn):
+                if not isinstance(message, ToolMessage):
+                    continue
+                prefix, snippets = _split_snippets(_text(message))
+                if not snippets:
+                    continue
+                parts = [prefix]
+                changed = False
+                for ref, snippet in snippets:
+                    if ref in seen:
+                        parts.append(_reference_only(snippet, "already shown above"))
+                        changed = True
+                    else:
+                        # Only a snippet whose code is still visible counts as seen
+                        if "Context:\n" in snippet:
+                            seen.add(ref)
+                        parts.append(snippet)
+                if changed:
+                    turn[i] = _with_content(message, "".join(parts))
+
+    @staticmethod
+    def _elide(message: BaseMessage) -> BaseMessage:
+        if not isinstance(message, ToolMessage):
+            return message
+        text = _text(message)
+        prefix, snippets = _split_snippets(text)
+        if snippets:
+            content = prefix + "".join(
+                _reference_only(snippet, "code omitted, use read_code to see it again")
+                for _, snippet in snippets
+            )
+        elif len(text) > SUMMARY_CHARS:
+            content = text[:SUMMARY_CHARS] + "\n... (older tool output truncated)"
+        else:
+            return message
+        return _with_content(message, content)
+
+    @staticmethod
+    def _summarize(turn: List[BaseMessage]) -> str:
+        question = next((_text(m) for m in turn if isinstance(m, HumanMessage)), "")
+        answer = next(
+            (_text(m) for m in reversed(turn) if isinstance(m, AIMessage) and not m.tool_calls), ""
+        )
+        files = []
+        for message in turn:
+            if isinstance(message, ToolMessage):
+                for match in FILE_LINE_RE.finditer(_text(message)):
+                    if match.group("location") not in files:
+                        files.append(match.group("location"))
+        line = f"- User: {question[:SUMMARY_CHARS]}"
+        if answer:
+            line += f"\n  Assistant: {answer[:SUMMARY_CHARS]}"
+        if files:
+            line += f"\n  Looked at: {', '.join(files[:SUMMARY_FILES])}"
+        return line
+
+    def _system_message(self, summary: List[str]) -> SystemMessage:
+        content = self.system_prompt
+        if summary:
+            # The summary gets at most a quarter of the budget; its oldest lines go first
+            budget = self.max_tokens * CHARS_PER_TOKEN // 4
+            kept: List[str] = []
+            used = 0
+            for line in reversed(summary):
+                if used + len(line) > budget and kept:
+                    break
+                kept.append(line)
+                used += len(line)
+            omitted = len(summary) - len(kept)
+            content += "\n\nSummary of earlier conversation (oldest first):\n"
+            if omitted:
+                content += f"- ({omitted} earlier turns omitted)\n"
+            content += "\n".join(reversed(kept))
+        return SystemMessage(content=content)
+
+    def compact(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        turns = self._turns(messages)
+        for turn in turns[:-1]:
+            turn[:] = [self._elide(message) for message in turn]
+        self._dedupe(turns)
+
+        summary: List[str] = []
+        tokens = estimate_tokens([self._system_message(summary)]) + sum(estimate_tokens(turn) for turn in turns)
+        while tokens > self.max_tokens and len(turns) > 1:
+            dropped = turns.pop(0)
+            summary.append(self._summarize(dropped))
+            tokens = (
+                estimate_tokens([self._system_message(summary)])
+                + sum(estimate_tokens(turn) for turn in turns)
+            )
+        metrics.increment("agent_context_dropped_turns_total", len(summary))
+
+        if turns and tokens > self.max_tokens:
+            current = turns[-1]
+            # Tool results after the last model step are what it is about to read
+            last_step = max(
+                (i for i, message in enumerate(current) if isinstance(message, AIMessage)), default=len(current)
+            )
+            for i in range(last_step):
+                if tokens <= self.max_tokens:
+                    break
+                before = estimate_tokens([current[i]])
+                current[i] = self._elide(current[i])
+                tokens -= before - estimate_tokens([current[i]])
+
+        metrics.set_gauge("agent_context_tokens", tokens)
+        return [self._system_message(summary)] + [message for turn in turns for message in turn]
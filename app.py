@@ -2,8 +2,14 @@ import streamlit as st
 import asyncio
 import os
 from langchain_core.messages import HumanMessage, AIMessage
-from agent import get_agent
-from ingestion_utils import ingest_folder
+from agent import get_agent, stream_agent
+from jobs import get_job_manager
+from retrieval import invalidate_retriever
+from watcher import start_watching, stop_watching
+from query_cache import get_query_cache
+from tool_cache import get_tool_cache
+from service_client import QUERY_SERVICE_URL, QueryClient, ServiceError
+import metrics
 
 st.set_page_config(
     page_title="Endee Codebase Agent",
@@ -14,6 +20,46 @@ st.set_page_config(
 st.title("🤖 Endee Codebase Agent")
 st.markdown("Ask questions about your codebase, structure, or implementation details.")
 
+def on_job_complete(job):
+    # Runs on the job's thread; the next script run picks up the new index
+    invalidate_retriever(job["codebase"])
+
+
+@st.cache_resource
+def load_job_manager():
+    return get_job_manager(on_complete=on_job_complete)
+
+job_manager = load_job_manager()
+
+
+@st.fragment(run_every=2)
+def ingest_jobs_panel():
+    """Polls background ingest jobs without blocking the rest of the page."""
+    jobs = job_manager.list()[:5]
+    for job in jobs:
+        progress = job["progress"]
+        total = progress.get("total_files") or 0
+        label = f"{job['codebase']} · {job['status']}"
+        if job["status"] == "running":
+            st.progress(
+                min(progress["files"] / max(total, 1), 1.0),
+                text=f"{label}: {progress['files']}/{total} files, {progress.get('chunks', 0)} chunks",
+            )
+            if st.button("Cancel", key=f"cancel-{job['id']}"):
+                job_manager.cancel(job["id"])
+        elif job["status"] == "completed" and job["stats"]:
+            stats = job["stats"]
+            st.caption(
+                f"✅ {label}: {stats['files']} files ({stats['unchanged_files']} unchanged), "
+                f"{stats['chunks']} chunks ({stats['files_per_sec']:.1f} files/s)"
+            )
+        else:
+            st.caption(f"{label}" + (f": {job['error']}" if job["error"] else ""))
+            if job["status"] in ("failed", "cancelled", "interrupted"):
+                if st.button("Resume", key=f"resume-{job['id']}"):
+                    job_manager.resume(job["id"])
+
+
 with st.sidebar:
     st.header("⚙️ Configuration")
     
@@ -21,21 +67,43 @@ with st.sidebar:
     default_path = os.getcwd()
     codebase_name = st.text_input("Codebase Name", value="default_codebase")
     path_input = st.text_input("Codebase Path", value=default_path)
+    workers = st.number_input("Parse Workers", min_value=1, value=os.cpu_count() or 1, step=1)
+    force_reingest = st.checkbox("Force full re-ingest", value=False)
     
     if st.button("Ingest Codebase"):
         if path_input and os.path.exists(path_input) and codebase_name:
-            with st.spinner(f"Ingesting {path_input} into '{codebase_name}'..."):
-                try:
-                    ingest_folder(path_input, codebase_name)
-                    st.success("Ingestion complete!")
-                    st.cache_resource.clear()
-                except Exception as e:
-                    st.error(f"Ingestion failed: {e}")
+            job = job_manager.submit(path_input, codebase_name, workers=int(workers), force=force_reingest)
+            st.toast(f"Ingest job {job['id']} for '{codebase_name}' is {job['status']}.")
         else:
             st.error("Please enter a valid path and codebase name.")
 
+    ingest_jobs_panel()
+
+    # Re-ingests edited files within seconds instead of waiting for the next full ingest
+    if st.checkbox("Watch for changes", value=False, key="watch_codebase"):
+        if path_input and os.path.isdir(path_input) and codebase_name:
+            try:
+                start_watching(path_input, codebase_name)
+                st.caption(f"👀 Watching {path_input}")
+            except Exception as e:
+                st.error(f"Could not watch {path_input}: {e}")
+    elif codebase_name:
+        stop_watching(codebase_name)
+
     st.markdown("---")
     st.header("Status")
+
+    cache_stats = get_query_cache().stats()
+    st.caption(
+        f"Query cache: {cache_stats['hit_rate']:.0%} hit rate "
+        f"({cache_stats['exact_hits']} exact, {cache_stats['semantic_hits']} semantic, "
+        f"{cache_stats['misses']} misses)"
+    )
+    tool_stats = get_tool_cache().stats()
+    st.caption(
+        f"Tool cache: {tool_stats['hit_rate']:.0%} hit rate "
+        f"({tool_stats['hits']} tool calls saved, {tool_stats['misses']} misses)"
+    )
     
     st.markdown("**Instructions:**")
     st.markdown("- Ask specific questions about files.")
@@ -51,9 +119,44 @@ if "messages" not in st.session_state:
 def load_agent_resource(name: str):
     return get_agent(name)
 
+
+def service_session(client: QueryClient, name: str) -> str:
+    """This browser session's conversation on the query service, per codebase."""
+    key = f"service_session_{name}"
+    if key not in st.session_state:
+        st.session_state[key] = client.create_session(name)
+    return st.session_state[key]
+
+
+def service_events(client: QueryClient, name: str, prompt: str):
+    """stream_agent-style events from the query service; recreates a session it no longer knows."""
+    try:
+        yield from client.stream(service_session(client, name), prompt)
+    except ServiceError as e:
+        if e.status != 404:
+            raise
+        st.session_state.pop(f"service_session_{name}", None)
+        yield from client.stream(service_session(client, name), prompt)
+
+@st.cache_resource
+def start_metrics_endpoint():
+    metrics.write_file_at_exit()
+    # Prometheus-style /metrics when METRICS_PORT is set
+    return metrics.start_metrics_server()
+
+start_metrics_endpoint()
+
+# With QUERY_SERVICE_URL set, the app is a thin client of server.py
+service = QueryClient(QUERY_SERVICE_URL) if QUERY_SERVICE_URL else None
+
 try:
     if codebase_name:
-        agent = load_agent_resource(codebase_name)
+        if service is not None:
+            # Fails fast if the service is down
+            service.health()
+            agent = service
+        else:
+            agent = load_agent_resource(codebase_name)
     else:
         st.warning("Please enter a codebase name to load the agent.")
         agent = None
@@ -84,18 +187,77 @@ if prompt := st.chat_input("Ask about the codebase..."):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
+        tool_container = st.container()
         message_placeholder = st.empty()
         message_placeholder.markdown("Thinking...")
         
         try:
-            # Run the agent
-            inputs = {"messages": st.session_state.messages}
-            response = agent.invoke(inputs)
-            last_message = response["messages"][-1]
-            full_response = last_message.content
+            # Stream the agent: tool calls show up as they are made and the
+            # answer renders token by token
+            full_response = ""
+            tool_status = {}
+            final_message = None
+            if service is not None:
+                events = service_events(service, codebase_name, prompt)
+            else:
+                events = stream_agent(agent, st.session_state.messages)
+            for event, data in events:
+                if event == "token":
+                    full_response += data["text"]
+                    message_placeholder.markdown(full_response + "▌")
+                elif event == "tool_call":
+                    status = tool_container.status(f"🔧 {data['name']}", state="running")
+                    status.json(data["args"])
+                    tool_status[data["id"]] = status
+                    # Text streamed before a tool call is intermediate reasoning
+                    full_response = ""
+                    message_placeholder.markdown("Thinking...")
+                elif event == "tool_result":
+                    status = tool_status.get(data["id"])
+                    if status is not None:
+                        preview = data["content"][:2000]
+                        status.code(preview)
+                        status.update(state="complete")
+                elif event == "final":
+                    final_message = data.get("message") or AIMessage(content=data["content"])
+
+            if final_message is not None and final_message.content:
+                full_response = final_message.content
             message_placeholder.markdown(full_response)
             st.session_state.messages.append(AIMessage(content=full_response))
             
         except Exception as e:
             message_placeholder.markdown(f"Error: {e}")
-            st.error(f"An error occurred: {e}")
\ No newline at end of file
+            st.error(f"An error occurred: {e}")
+
+# Rendered last so it includes this run's ingestion and chat
+with st.sidebar:
+    with st.expander("📊 Performance", expanded=False):
+        stages = metrics.registry.stage_histograms()
+        if not stages:
+            st.caption("No timings recorded yet.")
+        else:
+            st.dataframe(
+                [
+                    {
+                        "stage": stage,
+                        "count": histogram.count,
+                        "p50 ms": round(histogram.quantile(0.5) * 1000, 2),
+                        "p95 ms": round(histogram.quantile(0.95) * 1000, 2),
+                        "p99 ms": round(histogram.quantile(0.99) * 1000, 2),
+                        "total s": round(histogram.sum, 2),
+                        "errors": int(metrics.registry.counter("errors_total", stage=stage)),
+                    }
+                    for stage, histogram in sorted(stages.items())
+                ],
+                hide_index=True,
+            )
+            selected = st.selectbox("Latency histogram", sorted(stages))
+            histogram = stages[selected]
+            bounds = [f"≤{bound * 1000:g}ms" for bound in histogram.buckets] + ["more"]
+            st.bar_chart({"count": dict(zip(bounds, histogram.counts))})
+        st.download_button(
+            "Export Prometheus metrics",
+            metrics.registry.export_prometheus(),
+            file_name="metrics.prom",
+        )
@@ -0,0 +1,460 @@
+"""
+Offline ingestion and retrieval benchmark.
+
+Generates a synthetic repository (or loads a recorded fixture), ingests it
+with a stubbed embedder into the local vector store, then replays a labeled
+query set through the retriever. No network access is needed.
+
+    python benchmark.py --files 500 --output bench.json
+    python benchmark.py --fixture fixtures/small --compare bench.json
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+WORDS = (
+    "account address allocate archive audit balance batch buffer cache cancel "
+    "channel checksum chunk client commit compress config connect cursor decode "
+    "delete deploy digest dispatch document download encode encrypt event export "
+    "fetch filter flush format graph handler header index invoice journal ledger "
+    "limit lock merge message metric migrate monitor notify order packet parse "
+    "partition payment persist policy profile publish queue quota record refund "
+    "render replica request resolve retry route schedule schema session shard "
+    "signature snapshot socket stream subscribe tenant token transaction upload "
+    "user validate vector verify window worker"
+).split()
+
+# (label, compression, search dimension) compared by --compression
+COMPRESSION_CONFIGS = (
+    ("float32", "none", 0),
+    ("float32_dim256", "none", 256),
+    ("int8", "int8", 0),
+    ("int8_dim256", "int8", 256),
+    ("pq", "pq", 0),
+)
+
+# Fractional regressions beyond this are flagged by --compare
+DEFAULT_TOLERANCE = 0.10
+LOWER_IS_BETTER = ("seconds", "latency", "rss", "ms_per")
+
+
+def generate_repo(root: Path, num_files: int, functions_per_file: int = 8,
+                  num_queries: int = 200, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Writes a deterministic synthetic Python/JavaScript/Go repository under
+    `root` and returns labeled queries: each query describes one generated
+    function in prose and names the file (relative to `root`) and function
+    that answer it.
+    """
+    rng = random.Random(seed)
+    functions = []
+    for file_index in range(num_files):
+        language = ("python", "javascript", "go")[file_index % 3]
+        package = root / f"pkg{file_index % 20}"
+        package.mkdir(parents=True, exist_ok=True)
+        extension = {"python": ".py", "javascript": ".js", "go": ".go"}[language]
+        file_path = package / f"module{file_index}{extension}"
+
+        parts = ["package main\n"] if language == "go" else []
+        for function_index in range(functions_per_file):
+            topic = rng.sample(WORDS, 6)
+            name = f"{topic[0]}_{topic[1]}_{file_index}_{function_index}"
+            description = " ".join(topic)
+            body = [f"{rng.choice(WORDS)}_{i} = {rng.randint(0, 999)}" for i in range(rng.randint(3, 12))]
+            if language == "python":
+                lines = "\n".join(f"    {line}" for line in body)
+                parts.append(f'def {name}(value):\n    """{description}"""\n{lines}\n    return value\n')
+            elif language == "javascript":
+                lines = "\n".join(f"  let {line};" for line in body)
+                parts.append(f"// {description}\nfunction {name}(value) {{\n{lines}\n  return value;\n}}\n")
+            else:
+                lines = "\n".join(f"\t{line.replace(' = ', ' := ')}" for line in body)
+                parts.append(f"// {description}\nfunc {name}(value int) int {{\n{lines}\n\treturn value\n}}\n")
+            functions.append({"file_path": str(file_path.relative_to(root)), "name": name, "topic": topic})
+        file_path.write_text("\n".join(parts), encoding="utf-8")
+
+    queries = []
+    for function in rng.sample(functions, min(num_queries, len(functions))):
+        words = function["topic"][2:]
+        rng.shuffle(words)
+        queries.append({
+            "query": f"where do we {' '.join(words)}",
+            "relevant": [{"file_path": function["file_path"], "name": function["name"]}],
+        })
+    return queries
+
+
+class HashingEmbedder:
+    """
+    Stub embedder with some semantics: a signed feature-hashing bag of the
+    lexical terms, so texts sharing words end up close in cosine space.
+    """
+
+    def __init__(self, dimension: int):
+        from lexical_index import tokenize
+
+        self.model = "hashing"
+        self.dimension = dimension
+        self.requests = 0
+        self._tokenize = tokenize
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for term in self._tokenize(text):
+            digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        self.requests += 1
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    total = sum(seconds)
+    return {
+        "count": len(seconds),
+        "latency_p50_ms": percentile(seconds, 50) * 1000,
+        "latency_p95_ms": percentile(seconds, 95) * 1000,
+        "latency_p99_ms": percentile(seconds, 99) * 1000,
+        "latency_mean_ms": total / len(seconds) * 1000 if seconds else 0.0,
+        "qps": len(seconds) / total if total else 0.0,
+    }
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+STARTUP_MODULES = ("treeSitter", "ingestion_utils", "retrieval", "agent")
+
+
+def measure_startup() -> Dict[str, float]:
+    """
+    Cold import time of each app module, each in a fresh interpreter, plus
+    the cost of the first parse of a language (grammar load) vs. a warm one.
+    """
+    root = Path(__file__).resolve().parent
+    results = {}
+    for module in STARTUP_MODULES:
+        code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+        completed = subprocess.run(
+            [sys.executable, "-c", code], cwd=root, capture_output=True, text=True,
+        )
+        lines = completed.stdout.strip().splitlines()
+        if completed.returncode == 0 and lines:
+            results[f"import_{module}_seconds"] = float(lines[-1])
+
+    from treeSitter import TreeSitter
+
+    source = b"def f(x):\n    return x\n"
+    start = time.perf_counter()
+    TreeSitter("python").parse_bytes(source)
+    results["first_parse_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    TreeSitter("python").parse_bytes(source)
+    results["warm_parse_seconds"] = time.perf_counter() - start
+    return results
+
+
+def _is_relevant(metadata: Dict[str, Any], relevant: List[Dict[str, Any]]) -> bool:
+    # Small neighbouring blocks are merged into one chunk named "a, b"
+    names = metadata.get("name", "").split(", ")
+    return any(
+        metadata.get("file_path") == item["file_path"] and item["name"] in names
+        for item in relevant
+    )
+
+
+def queries_from_index(codebase_name: str, count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Labeled queries for a real repository: the words of a random sample of
+    indexed function names, each answered by the block that defines it.
+    """
+    from lexical_index import LexicalIndex
+
+    docs = [
+        doc for doc in LexicalIndex.load(codebase_name).docs.values()
+        if "function" in doc.get("type", "") or "method" in doc.get("type", "")
+    ]
+    rng = random.Random(seed)
+    queries = []
+    for doc in rng.sample(docs, min(count, len(docs))):
+        name = doc["name"].split(", ")[0]
+        words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name).replace("_", " ").lower().split()
+        if words:
+            queries.append({
+                "query": " ".join(words),
+                "relevant": [{"file_path": doc["file_path"], "name": name}],
+            })
+    return queries
+
+
+def benchmark_compression(codebase_name: str, queries: List[Dict[str, Any]], embedder,
+                          top_k: int) -> Dict[str, Any]:
+    """
+    Memory and latency vs. recall@k of each COMPRESSION_CONFIGS setting over
+    the already-ingested local store. Recall is measured against the exact
+    float32 top-k and against the query labels. A reduced setting that is
+    not in effect (PQ below LOCAL_PQ_MIN_VECTORS vectors) is reported as
+    inactive, without latency or recall, since it would score float32.
+
+    The vectors come from `embedder`; with HashingEmbedder they are sparse
+    bag-of-words hashes, so the recall numbers say little about how a real
+    embedding model compresses. They are labelled with the embedder's model.
+    """
+    from manifest import get_state_dir
+    from vector_store import LOCAL_PQ_MIN_VECTORS, LocalVectorStore
+
+    directory = get_state_dir(codebase_name) / "vectors"
+    vectors = [embedder.embed_query(item["query"]) for item in queries]
+    exact = LocalVectorStore(directory, compression="none", search_dimension=0)
+    expected = [{hit["id"] for hit in exact.search(vector, top_k)} for vector in vectors]
+
+    results: Dict[str, Any] = {"embedder": embedder.model}
+    for label, compression, search_dimension in COMPRESSION_CONFIGS:
+        store = LocalVectorStore(directory, compression=compression, search_dimension=search_dimension)
+        # The first search pays for PQ training; keep it out of the latencies
+        start = time.perf_counter()
+        store.search(vectors[0], top_k)
+        setup_seconds = time.perf_counter() - start
+        if store.reduced and not store.compressed:
+            print(f"Skipping {label}: not in effect on {store.count()} vectors "
+                  f"(PQ trains from LOCAL_PQ_MIN_VECTORS={LOCAL_PQ_MIN_VECTORS}).")
+            results[label] = {**store.footprint(), "compression_active": False}
+            continue
+
+        latencies = []
+        overlap = 0
+        hits = 0
+        for vector, item, exact_ids in zip(vectors, queries, expected):
+            start = time.perf_counter()
+            found = store.search(vector, top_k)
+            latencies.append(time.perf_counter() - start)
+            overlap += len(exact_ids & {hit["id"] for hit in found})
+            if any(_is_relevant({**hit["filter"], **hit["meta"]}, item["relevant"]) for hit in found):
+                hits += 1
+        results[label] = {
+            **store.footprint(),
+            "compression_active": store.compressed,
+            **latency_summary(latencies),
+            "setup_seconds": setup_seconds,
+            f"recall_at_{top_k}_vs_exact": overlap / max(sum(len(ids) for ids in expected), 1),
+            f"recall_at_{top_k}": hits / len(queries) if queries else 0.0,
+        }
+    return results
+
+
+def run_benchmark(repo: Path, queries: Optional[List[Dict[str, Any]]], workers: int, top_k: int,
+                  codebase_name: str = "benchmark", num_queries: int = 200,
+                  compression: bool = False) -> Dict[str, Any]:
+    """
+    Ingests `repo` and replays `queries` (sampled from the index if None);
+    assumes the environment is already offline.
+    """
+    import ingestion_utils
+    from embeddings import EMBEDDING_DIMENSION
+    from retrieval import EndeeRetriever
+
+    embedder = HashingEmbedder(EMBEDDING_DIMENSION)
+    ingestion_utils.embedder = embedder
+
+    results: Dict[str, Any] = {}
+    stats = ingestion_utils.ingest_folder(str(repo), codebase_name, workers=workers, force=True)
+    results["ingest"] = {
+        "files": stats["files"],
+        "chunks": stats["chunks"],
+        "seconds": stats["seconds"],
+        "files_per_sec": stats["files_per_sec"],
+        "chunks_per_sec": stats["chunks_per_sec"],
+        "ms_per_file": stats["seconds"] / max(stats["files"], 1) * 1000,
+        "ms_per_chunk": stats["seconds"] / max(stats["chunks"], 1) * 1000,
+    }
+
+    # An unchanged re-run measures the incremental path
+    stats = ingestion_utils.ingest_folder(str(repo), codebase_name, workers=workers)
+    results["reingest_unchanged"] = {"seconds": stats["seconds"], "files_per_sec": stats["files_per_sec"]}
+    if queries is None:
+        queries = queries_from_index(codebase_name, num_queries)
+
+    retriever = EndeeRetriever(index_name=codebase_name, top_k=top_k, embeddings=embedder)
+    for mode, search in (
+        ("search", lambda q: retriever.search(q)),
+        ("vector", lambda q: retriever._search_internal(q, top_k=top_k)),
+    ):
+        latencies = []
+        hits = 0
+        for item in queries:
+            start = time.perf_counter()
+            documents = search(item["query"])
+            latencies.append(time.perf_counter() - start)
+            if any(_is_relevant(doc.metadata, item["relevant"]) for doc in documents[:top_k]):
+                hits += 1
+        results[mode] = latency_summary(latencies)
+        results[mode][f"recall_at_{top_k}"] = hits / len(queries) if queries else 0.0
+
+    if compression:
+        results["compression"] = benchmark_compression(codebase_name, queries, embedder, top_k)
+    results["memory"] = peak_rss_mb()
+    # Runs subprocesses, so it must come after the RSS snapshot
+    results["startup"] = measure_startup()
+    return results
+
+
+def _flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Returns a line per metric that regressed by more than `tolerance`."""
+    now = _flatten(current["results"])
+    before = _flatten(baseline["results"])
+    regressions = []
+    for name, old in sorted(before.items()):
+        new = now.get(name)
+        if new is None or not old or name.endswith("count") or name.endswith(("files", "chunks")):
+            continue
+        change = (new - old) / abs(old)
+        lower_is_better = any(marker in name for marker in LOWER_IS_BETTER)
+        if (lower_is_better and change > tolerance) or (not lower_is_better and change < -tolerance):
+            regressions.append(f"{name}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and retrieval offline.")
+    parser.add_argument("--files", type=int, default=200, help="Synthetic repo size")
+    parser.add_argument("--functions", type=int, default=8, help="Functions per synthetic file")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--fixture", help="Directory with a recorded repo/ and queries.json")
+    parser.add_argument("--repo", help="Benchmark an existing repository; queries are sampled from its functions")
+    parser.add_argument("--compression", action="store_true",
+                        help="Also compare compressed / reduced-dimension vector search")
+    parser.add_argument("--save-fixture", help="Record the generated repo and queries here")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="endee-bench-"))
+    # Everything stays local and starts cold; set before the modules are imported
+    os.environ["ENDEE_STATE_DIR"] = str(work_dir / "state")
+    os.environ["VECTOR_BACKEND"] = "local"
+    os.environ["ENDEE_EMBED_CACHE_SIZE"] = "0"
+    os.environ["QUERY_CACHE_SIZE"] = "0"
+    os.environ["QUERY_CACHE_SEMANTIC_SIZE"] = "0"
+
+    if args.repo:
+        repo = Path(args.repo)
+        queries = None
+    elif args.fixture:
+        repo = Path(args.fixture) / "repo"
+        with open(Path(args.fixture) / "queries.json", "r", encoding="utf-8") as f:
+            queries = json.load(f)
+    else:
+        repo = Path(args.save_fixture or work_dir) / "repo"
+        queries = generate_repo(repo, args.files, args.functions, args.queries, args.seed)
+        if args.save_fixture:
+            with open(Path(args.save_fixture) / "queries.json", "w", encoding="utf-8") as f:
+                json.dump(queries, f, indent=1)
+
+    # Labels are stored relative to the repo; ingestion records absolute paths
+    repo = repo.resolve()
+    for item in queries or []:
+        for relevant in item["relevant"]:
+            relevant["file_path"] = str(repo / relevant["file_path"])
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "params": {
+            "fixture": args.fixture,
+            "repo": args.repo,
+            "files": args.files,
+            "functions": args.functions,
+            "queries": len(queries) if queries is not None else args.queries,
+            "seed": args.seed,
+            "workers": args.workers,
+            "top_k": args.top_k,
+            # Vectors are synthetic everywhere, including --repo runs
+            "embedder": "hashing",
+        },
+        "results": run_benchmark(repo, queries, args.workers, args.top_k,
+                                 num_queries=args.queries, compression=args.compression),
+    }
+    print(json.dumps(report["results"], indent=2))
+    if args.compression:
+        print("Note: compression recall was measured on synthetic HashingEmbedder vectors, "
+              "not the production embedding model.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.compare} (commit {baseline.get('commit')}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare}.")
+
+
+if __name__ == "__main__":
+    main()
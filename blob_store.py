@@ -0,0 +1,316 @@
+import json
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so one writer at a time
+    fcntl = None
+
+import metrics
+from manifest import get_state_dir, write_json_atomic
+
+BLOB_STORE_VERSION = 1
+BLOB_COMPRESSION_LEVEL = int(os.getenv("BLOB_COMPRESSION_LEVEL", 6))
+# Decoded blobs kept in memory, in characters
+BLOB_CACHE_CHARS = int(os.getenv("BLOB_CACHE_CHARS", 32 * 1024 * 1024))
+# Compact the pack once this fraction of it belongs to blobs nothing references
+BLOB_COMPACT_RATIO = float(os.getenv("BLOB_COMPACT_RATIO", 0.5))
+
+# hash -> (offset, compressed length, decoded length, line count)
+BlobEntry = Tuple[int, int, int, int]
+
+
+class BlobStore:
+    """
+    Content-addressed store of code block bodies, keyed by block hash.
+
+    Blobs are zlib-compressed and appended to a single pack file that is
+    read through mmap; an index maps each hash to its offset, length and
+    line count. New blobs are held in memory until save(), so the pack only
+    ever grows by whole, indexed blobs. Decoded blobs are kept in an LRU
+    bounded by BLOB_CACHE_CHARS.
+
+    Readers only trust the indexed size of the pack; bytes past it belong to
+    a writer that is still appending (or crashed). Writers (save, compact)
+    hold an exclusive flock, reload the index if another process changed it
+    and only then drop such a tail.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._pack_path = self.directory / "blobs.pack"
+        self._index_path = self.directory / "blobs.json"
+        self._lock_path = self.directory / "lock"
+        self._lock = threading.RLock()
+        self.entries: Dict[str, BlobEntry] = {}
+        self._pending: Dict[str, Tuple[bytes, int, int]] = {}
+        self._decoded: "OrderedDict[str, str]" = OrderedDict()
+        self._decoded_chars = 0
+        self._size = 0
+        self._mmap: Optional[mmap.mmap] = None
+        # mtime of the index file this instance last loaded or wrote
+        self.index_mtime = 0
+        # Shared, so a compaction cannot swap the pack between index and pack reads
+        with self._flock(exclusive=False):
+            self._load()
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending)
+
+    def _load(self):
+        """Reads the index and maps the pack; never modifies either."""
+        data = {}
+        if self._index_path.exists():
+            try:
+                self.index_mtime = os.stat(self._index_path).st_mtime_ns
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") != BLOB_STORE_VERSION:
+                    data = {}
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable blob index {self._index_path}: {e}")
+                data = {}
+        self._size = data.get("size", 0)
+        self.entries = {block_hash: tuple(entry) for block_hash, entry in data.get("blobs", {}).items()}
+        try:
+            actual = os.path.getsize(self._pack_path)
+        except OSError:
+            actual = 0
+        if actual < self._size:
+            # Pack lost its tail (e.g. copied mid-write): keep what is still there
+            self.entries = {h: e for h, e in self.entries.items() if e[0] + e[1] <= actual}
+            self._size = max((e[0] + e[1] for e in self.entries.values()), default=0)
+        # Bytes past the indexed size are ignored: a writer may be appending them
+        self._remap()
+
+    @contextmanager
+    def _flock(self, exclusive: bool):
+        with open(self._lock_path, "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        """
+        Exclusive write access across processes: reloads the index if another
+        process saved since, and drops pack bytes that no index accounts for.
+        """
+        with self._lock, self._flock(exclusive=True):
+            try:
+                mtime = os.stat(self._index_path).st_mtime_ns
+            except OSError:
+                mtime = 0
+            if mtime != self.index_mtime:
+                self._load()
+                for block_hash in [h for h in self._pending if h in self.entries]:
+                    del self._pending[block_hash]
+            try:
+                if os.path.getsize(self._pack_path) > self._size:
+                    # Left by a writer that crashed before committing its index
+                    with open(self._pack_path, "r+b") as f:
+                        f.truncate(self._size)
+            except OSError:
+                pass
+            yield
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._size:
+            with open(self._pack_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self.entries or block_hash in self._pending
+
+    def __len__(self) -> int:
+        return len(self.entries) + len(self._pending)
+
+    def put(self, block_hash: str, code: str) -> bool:
+        """Stores a block body unless its hash is already present. Returns whether it was new."""
+        with self._lock:
+            if block_hash in self:
+                return False
+            raw = code.encode("utf-8")
+            compressed = zlib.compress(raw, BLOB_COMPRESSION_LEVEL)
+            self._pending[block_hash] = (compressed, len(code), code.count("\n") + 1)
+            metrics.increment("blob_bytes_written_total", len(compressed))
+            return True
+
+    def _compressed(self, block_hash: str) -> Optional[bytes]:
+        pending = self._pending.get(block_hash)
+        if pending is not None:
+            return pending[0]
+        entry = self.entries.get(block_hash)
+        if entry is None or self._mmap is None:
+            return None
+        offset, length = entry[0], entry[1]
+        return self._mmap[offset : offset + length]
+
+    def get(self, block_hash: str) -> Optional[str]:
+        """Decoded block body, or None if the hash is unknown."""
+        with self._lock:
+            text = self._decoded.get(block_hash)
+            if text is not None:
+                self._decoded.move_to_end(block_hash)
+                metrics.increment("blob_cache_hits_total")
+                return text
+            compressed = self._compressed(block_hash)
+            if compressed is None:
+                return None
+            metrics.increment("blob_cache_misses_total")
+            try:
+                text = zlib.decompress(compressed).decode("utf-8")
+            except (zlib.error, UnicodeDecodeError) as e:
+                print(f"Ignoring corrupt blob {block_hash}: {e}")
+                return None
+            self._decoded[block_hash] = text
+            self._decoded_chars += len(text)
+            while self._decoded_chars > BLOB_CACHE_CHARS and len(self._decoded) > 1:
+                _, evicted = self._decoded.popitem(last=False)
+                self._decoded_chars -= len(evicted)
+            return text
+
+    def line_count(self, block_hash: str) -> Optional[int]:
+        """Lines in a block, from the index and without decoding it."""
+        with self._lock:
+            pending = self._pending.get(block_hash)
+            if pending is not None:
+                return pending[2]
+            entry = self.entries.get(block_hash)
+            return entry[3] if entry is not None else None
+
+    def get_lines(self, block_hash: str, start: int = 0, end: Optional[int] = None) -> Optional[str]:
+        """Lines [start, end) of a block (0-based, relative to the block)."""
+        text = self.get(block_hash)
+        if text is None:
+            return None
+        if start <= 0 and (end is None or end >= self.line_count(block_hash)):
+            return text
+        lines = text.split("\n", end) if end is not None else text.split("\n")
+        return "\n".join(lines[max(start, 0) : end])
+
+    def _append(self, blobs: Iterable[Tuple[str, bytes, int, int]]):
+        # _writing() truncated the pack to its indexed size, so appends land at _size
+        with open(self._pack_path, "ab") as f:
+            for block_hash, compressed, chars, lines in blobs:
+                f.write(compressed)
+                self.entries[block_hash] = (self._size, len(compressed), chars, lines)
+                self._size += len(compressed)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_index(self):
+        data = {
+            "version": BLOB_STORE_VERSION,
+            "size": self._size,
+            "blobs": {block_hash: list(entry) for block_hash, entry in self.entries.items()},
+        }
+        write_json_atomic(self._index_path, data)
+        self.index_mtime = os.stat(self._index_path).st_mtime_ns
+
+    def save(self):
+        """Appends pending blobs to the pack, then commits them in the index."""
+        with self._lock:
+            if not self._pending:
+                return
+        with self._writing():
+            if not self._pending:
+                return
+            self._append((h, compressed, chars, lines) for h, (compressed, chars, lines) in self._pending.items())
+            self._pending.clear()
+            self._write_index()
+            self._remap()
+
+    def compact(self, live_hashes: Iterable[str], min_ratio: float = BLOB_COMPACT_RATIO) -> int:
+        """
+        Drops blobs outside `live_hashes` and rewrites the pack without them,
+        if at least `min_ratio` of it is garbage. Returns the bytes reclaimed.
+        """
+        live = set(live_hashes)
+        with self._writing():
+            for block_hash in [h for h in self._pending if h not in live]:
+                del self._pending[block_hash]
+            dead = [h for h in self.entries if h not in live]
+            dead_bytes = sum(self.entries[h][1] for h in dead)
+            if not dead or dead_bytes < self._size * min_ratio:
+                return 0
+
+            kept: List[Tuple[str, bytes, int, int]] = [
+                (h, self._mmap[offset : offset + length], chars, lines)
+                for h, (offset, length, chars, lines) in sorted(self.entries.items(), key=lambda item: item[1][0])
+                if h in live
+            ]
+            temp_path = self._pack_path.with_suffix(".tmp")
+            with open(temp_path, "wb") as f:
+                entries = {}
+                size = 0
+                for h, compressed, chars, lines in kept:
+                    f.write(compressed)
+                    entries[h] = (size, len(compressed), chars, lines)
+                    size += len(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            # Pack first: an index left pointing into the new pack only loses blobs
+            os.replace(temp_path, self._pack_path)
+            self.entries = entries
+            self._size = size
+            self._write_index()
+            self._remap()
+            for h in dead:
+                text = self._decoded.pop(h, None)
+                if text is not None:
+                    self._decoded_chars -= len(text)
+            metrics.increment("blob_bytes_compacted_total", dead_bytes)
+            print(f"Compacted blob store {self.directory}: {len(dead)} blobs, {dead_bytes} bytes reclaimed")
+            return dead_bytes
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "blobs": len(self),
+                "pack_bytes": self._size,
+                "decoded_chars": sum(entry[2] for entry in self.entries.values()),
+                "cached_blobs": len(self._decoded),
+                "cached_chars": self._decoded_chars,
+            }
+
+
+_blob_stores: Dict[str, BlobStore] = {}
+_blob_stores_lock = threading.Lock()
+
+
+def get_blob_store(codebase_name: str) -> BlobStore:
+    """
+    Returns the process-wide blob store for a codebase, reloading it if
+    another process saved a newer index (and there are no unsaved blobs).
+    """
+    directory = get_state_dir(codebase_name) / "blobs"
+    try:
+        mtime = os.stat(directory / "blobs.json").st_mtime_ns
+    except OSError:
+        mtime = 0
+    with _blob_stores_lock:
+        store = _blob_stores.get(codebase_name)
+        if store is None or (store.index_mtime != mtime and not store.dirty):
+            store = BlobStore(directory)
+            _blob_stores[codebase_name] = store
+        return store
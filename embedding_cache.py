@@ -0,0 +1,275 @@
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so one writer at a time
+    fcntl = None
+
+from embeddings import EMBEDDING_DIMENSION
+from manifest import STATE_DIR, write_json_atomic
+
+DEFAULT_CAPACITY = int(os.getenv("ENDEE_EMBED_CACHE_SIZE", 50_000))
+# Fold the slot journal into the index once it has this many entries
+JOURNAL_COMPACT_ENTRIES = 5000
+
+
+def cache_key(model: str, text: str) -> str:
+    """Content-addressed cache key for a (model, text) pair."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Persistent, size-bounded embedding cache.
+
+    Vectors live in a memory-mapped float32 file with `capacity` fixed-size
+    slots; a small JSON index maps cache keys to slots in LRU order. When the
+    cache is full the least recently used slot is overwritten.
+
+    Several processes (parse workers, ingest jobs, the watcher, the app)
+    share one cache directory. Slot assignments are appended to a journal
+    next to the index while holding an exclusive flock, and every lookup
+    first replays what other processes appended under a shared one, so two
+    processes never hand out the same slot or read a slot that was reused.
+    """
+
+    def __init__(self, directory: Path, dimension: int = EMBEDDING_DIMENSION,
+                 capacity: int = DEFAULT_CAPACITY):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dimension = dimension
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+        self._row_bytes = dimension * 4
+        self._index_path = self.directory / "index.json"
+        self._journal_path = self.directory / "journal"
+        self._data_path = self.directory / "vectors.f32"
+        self._lock = threading.Lock()
+        self._lock_file = open(self.directory / "lock", "a+b")
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._owners: Dict[int, str] = {}
+        self._free: List[int] = []
+        # (inode, mtime) of the index last loaded, and how much of the journal was replayed
+        self._index_version: Optional[Tuple[int, int]] = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._loaded = False
+
+        self._open_data()
+
+    def _stat_index(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._index_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load_index(self):
+        self._slots.clear()
+        if self._index_path.exists():
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("dimension") == self.dimension:
+                    for key, slot in data.get("slots", []):
+                        if slot < self.capacity:
+                            self._slots[key] = slot
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable embedding cache index: {e}")
+        self._owners = {slot: key for key, slot in self._slots.items()}
+        self._free = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in self._owners]
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _assign(self, key: str, slot: int):
+        """Points `key` at `slot`, evicting whichever key held it before."""
+        previous = self._owners.get(slot)
+        if previous is not None and previous != key:
+            del self._slots[previous]
+        old_slot = self._slots.get(key)
+        if old_slot is not None and old_slot != slot:
+            del self._owners[old_slot]
+            self._free.append(old_slot)
+        self._slots[key] = slot
+        self._slots.move_to_end(key)
+        self._owners[slot] = key
+
+    def _replay_journal(self):
+        try:
+            with open(self._journal_path, "rb") as f:
+                f.seek(self._journal_offset)
+                tail = f.read()
+        except OSError:
+            return
+        # A line without its newline is an append that never finished
+        complete = tail[: tail.rfind(b"\n") + 1]
+        replayed = set()
+        for line in complete.splitlines():
+            try:
+                key, slot = json.loads(line)
+            except ValueError:
+                continue
+            if slot < self.capacity:
+                self._assign(key, slot)
+                replayed.add(slot)
+            self._journal_entries += 1
+        if replayed:
+            self._free = [slot for slot in self._free if slot not in replayed]
+        self._journal_offset += len(complete)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        """Holds the thread and file locks, with other processes' changes applied."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                version = self._stat_index()
+                if not self._loaded or version != self._index_version:
+                    self._load_index()
+                    self._index_version = version
+                    self._loaded = True
+                self._replay_journal()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _open_data(self):
+        size = self.capacity * self._row_bytes
+        with open(self._data_path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size < size:
+                # Sparse on most filesystems; pages are only allocated when written
+                f.truncate(size)
+        self._file = open(self._data_path, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+    def _read(self, slot: int) -> List[float]:
+        offset = slot * self._row_bytes
+        row = array("f")
+        row.frombytes(self._mm[offset : offset + self._row_bytes])
+        return row.tolist()
+
+    def _write(self, slot: int, vector: Sequence[float]):
+        offset = slot * self._row_bytes
+        self._mm[offset : offset + self._row_bytes] = array("f", vector).tobytes()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Looks up many texts at once; misses come back as None."""
+        keys = [cache_key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = []
+        with self._locked(exclusive=False):
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    self._slots.move_to_end(key)
+                    results.append(self._read(slot))
+        return results
+
+    def put(self, model: str, text: str, vector: Sequence[float]):
+        self.put_many(model, [text], [vector])
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        with self._locked(exclusive=True):
+            lines = []
+            for text, vector in zip(texts, vectors):
+                if len(vector) != self.dimension:
+                    continue
+                key = cache_key(model, text)
+                slot = self._slots.get(key)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                    else:
+                        # Evict the least recently used entry and reuse its slot
+                        slot = next(iter(self._slots.values()))
+                    lines.append(json.dumps([key, slot]) + "\n")
+                self._write(slot, vector)
+                self._assign(key, slot)
+            if lines:
+                self._mm.flush()
+                # Other processes must see the new slots before they allocate any
+                with open(self._journal_path, "ab") as f:
+                    f.truncate(self._journal_offset)
+                    data = "".join(lines).encode("utf-8")
+                    f.write(data)
+                self._journal_offset += len(data)
+                self._journal_entries += len(lines)
+                if self._journal_entries >= JOURNAL_COMPACT_ENTRIES:
+                    self._save_index()
+
+    def _save_index(self):
+        """Writes the index and empties the journal; needs the exclusive lock."""
+        self._mm.flush()
+        write_json_atomic(self._index_path, {"dimension": self.dimension, "slots": list(self._slots.items())})
+        with open(self._journal_path, "wb"):
+            pass
+        self._index_version = self._stat_index()
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def save(self):
+        """Flushes vectors and persists the slot index in this process's LRU order."""
+        with self._locked(exclusive=True):
+            self._save_index()
+
+    def stats(self) -> Dict[str, int]:
+        with self._locked(exclusive=False):
+            entries = len(self._slots)
+        return {
+            "entries": entries,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        self.save()
+        self._mm.close()
+        self._file.close()
+        self._lock_file.close()
+
+
+_caches: Dict[int, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(dimension: int = EMBEDDING_DIMENSION) -> Optional[EmbeddingCache]:
+    """
+    Returns the process-wide embedding cache shared by ingestion and retrieval.
+
+    Set ENDEE_EMBED_CACHE_SIZE=0 to disable caching.
+    """
+    if DEFAULT_CAPACITY <= 0:
+        return None
+    with _caches_lock:
+        cache = _caches.get(dimension)
+        if cache is None:
+            try:
+                cache = EmbeddingCache(STATE_DIR / "embedding_cache" / str(dimension), dimension)
+            except OSError as e:
+                print(f"Embedding cache unavailable: {e}")
+                return None
+            _caches[dimension] = cache
+            atexit.register(cache.save)
+        return cache
@@ -0,0 +1,225 @@
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import metrics
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIMENSION = 768
+
+# text-embedding-004 accepts at most 100 contents per embed_content request.
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1.0
+
+
+class Embedder:
+    """Base class for anything that turns a batch of texts into vectors."""
+
+    model: str = EMBEDDING_MODEL
+    dimension: int = EMBEDDING_DIMENSION
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embeds a batch of texts in a single request, preserving order."""
+        raise NotImplementedError
+
+
+class GeminiEmbedder(Embedder):
+    """Embeds texts with Google GenAI, packing a whole batch into one request."""
+
+    def __init__(self, client, model: str = EMBEDDING_MODEL):
+        self._client = client
+        self.model = model
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        response = self._client.models.embed_content(
+            model=self.model,
+            contents=list(texts)
+        )
+        return [embedding.values for embedding in response.embeddings]
+
+
+class FakeEmbedder(Embedder):
+    """
+    Deterministic offline embedder for benchmarking the batching pipeline.
+
+    Vectors are derived from a hash of the text, so identical texts always get
+    identical vectors. `request_latency` and `per_text_latency` simulate the
+    round-trip and per-item cost of a remote embedding service.
+    """
+
+    def __init__(
+        self,
+        dimension: int = EMBEDDING_DIMENSION,
+        request_latency: float = 0.0,
+        per_text_latency: float = 0.0,
+        failure_rate: float = 0.0,
+    ):
+        self.model = "fake"
+        self.dimension = dimension
+        self.request_latency = request_latency
+        self.per_text_latency = per_text_latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        values = []
+        counter = 0
+        while len(values) < self.dimension:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(b / 127.5 - 1.0 for b in digest)
+            counter += 1
+        return values[: self.dimension]
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        with self._lock:
+            self.requests += 1
+        delay = self.request_latency + self.per_text_latency * len(texts)
+        if delay:
+            time.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("Simulated embedding failure")
+        return [self._vector(text) for text in texts]
+
+
+def _embed_with_retry(
+    embedder: Embedder,
+    texts: Sequence[str],
+    max_retries: int,
+    backoff: float,
+) -> Optional[List[List[float]]]:
+    """
+    Embeds one batch, retrying with exponential backoff and jitter.
+
+    Returns None if every attempt failed.
+    """
+    attempt = 0
+    while True:
+        try:
+            with metrics.span("embed_request"):
+                vectors = embedder.embed_batch(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(
+                    f"Expected {len(texts)} embeddings, got {len(vectors)}"
+                )
+            return vectors
+        except Exception as e:
+            if attempt >= max_retries:
+                print(f"Error generating embeddings for batch of {len(texts)}: {e}")
+                metrics.increment("errors_total", stage="embed")
+                return None
+            metrics.increment("embed_retries_total")
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            print(f"Embedding batch failed ({e}), retrying in {delay:.2f}s...")
+            time.sleep(delay)
+            attempt += 1
+
+
+def embed_texts(
+    texts: Sequence[str],
+    embedder: Embedder,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff: float = DEFAULT_BACKOFF_SECONDS,
+    cache=None,
+) -> List[Optional[List[float]]]:
+    """
+    Embeds many texts with batched, bounded-concurrency requests.
+
+    Texts are packed into batches of `batch_size`, at most `max_concurrency`
+    batches are in flight at once, and the returned vectors are in the same
+    order as `texts`. If an EmbeddingCache is given, cached texts are served
+    from it and only the misses are sent to the embedder. Texts whose batch
+    still failed after all retries get None, so callers can skip and retry them.
+    """
+    if not texts:
+        return []
+
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    if cache is not None:
+        vectors = cache.get_many(embedder.model, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if not missing:
+        return vectors
+
+    # Identical texts only need to be embedded once
+    unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+    batches = [
+        unique_texts[i : i + batch_size] for i in range(0, len(unique_texts), batch_size)
+    ]
+
+    def run(batch):
+        return _embed_with_retry(embedder, batch, max_retries, backoff)
+
+    if len(batches) == 1 or max_concurrency <= 1:
+        results = [run(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+            results = list(pool.map(run, batches))
+
+    embedded: Dict[str, List[float]] = {}
+    for batch, batch_vectors in zip(batches, results):
+        if batch_vectors is None:
+            continue
+        embedded.update(zip(batch, batch_vectors))
+        if cache is not None:
+            cache.put_many(embedder.model, batch, batch_vectors)
+
+    for i in missing:
+        vectors[i] = embedded.get(texts[i])
+    return vectors
+
+
+def benchmark(
+    num_texts: int = 2000,
+    batch_sizes: Sequence[int] = (1, 10, 50, 100),
+    concurrencies: Sequence[int] = (1, 4, 8),
+    request_latency: float = 0.05,
+    per_text_latency: float = 0.0005,
+    embedder: Optional[Embedder] = None,
+):
+    """Measures embedding throughput offline across batch sizes and concurrency."""
+    texts = [f"def func_{i}(x):\n    return x * {i}\n" for i in range(num_texts)]
+    if embedder is None:
+        embedder = FakeEmbedder(
+            request_latency=request_latency,
+            per_text_latency=per_text_latency,
+        )
+
+    print(f"{'batch':>6} {'conc':>5} {'requests':>9} {'seconds':>8} {'texts/s':>9}")
+    for batch_size in batch_sizes:
+        for concurrency in concurrencies:
+            before = getattr(embedder, "requests", 0)
+            start = time.perf_counter()
+            vectors = embed_texts(
+                texts, embedder, batch_size=batch_size, max_concurrency=concurrency
+            )
+            elapsed = time.perf_counter() - start
+            assert len(vectors) == len(texts)
+            requests = getattr(embedder, "requests", 0) - before
+            print(
+                f"{batch_size:>6} {concurrency:>5} {requests:>9} "
+                f"{elapsed:>8.2f} {len(texts) / elapsed:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark batched embedding offline.")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per request")
+    parser.add_argument("--per-text", type=float, default=0.0005, help="Seconds per text")
+    args = parser.parse_args()
+
+    benchmark(
+        num_texts=args.texts,
+        request_latency=args.latency,
+        per_text_latency=args.per_text,
+    )
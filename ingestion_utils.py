@@ -1,12 +1,25 @@
+import mmap
+import multiprocessing
 import os
+import queue
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from endee import Endee
+import metrics
 from treeSitter import TreeSitter
+from embeddings import Embedder, FakeEmbedder, GeminiEmbedder, embed_texts
+from embedding_cache import get_embedding_cache
+from blob_store import get_blob_store
+from manifest import Manifest, codebase_lock, content_hash
+from file_discovery import FileDiscovery
+from lexical_index import LexicalIndex
+from symbol_index import SymbolIndex, extract_file_symbols
+from vector_store import VECTOR_BACKEND, VectorStore, get_vector_store
 
 # Load environment variables
 load_dotenv()
@@ -19,16 +32,51 @@ if not ENDEE_API_KEY:
 if not GEMINI_API_KEY:
     print("WARNING: GEMINI_API_KEY not found in environment variables.")
 
-# Initialize clients
-if GEMINI_API_KEY:
-    genai_client = genai.Client(api_key=GEMINI_API_KEY)
-else:
-    genai_client = None
+# Clients are created on first use: importing this module (Streamlit reruns,
+# every parse worker) should not pay for the SDK imports or connections
+_clients_lock = threading.RLock()
+_genai_client = None
+_endee_client = None
+# Set explicitly (e.g. by the benchmark) to override the default embedder
+embedder: Optional[Embedder] = None
 
-if ENDEE_API_KEY:
-    endee_client = Endee()
-else:
-    endee_client = None
+
+def get_genai_client():
+    """Returns the shared Google GenAI client, or None without GEMINI_API_KEY."""
+    global _genai_client
+    if not GEMINI_API_KEY:
+        return None
+    with _clients_lock:
+        if _genai_client is None:
+            from google import genai
+            _genai_client = genai.Client(api_key=GEMINI_API_KEY)
+        return _genai_client
+
+
+def get_endee_client():
+    """Returns the shared Endee client, or None without ENDEE_API_KEY."""
+    global _endee_client
+    if not ENDEE_API_KEY:
+        return None
+    with _clients_lock:
+        if _endee_client is None:
+            from endee import Endee
+            _endee_client = Endee()
+        return _endee_client
+
+
+def get_embedder() -> Embedder:
+    """Returns the embedder used for ingestion."""
+    global embedder
+    with _clients_lock:
+        if embedder is None:
+            genai_client = get_genai_client()
+            if genai_client:
+                embedder = GeminiEmbedder(genai_client)
+            else:
+                # Offline fallback so ingestion still runs without a key
+                embedder = FakeEmbedder()
+        return embedder
 
 
 EXTENSION_TO_LANGUAGE: Dict[str, str] = {
@@ -45,184 +93,957 @@ EXTENSION_TO_LANGUAGE: Dict[str, str] = {
     ".sh": "bash",
 }
 
+# Endee accepts at most 1000 vectors per upsert call.
+UPSERT_BATCH_SIZE = 256
+# Files at least this large are memory-mapped instead of read into memory
+MMAP_THRESHOLD = 1024 * 1024
+PROGRESS_EVERY = 50
+# Local state is saved at least this often during a long ingest
+CHECKPOINT_SECONDS = float(os.getenv("INGEST_CHECKPOINT_SECONDS", 30))
+
 INTERESTING_NODE_TYPES = {
     "python": {
         "class_definition",
         "function_definition",
         "assignment",
-    }
+    },
+    "javascript": {
+        "class_declaration",
+        "function_declaration",
+        "generator_function_declaration",
+        "method_definition",
+        "lexical_declaration",
+    },
+    "java": {
+        "class_declaration",
+        "interface_declaration",
+        "enum_declaration",
+        "record_declaration",
+        "method_declaration",
+        "constructor_declaration",
+    },
+    "cpp": {
+        "function_definition",
+        "class_specifier",
+        "struct_specifier",
+        "enum_specifier",
+    },
+    "go": {
+        "function_declaration",
+        "method_declaration",
+        "type_declaration",
+    },
+    "rust": {
+        "function_item",
+        "struct_item",
+        "enum_item",
+        "trait_item",
+        "impl_item",
+        "macro_definition",
+    },
+    "zig": {
+        "function_declaration",
+        "variable_declaration",
+        "test_declaration",
+    },
+    "bash": {
+        "function_definition",
+    },
 }
 
-try:
-    from tools import get_excluded_patterns
-except ImportError:
-    def get_excluded_patterns():
-        return [".git", "__pycache__", ".venv", ".DS_Store", "node_modules", "dist", "build"]
-
-def get_embedding(text: str) -> List[float]:
-    """Generates embedding using Google GenAI."""
-    if not genai_client:
-        # Fallback placeholder if no key
-        return [0.1] * 768 
-    
-    try:
-        # User specified model: models/text-embedding-004
-        response = genai_client.models.embed_content(
-            model="models/text-embedding-004",
-            contents=text
-        )
-        return response.embeddings[0].values
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        # Return zero vector or re-raise. For robustness, returning zero-ish vector of likely size (768 for text-embedding-004)
-        return [0.0] * 768
+# Interesting nodes whose members are indexed as blocks of their own
+CONTAINER_NODE_TYPES = {
+    "python": {"class_definition"},
+    "javascript": {"class_declaration"},
+    "java": {"class_declaration", "interface_declaration", "enum_declaration", "record_declaration"},
+    "cpp": {"class_specifier", "struct_specifier"},
+    "rust": {"trait_item", "impl_item"},
+    "zig": {"variable_declaration"},
+}
+
+# C++ specifiers are only definitions when they have a body (`struct S s;` is not)
+BODY_REQUIRED_NODE_TYPES = {"class_specifier", "struct_specifier", "enum_specifier"}
+
+# Size-aware chunking. Token counts are estimated from byte length.
+BYTES_PER_TOKEN = 4
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", 1500))
+# Adjacent sibling blocks smaller than this are merged into one chunk
+MIN_CHUNK_TOKENS = 64
+# Split pieces with less non-whitespace content than this (braces, colons) are dropped
+MIN_PIECE_BYTES = 8
 
 def extract_node_name(node, content_bytes):
     """
     Attempts to extract the name of a node (function/class name).
     """
+    def text(n):
+        return content_bytes[n.start_byte : n.end_byte].decode("utf-8", errors="ignore")
+
     name_node = node.child_by_field_name("name")
     if name_node:
-        return content_bytes[name_node.start_byte : name_node.end_byte].decode("utf-8")
+        return text(name_node)
+
+    # C/C++ functions keep their name at the end of the declarator chain
+    declarator = node.child_by_field_name("declarator")
+    while declarator is not None:
+        inner = declarator.child_by_field_name("declarator")
+        if inner is None:
+            return text(declarator)
+        declarator = inner
+
+    # Rust impl blocks are named after the type they implement
+    if node.type == "impl_item":
+        impl_type = node.child_by_field_name("type")
+        if impl_type:
+            return text(impl_type)
     
     # Fallback: look for identifier
     for i in range(node.child_count):
         child = node.child(i)
-        if child.type == "identifier":
-             return content_bytes[child.start_byte : child.end_byte].decode("utf-8")
+        if child.type in ("identifier", "type_identifier", "word"):
+             return text(child)
+
+    # Wrappers such as Go type_declaration or JS lexical_declaration
+    for child in node.named_children:
+        name_node = child.child_by_field_name("name")
+        if name_node:
+            return text(name_node)
     
     return "anonymous"
 
-def ingest_folder(directory: str, codebase_name: str):
+def source_file_discovery(directory: str) -> FileDiscovery:
+    """File discovery for ingestion: supported languages only, .gitignore-aware."""
+    return FileDiscovery(directory, extensions=EXTENSION_TO_LANGUAGE)
+
+def _iter_source_files(directory: str, workers: Optional[int] = None) -> List[str]:
+    """Supported source files under a directory, honouring exclusions."""
+    return source_file_discovery(directory).walk(workers)
+
+def is_source_file(file_path: str, directory: str) -> bool:
+    """
+    Whether _iter_source_files would yield `file_path` when walking `directory`.
+    Used for single paths, e.g. filesystem events.
+    """
+    return source_file_discovery(directory).accepts(file_path)
+
+def _get_or_create_index(codebase_name: str) -> Optional[VectorStore]:
+    """Returns the vector store for a codebase, creating the index if needed."""
+    endee_client = get_endee_client() if VECTOR_BACKEND != "local" else None
+    if VECTOR_BACKEND != "local" and not endee_client:
+        print("Endee client not initialized (missing key?). Skipping upsert.")
+        return None
+    return get_vector_store(codebase_name, client=endee_client, create=True)
+
+def _get_mp_context():
+    """
+    Returns the multiprocessing context for the parse pool.
+
+    Forking a process that already runs threads (Streamlit, the I/O stage) is
+    unsafe, so prefer a forkserver that has this module preloaded.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+def delete_blocks(index: VectorStore, block_ids: List[str]) -> Tuple[int, List[str]]:
+    """
+    Deletes vectors by ID from the vector store. Returns how many were
+    removed and the IDs that could not be deleted.
+    """
+    if not block_ids:
+        return 0, []
+    return index.delete(block_ids)
+
+def make_block_id(file_path: str, name: str, block_hash: str, start_line: Optional[int] = None) -> str:
+    """
+    Vector ID of a block. A digest rather than the readable key, because
+    the Endee API puts IDs into URL paths and file paths contain slashes.
+    """
+    key = f"{file_path}::{name}::{block_hash}"
+    if start_line is not None:
+        key = f"{key}::{start_line}"
+    return content_hash(key.encode("utf-8"))
+
+def _is_legacy_block_id(block_id: str) -> bool:
+    # IDs used to be "<file_path>::<name>::<hash12>", which can't be deleted by ID
+    return "::" in block_id
+
+def clear_legacy_blocks(manifest: Manifest, index: VectorStore, file_path: str) -> bool:
+    """
+    Deletes every vector of a file still recorded under legacy block IDs,
+    so the next diff re-upserts it in full under the current IDs. Returns
+    False if the vectors could not be deleted.
+    """
+    entry = manifest.get(file_path) or {}
+    if not any(_is_legacy_block_id(block_id) for block_id in entry.get("blocks", {})):
+        return True
+    if not index.delete_file(file_path):
+        return False
+    manifest.mark_failed(file_path, {})
+    return True
+
+def remove_manifest_file(manifest: Manifest, index: VectorStore, file_path: str) -> int:
+    """
+    Deletes the vectors of a file that is gone and forgets it. Blocks that
+    could not be deleted stay in the manifest so the next run retries them.
+    """
+    if not clear_legacy_blocks(manifest, index, file_path):
+        print(f"Could not delete the blocks of {file_path}; they will be retried next run.")
+        return 0
+    block_ids = manifest.remove(file_path)
+    deleted, failed = delete_blocks(index, block_ids)
+    if failed:
+        print(f"Could not delete {len(failed)} blocks of {file_path}; they will be retried next run.")
+        manifest.mark_failed(file_path, dict.fromkeys(failed))
+    return deleted
+
+def _plan_file_update(manifest: Manifest, file_path: str, file_hash: str,
+                      chunks: List[Dict[str, Any]], force: bool = False):
+    """
+    Diffs a freshly extracted file against the manifest.
+
+    Returns None if the file content is unchanged, otherwise
+    (chunks_to_upsert, stale_block_ids, blocks) where blocks maps every
+    current block ID to its code hash.
+    """
+    entry = manifest.get(file_path) or {}
+    if not force and entry.get("hash") == file_hash:
+        return None
+
+    old_blocks = entry.get("blocks", {})
+    blocks = {chunk["id"]: chunk["hash"] for chunk in chunks}
+    if force:
+        to_upsert = chunks
+    else:
+        # Block IDs embed the code hash, so a known ID means identical code
+        to_upsert = [chunk for chunk in chunks if chunk["id"] not in old_blocks]
+    stale_ids = [block_id for block_id in old_blocks if block_id not in blocks]
+    return to_upsert, stale_ids, blocks
+
+def ingest_folder(directory: str, codebase_name: str, workers: Optional[int] = None,
+                  force: bool = False,
+                  progress: Optional[Callable[[Dict[str, Any], int], None]] = None,
+                  cancel: Optional[threading.Event] = None,
+                  skip_files: Optional[Set[str]] = None,
+                  checkpoint: Optional[Callable[[List[str]], None]] = None) -> Dict[str, Any]:
     """
     Recursively ingests a folder.
+
+    Parsing and block extraction run in a pool of `workers` processes
+    (default: INGEST_WORKERS or the CPU count). Extracted chunks are handed to
+    an I/O thread that embeds and upserts them in batches, so parsing and
+    network calls overlap. Returns throughput stats for the run.
+
+    Files are found with FileDiscovery, which honours nested .gitignore
+    files and skips oversized and binary files before they are read.
+
+    Ingestion is incremental: a per-codebase Manifest records each file's
+    content hash and block IDs, so unchanged files are skipped, only changed
+    blocks are re-embedded, and blocks from edited or deleted files are
+    removed from the index. Pass force=True to re-embed everything. A local
+    BM25 LexicalIndex and a SymbolIndex (definitions, references, imports and
+    call edges) are kept in sync next to the manifest.
+
+    Memory stays bounded: only a fixed window of files is in flight in the
+    pool, the hand-off queue is bounded, and chunks are embedded and upserted
+    in UPSERT_BATCH_SIZE batches as soon as enough have accumulated.
+
+    The codebase lock is held for the whole run, so a watcher on the same
+    codebase applies its batches before or after, never in between.
     """
+    with codebase_lock(codebase_name):
+        return _ingest_folder(directory, codebase_name, workers, force, progress, cancel,
+                              skip_files, checkpoint)
+
+def _ingest_folder(directory: str, codebase_name: str, workers: Optional[int] = None,
+                   force: bool = False,
+                   progress: Optional[Callable[[Dict[str, Any], int], None]] = None,
+                   cancel: Optional[threading.Event] = None,
+                   skip_files: Optional[Set[str]] = None,
+                   checkpoint: Optional[Callable[[List[str]], None]] = None) -> Dict[str, Any]:
+    """ingest_folder() with the codebase lock held."""
+    directory = os.path.abspath(directory)
     print(f"Starting ingestion for folder: {directory}")
-    root_path = Path(directory)
-    excluded_patterns = set(get_excluded_patterns())
-    
-    for root, dirs, files in os.walk(directory):
-        # Modify dirs in-place to skip excluded
-        dirs[:] = [d for d in dirs if d not in excluded_patterns and not d.startswith('.')]
-        
-        for file in files:
-            if file in excluded_patterns or file.startswith('.'):
+    if workers is None:
+        workers = int(os.getenv("INGEST_WORKERS", 0)) or os.cpu_count() or 1
+
+    manifest = Manifest.load(codebase_name)
+    lexical = LexicalIndex.load(codebase_name)
+    symbols = SymbolIndex.load(codebase_name)
+    blobs = get_blob_store(codebase_name)
+    # Files missing from the local indexes must be parsed even if unchanged
+    indexed_files = lexical.files() & set(symbols.files)
+    discovery = source_file_discovery(directory)
+    file_paths = discovery.walk()
+    stats = {
+        "files": 0,
+        "unchanged_files": 0,
+        "failed_files": 0,
+        "chunks": 0,
+        "upserted": 0,
+        "deleted": 0,
+        "skipped_files": 0,
+        # Files the discovery walk left out: ignored, oversized or binary
+        "discovery_skipped": dict(discovery.skipped),
+        "workers": workers,
+        "cancelled": False,
+    }
+    start = time.perf_counter()
+    skip_files = skip_files or set()
+    # Files whose vectors and manifest entry are final since the last checkpoint
+    committed: List[str] = []
+    committed_lock = threading.Lock()
+    last_checkpoint = start
+
+    index = _get_or_create_index(codebase_name)
+    if not index:
+        print("No index available; the manifest will not be updated.")
+
+    # Cheap mtime/size check first; only changed files get parsed
+    to_parse = []
+    for file_path in file_paths:
+        if file_path in skip_files:
+            stats["files"] += 1
+            stats["skipped_files"] += 1
+            continue
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        if index and not clear_legacy_blocks(manifest, index, file_path):
+            print(f"Could not clear the old blocks of {file_path}; it will be retried next run.")
+            stats["files"] += 1
+            stats["failed_files"] += 1
+            continue
+        if not force and manifest.is_unchanged(file_path, stat) and file_path in indexed_files:
+            stats["files"] += 1
+            stats["unchanged_files"] += 1
+        else:
+            to_parse.append((file_path, stat))
+
+    update_queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=workers * 4)
+
+    def consume():
+        """I/O stage: drains file updates and flushes them in fixed-size batches."""
+        pending_chunks: List[Dict[str, Any]] = []
+        # file_path -> [chunks not yet flushed, (file_hash, stat, stale_ids, blocks, old_blocks)]
+        waiting: Dict[str, list] = {}
+        failed = set()
+
+        def commit_ready():
+            # New blocks are live, so stale ones can go and the manifest can advance
+            for file_path in [path for path, (left, _) in waiting.items() if left == 0]:
+                _, (file_hash, stat, stale_ids, blocks, old_blocks) = waiting.pop(file_path)
+                if file_path in failed:
+                    print(f"Some upserts failed for {file_path}; it will be retried next run.")
+                    stats["failed_files"] += 1
+                    manifest.mark_failed(file_path, old_blocks)
+                    continue
+                deleted, failed_deletes = delete_blocks(index, stale_ids)
+                stats["deleted"] += deleted
+                if failed_deletes:
+                    print(f"Some deletes failed for {file_path}; they will be retried next run.")
+                    stats["failed_files"] += 1
+                    retry = {block_id: old_blocks.get(block_id) for block_id in failed_deletes}
+                    manifest.mark_failed(file_path, {**blocks, **retry})
+                    continue
+                manifest.update(file_path, file_hash, stat, blocks)
+                with committed_lock:
+                    committed.append(file_path)
+
+        def flush(batch):
+            upserted = upsert_chunks(batch, index)
+            stats["upserted"] += upserted
+            if upserted != len(batch):
+                failed.update(chunk["file_path"] for chunk in batch)
+            for chunk in batch:
+                waiting[chunk["file_path"]][0] -= 1
+
+        while True:
+            item = update_queue.get()
+            if item is None:
+                break
+            file_path, file_hash, stat, to_upsert, stale_ids, blocks, old_blocks = item
+            waiting[file_path] = [len(to_upsert), (file_hash, stat, stale_ids, blocks, old_blocks)]
+            pending_chunks.extend(to_upsert)
+            while len(pending_chunks) >= UPSERT_BATCH_SIZE:
+                flush(pending_chunks[:UPSERT_BATCH_SIZE])
+                pending_chunks = pending_chunks[UPSERT_BATCH_SIZE:]
+            commit_ready()
+        if pending_chunks:
+            flush(pending_chunks)
+        commit_ready()
+
+    def handle(file_path, stat, result):
+        stats["files"] += 1
+        if result is None:
+            stats["failed_files"] += 1
+            return
+        file_hash, chunks, file_symbols = result
+        stats["chunks"] += len(chunks)
+        for chunk in chunks:
+            blobs.put(chunk["hash"], chunk["code"])
+        lexical.update_file(file_path, chunks)
+        symbols.update_file(file_path, file_symbols)
+        plan = _plan_file_update(manifest, file_path, file_hash, chunks, force)
+        if plan is None:
+            stats["unchanged_files"] += 1
+            manifest.touch(file_path, stat)
+            with committed_lock:
+                committed.append(file_path)
+            return
+        if index:
+            to_upsert, stale_ids, blocks = plan
+            old_blocks = (manifest.get(file_path) or {}).get("blocks", {})
+            update_queue.put((file_path, file_hash, stat, to_upsert, stale_ids, blocks, old_blocks))
+
+    consumer = threading.Thread(target=consume, name="ingest-io", daemon=True)
+    consumer.start()
+
+    def report():
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        metrics.set_gauge("ingest_files_total", len(file_paths), codebase=codebase_name)
+        metrics.set_gauge("ingest_files_done", stats["files"], codebase=codebase_name)
+        metrics.set_gauge("ingest_chunks", stats["chunks"], codebase=codebase_name)
+        metrics.set_gauge("ingest_upserted", stats["upserted"], codebase=codebase_name)
+        if progress:
+            progress(stats, len(file_paths))
+        print(
+            f"Progress: {stats['files']}/{len(file_paths)} files "
+            f"({stats['files'] / elapsed:.1f} files/s), "
+            f"{stats['chunks']} chunks ({stats['chunks'] / elapsed:.1f} chunks/s), "
+            f"{stats['upserted']} upserted"
+        )
+
+    def save_checkpoint():
+        nonlocal last_checkpoint
+        # Files committed after this point may not have their vectors in the
+        # index save below, so neither the manifest nor `done` include them
+        with committed_lock:
+            done = committed[:]
+            committed.clear()
+            files = manifest.snapshot()
+        # Code first, so every block the indexes point at can be hydrated
+        blobs.save()
+        if index:
+            index.save()
+            manifest.save(files)
+        lexical.save()
+        symbols.save()
+        if checkpoint:
+            checkpoint(done)
+        last_checkpoint = time.perf_counter()
+
+    def after_file():
+        if stats["files"] % PROGRESS_EVERY == 0:
+            report()
+        if time.perf_counter() - last_checkpoint >= CHECKPOINT_SECONDS:
+            save_checkpoint()
+
+    def cancelled() -> bool:
+        return cancel is not None and cancel.is_set()
+
+    try:
+        if workers <= 1 or len(to_parse) <= 1:
+            for file_path, stat in to_parse:
+                if cancelled():
+                    break
+                handle(file_path, stat, _safe_extract_file(file_path))
+                after_file()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_get_mp_context()) as pool:
+                # Keep a fixed window of files in flight so finished results
+                # cannot pile up faster than the I/O stage drains them
+                pending = iter(to_parse)
+                in_flight = {}
+
+                def submit_next():
+                    item = None if cancelled() else next(pending, None)
+                    if item is not None:
+                        in_flight[pool.submit(_extract_in_worker, item[0])] = item
+
+                for _ in range(workers * 2):
+                    submit_next()
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_path, stat = in_flight.pop(future)
+                        result, worker_metrics = future.result()
+                        metrics.registry.merge(worker_metrics)
+                        handle(file_path, stat, result)
+                        submit_next()
+                        after_file()
+    finally:
+        update_queue.put(None)
+        consumer.join()
+
+    stats["cancelled"] = cancelled()
+    present = set(file_paths)
+    for file_path in lexical.files() | set(symbols.files):
+        if file_path.startswith(os.path.join(directory, "")) and file_path not in present:
+            lexical.remove_file(file_path)
+            symbols.remove_file(file_path)
+
+    if index:
+        # Drop everything that belonged to files which no longer exist or are now ignored
+        for file_path in manifest.missing_files(directory, file_paths):
+            stats["deleted"] += remove_manifest_file(manifest, index, file_path)
+    if not stats["cancelled"]:
+        blobs.compact(doc["hash"] for doc in lexical.docs.values())
+    save_checkpoint()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    stats["seconds"] = elapsed
+    stats["files_per_sec"] = stats["files"] / elapsed
+    stats["chunks_per_sec"] = stats["chunks"] / elapsed
+    report()
+    metrics.observe("ingest_seconds", elapsed, codebase=codebase_name)
+    metrics.registry.write_file()
+    print(
+        f"{'Cancelled' if stats['cancelled'] else 'Finished'} ingestion for folder: {directory} "
+        f"in {elapsed:.2f}s ({stats['unchanged_files']} unchanged files, "
+        f"{stats['deleted']} stale blocks removed)"
+    )
+    return stats
+
+def _safe_extract_file(file_path: str):
+    """Returns extract_file(file_path), or None instead of raising."""
+    try:
+        return extract_file(file_path)
+    except Exception as e:
+        print(f"Failed to ingest file {file_path}: {e}")
+        metrics.increment("errors_total", stage="extract")
+        return None
+
+def _extract_in_worker(file_path: str):
+    """Process-pool entry point; also hands the worker's metrics back to the parent."""
+    result = _safe_extract_file(file_path)
+    return result, metrics.registry.drain()
+
+@contextmanager
+def open_source(file_path: str):
+    """
+    Reads a source file once and yields its bytes.
+
+    Files of MMAP_THRESHOLD bytes or more are memory-mapped instead of read,
+    so the parser and the block extractor share one buffer backed by the page
+    cache rather than a private copy.
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield content
+            finally:
+                content.close()
+        else:
+            yield f.read()
+
+def _split_node(node, content, budget_bytes: int, skip_types=frozenset()):
+    """
+    Splits an oversized node into (start_byte, end_byte, start_line) pieces.
+
+    Consecutive children are packed greedily into pieces of at most
+    `budget_bytes`, so cuts only ever fall on syntax boundaries. Children that
+    are still too large are split recursively; children of `skip_types` are
+    left out (they are indexed separately) and act as cut points.
+    """
+    pieces = []
+    current = None
+
+    def close():
+        nonlocal current
+        if current is not None:
+            pieces.append(tuple(current))
+            current = None
+
+    for child in node.children:
+        if child.type in skip_types:
+            close()
+            continue
+
+        if child.end_byte - child.start_byte > budget_bytes:
+            sub_pieces = (
+                _split_node(child, content, budget_bytes, skip_types)
+                if child.child_count
+                else [(child.start_byte, child.end_byte, child.start_point[0])]
+            )
+            # Keep a short header (e.g. a signature) with the first piece of the body
+            if current is not None and sub_pieces and sub_pieces[0][1] - current[0] <= budget_bytes:
+                first = sub_pieces[0]
+                sub_pieces[0] = (current[0], first[1], current[2])
+                current = None
+            close()
+            pieces.extend(sub_pieces)
+            continue
+
+        if current is not None and child.end_byte - current[0] > budget_bytes:
+            close()
+        if current is None:
+            current = [child.start_byte, child.end_byte, child.start_point[0]]
+        else:
+            current[1] = child.end_byte
+    close()
+
+    return [
+        piece for piece in pieces
+        if len(bytes(content[piece[0] : piece[1]]).strip()) >= MIN_PIECE_BYTES
+    ]
+
+def _merge_small_blocks(blocks, budget_bytes: int):
+    """
+    Merges runs of small, adjacent sibling blocks of the same type into one.
+
+    Blocks are (start_byte, end_byte, start_line, name, type, parent_id) tuples;
+    split pieces carry parent_id None and are never merged.
+    """
+    min_bytes = MIN_CHUNK_TOKENS * BYTES_PER_TOKEN
+    merged = []
+    names = []
+    for block in blocks:
+        start, end, _, name, node_type, parent_id = block
+        if merged:
+            prev = merged[-1]
+            if (
+                parent_id is not None
+                and prev[5] == parent_id
+                and prev[4] == node_type
+                and prev[1] - prev[0] < min_bytes
+                and end - start < min_bytes
+                and end - prev[0] <= budget_bytes
+            ):
+                names[-1].append(name)
+                merged[-1] = (prev[0], end, prev[2], prev[3], node_type, parent_id)
                 continue
-            
-            file_path = Path(root) / file
-            # Simple extension check
-            if file_path.suffix.lower() in EXTENSION_TO_LANGUAGE:
-                try:
-                    ingest_file(str(file_path), codebase_name)
-                except Exception as e:
-                    print(f"Failed to ingest file {file_path}: {e}")
+        merged.append(block)
+        names.append([name])
+
+    result = []
+    for block, block_names in zip(merged, names):
+        if len(block_names) > 1:
+            block = block[:3] + (", ".join(block_names),) + block[4:]
+        result.append(block)
+    return result
 
-def ingest_file(file_path: str, codebase_name: str):
+def _collect_blocks(file_path: str, content):
     """
-    Parses and ingests a single file.
+    Parses a file's content and returns (tree, collected_blocks).
+
+    Each block is a (start_byte, end_byte, start_line, name, type, parent_id)
+    tuple. Blocks come from the per-language INTERESTING_NODE_TYPES; those over
+    CHUNK_TOKEN_BUDGET are split at syntax boundaries and small adjacent
+    siblings are merged, so chunks stay within what the embedder can use.
     """
     path_obj = Path(file_path)
-    extension = path_obj.suffix.lower()
-    
-    if extension not in EXTENSION_TO_LANGUAGE:
-        # Skip unsupported
-        return
-    
-    language = EXTENSION_TO_LANGUAGE[extension]
-    
-    # Read content
-    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        content_str = f.read()
-    content_bytes = content_str.encode("utf-8")
+    language = EXTENSION_TO_LANGUAGE[path_obj.suffix.lower()]
+    budget_bytes = CHUNK_TOKEN_BUDGET * BYTES_PER_TOKEN
 
     # Parse
     parser = TreeSitter(language=language)
-    tree = parser.parse(file_path)
+    tree = parser.parse_bytes(content)
     root_node = tree.root_node
-    
-    nodes_to_index = []
-    
-    
-    cursor = tree.walk()
-    
-    # We will collect all nodes of interest
-    stack = [root_node]
-    
+
     target_types = INTERESTING_NODE_TYPES.get(language, set())
-    
-    collected_blocks = [] # List of (node, name, type)
+    container_types = CONTAINER_NODE_TYPES.get(language, set())
+
+    collected_blocks = []
+
+    def add(node, name, node_type, skip_types=frozenset()):
+        if node.end_byte - node.start_byte <= budget_bytes:
+            # Siblings are compared by their enclosing scope, looking through
+            # single-child wrappers such as Python's expression_statement
+            parent = node.parent
+            while parent is not None and parent.parent is not None and parent.named_child_count == 1:
+                parent = parent.parent
+            parent_id = parent.id if parent is not None else None
+            collected_blocks.append(
+                (node.start_byte, node.end_byte, node.start_point[0], name, node_type, parent_id)
+            )
+            return
+        for start, end, line in _split_node(node, content, budget_bytes, skip_types):
+            collected_blocks.append((start, end, line, name, node_type, None))
 
     def traverse(node):
-        if node.type in target_types:
-            name = extract_node_name(node, content_bytes)
-            collected_blocks.append((node, name, node.type))
-            if node.type == "class_definition":
+        if node.type in target_types and (
+            node.type not in BODY_REQUIRED_NODE_TYPES or node.child_by_field_name("body")
+        ):
+            name = extract_node_name(node, content)
+            if node.type in container_types:
+                # An oversized container keeps only what its members don't cover
+                add(node, name, node.type, skip_types=target_types)
                 # Recurse to find methods
                 for i in range(node.child_count):
                     traverse(node.child(i))
-            return 
-        
+            else:
+                add(node, name, node.type)
+            return
+
         # Recurse
         for i in range(node.child_count):
             traverse(node.child(i))
 
-    if target_types:
-        traverse(root_node)
-    else:
-        # Fallback: Treat whole file as one block
-        collected_blocks.append((root_node, path_obj.name, "file"))
+    with metrics.span("extract_blocks", language=language):
+        if target_types:
+            traverse(root_node)
+        if not collected_blocks:
+            # Fallback: Treat whole file as one block (split if it is too large)
+            add(root_node, path_obj.name, "file")
+        collected_blocks = _merge_small_blocks(collected_blocks, budget_bytes)
+    metrics.increment("blocks_extracted_total", len(collected_blocks), language=language)
+    return tree, collected_blocks
 
-    if not endee_client:
-        print("Endee client not initialized (missing key?). Skipping upsert.")
-        return
+def _iter_chunks(file_path: str, content, collected_blocks) -> Iterator[Dict[str, Any]]:
+    """Lazily turns parsed blocks into plain, picklable chunk dicts."""
+    extension = Path(file_path).suffix.lower()
+    seen_ids = set()
+    for start_byte, end_byte, start_line, name, node_type, _ in collected_blocks:
+        code_bytes = content[start_byte:end_byte]
+        block_hash = content_hash(code_bytes)
+        # IDs are keyed by code hash rather than line number, so moving a
+        # block does not orphan its vector
+        node_id = make_block_id(file_path, name, block_hash)
+        if node_id in seen_ids:
+            node_id = make_block_id(file_path, name, block_hash, start_line)
+        seen_ids.add(node_id)
+        code_str = code_bytes.decode("utf-8", errors="ignore")
+        yield {
+            "id": node_id,
+            "hash": block_hash,
+            "code": code_str,
+            "name": name,
+            "type": node_type,
+            "extension": extension,
+            "file_path": str(file_path),
+            "start_byte": start_byte,
+            "end_byte": end_byte,
+            # 1-based, inclusive
+            "start_line": start_line + 1,
+            "end_line": start_line + 1 + code_str.count("\n"),
+        }
 
-    index = None
-    try:
-        index = endee_client.get_index(codebase_name)
-    except Exception:
-        print(f"Index '{codebase_name}' not found. Creating it...")
-        try:
-            index = endee_client.create_index(codebase_name, dimension=768, space_type="cosine")
-        except Exception as create_error:
-            print(f"Failed to create index: {create_error}")
-            return
-            
+def extract_chunks(file_path: str) -> List[Dict[str, Any]]:
+    """
+    Parses a file and extracts its indexable chunks without any network I/O.
+
+    This is the CPU-bound half of ingestion and is safe to run in a worker process.
+    """
+    return extract_file(file_path)[1]
+
+def extract_file(file_path: str):
+    """
+    Like extract_chunks, but returns (file_hash, chunks, symbols) where
+    symbols is the file's record for the SymbolIndex.
+    """
+    if Path(file_path).suffix.lower() not in EXTENSION_TO_LANGUAGE:
+        return None, [], None
+    with open_source(file_path) as content:
+        tree, collected_blocks = _collect_blocks(file_path, content)
+        chunks = list(_iter_chunks(file_path, content, collected_blocks))
+        return content_hash(content), chunks, _extract_symbols(file_path, tree, content)
+
+def _extract_symbols(file_path: str, tree, content) -> Dict[str, Any]:
+    """Records definitions, references, imports and calls from an already-parsed tree."""
+    language = EXTENSION_TO_LANGUAGE[Path(file_path).suffix.lower()]
+    with metrics.span("extract_symbols", language=language):
+        return extract_file_symbols(
+            tree.root_node,
+            content,
+            language,
+            INTERESTING_NODE_TYPES.get(language, set()),
+            CONTAINER_NODE_TYPES.get(language, set()),
+            extract_node_name,
+        )
+
+def upsert_chunks(chunks: Iterable[Dict[str, Any]], index: Optional[VectorStore]) -> int:
+    """
+    Embeds chunks and upserts them into the vector store.
+
+    Chunks are consumed lazily and flushed in UPSERT_BATCH_SIZE batches, so
+    only one batch of code strings and vectors is held at a time. Returns the
+    number of chunks upserted.
+    """
     if not index:
-         return
+        return 0
 
-    batch = []
-    for node, name, node_type in collected_blocks:
-        code_bytes = content_bytes[node.start_byte : node.end_byte]
-        code_str = code_bytes.decode("utf-8")
-        
-        # Generate embedding
-        vector = get_embedding(code_str)
-        
-        # Construct ID
-        node_id = f"{file_path}::{name}::{node.start_point[0]}"
-        
-        batch.append({
-            "id": node_id,
-            "vector": vector,
-            "meta": {
-                "code": code_str,
-                "name": name,
-                "type": node_type
-            },
-            "filter": {
-                "extension": extension,
-                "file_path": str(file_path),
-                "node_type": node_type,
-                "name": name
-            }
-        })
-        print(f"Prepared ingestion for: {node_id} ({node_type})")
-
-    if batch:
+    chunks = iter(chunks)
+    upserted = 0
+    while True:
+        part = list(islice(chunks, UPSERT_BATCH_SIZE))
+        if not part:
+            break
+
+        # Generate embeddings in batched, concurrent requests
+        with metrics.span("embed"):
+            vectors = embed_texts(
+                [chunk["code"] for chunk in part], get_embedder(), cache=get_embedding_cache()
+            )
+
+        batch = []
+        for chunk, vector in zip(part, vectors):
+            if vector is None:
+                # Not written, so the caller sees a short count and retries the file
+                continue
+            batch.append({
+                "id": chunk["id"],
+                "vector": vector,
+                # Code lives in the local blob store, keyed by hash
+                "meta": {
+                    "hash": chunk["hash"],
+                    "name": chunk["name"],
+                    "type": chunk["type"],
+                    "start_line": chunk["start_line"],
+                    "end_line": chunk["end_line"]
+                },
+                "filter": {
+                    "extension": chunk["extension"],
+                    "file_path": chunk["file_path"],
+                    "node_type": chunk["type"],
+                    "name": chunk["name"]
+                }
+            })
+
+        if len(batch) < len(part):
+            print(f"Skipping {len(part) - len(batch)} chunks whose embeddings failed")
+        if not batch:
+            continue
         try:
-            index.upsert(batch)
-            print(f"Successfully upserted {len(batch)} items for {file_path}")
+            with metrics.span("upsert"):
+                index.upsert(batch)
+            upserted += len(batch)
+            metrics.increment("chunks_upserted_total", len(batch))
         except Exception as e:
-            print(f"Error upserting to Endee: {e}")
+            print(f"Error upserting vectors: {e}")
+    return upserted
+
+def ingest_file(file_path: str, codebase_name: str, manifest: Optional[Manifest] = None,
+                force: bool = False, lexical: Optional[LexicalIndex] = None,
+                symbols: Optional[SymbolIndex] = None):
+    """
+    Parses and ingests a single file.
+
+    Only blocks whose code changed since the last ingest are re-embedded, and
+    blocks that disappeared from the file are deleted from the index. The
+    file is read once and its chunks are streamed to the index in fixed-size
+    batches. Returns the syntax tree, or None if the file was unchanged.
+    """
+    file_path = os.path.abspath(file_path)
+    if Path(file_path).suffix.lower() not in EXTENSION_TO_LANGUAGE:
+        # Skip unsupported
+        return
+
+    index = _get_or_create_index(codebase_name)
+    if not index:
+         return
+
+    save_manifest = manifest is None
+    if manifest is None:
+        manifest = Manifest.load(codebase_name)
+    save_lexical = lexical is None
+    if lexical is None:
+        lexical = LexicalIndex.load(codebase_name)
+    save_symbols = symbols is None
+    if symbols is None:
+        symbols = SymbolIndex.load(codebase_name)
+    blobs = get_blob_store(codebase_name)
+
+    if not clear_legacy_blocks(manifest, index, file_path):
+        print(f"Could not clear the old blocks of {file_path}; it will be retried next run.")
+        return
+    stat = os.stat(file_path)
+    entry = manifest.get(file_path) or {}
+    old_blocks = entry.get("blocks", {})
+    tree = None
+
+    with open_source(file_path) as content:
+        file_hash = content_hash(content)
+        if (
+            not force
+            and entry.get("hash") == file_hash
+            and file_path in lexical.files()
+            and file_path in symbols.files
+        ):
+            manifest.touch(file_path, stat)
+        else:
+            tree, collected_blocks = _collect_blocks(file_path, content)
+            symbols.update_file(file_path, _extract_symbols(file_path, tree, content))
+            blocks: Dict[str, str] = {}
+            expected = 0
+            lexical.remove_file(file_path)
+
+            def changed_chunks():
+                nonlocal expected
+                for chunk in _iter_chunks(file_path, content, collected_blocks):
+                    blocks[chunk["id"]] = chunk["hash"]
+                    blobs.put(chunk["hash"], chunk["code"])
+                    lexical.add_chunk(chunk)
+                    # Block IDs embed the code hash, so a known ID means identical code
+                    if force or chunk["id"] not in old_blocks:
+                        expected += 1
+                        print(f"Prepared ingestion for: {file_path}::{chunk['name']} ({chunk['type']})")
+                        yield chunk
+
+            upserted = upsert_chunks(changed_chunks(), index)
+            if upserted == expected:
+                if upserted:
+                    print(f"Successfully upserted {upserted} items for {file_path}")
+                _, failed = delete_blocks(index, [block_id for block_id in old_blocks if block_id not in blocks])
+                if failed:
+                    print(f"Some deletes failed for {file_path}; they will be retried next run.")
+                    retry = {block_id: old_blocks[block_id] for block_id in failed}
+                    manifest.mark_failed(file_path, {**blocks, **retry})
+                else:
+                    manifest.update(file_path, file_hash, stat, blocks)
+            else:
+                print(f"Some upserts failed for {file_path}; it will be retried next run.")
+                manifest.mark_failed(file_path, old_blocks)
+
+    if save_lexical or save_manifest:
+        # Callers batching several files save the shared blob store themselves
+        blobs.save()
+    if save_manifest:
+        index.save()
+        manifest.save()
+    if save_lexical:
+        lexical.save()
+    if save_symbols:
+        symbols.save()
 
     return tree
+
+def remove_file(file_path: str, codebase_name: str, manifest: Optional[Manifest] = None,
+                lexical: Optional[LexicalIndex] = None,
+                symbols: Optional[SymbolIndex] = None) -> int:
+    """
+    Removes every block of a deleted file from the index, the manifest and
+    the local lexical and symbol indexes.
+    """
+    file_path = os.path.abspath(file_path)
+    save_lexical = lexical is None
+    if lexical is None:
+        lexical = LexicalIndex.load(codebase_name)
+    lexical.remove_file(file_path)
+    if save_lexical:
+        lexical.save()
+    save_symbols = symbols is None
+    if symbols is None:
+        symbols = SymbolIndex.load(codebase_name)
+    symbols.remove_file(file_path)
+    if save_symbols:
+        symbols.save()
+
+    index = _get_or_create_index(codebase_name)
+    if not index:
+        return 0
+
+    save_manifest = manifest is None
+    if manifest is None:
+        manifest = Manifest.load(codebase_name)
+
+    deleted = remove_manifest_file(manifest, index, file_path)
+    if save_manifest:
+        index.save()
+        manifest.save()
+    return deleted
@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so one app instance at a time
+    fcntl = None
+
+from manifest import STATE_DIR, write_json_atomic
+from ingestion_utils import ingest_folder
+
+JOBS_DIR = STATE_DIR / "jobs"
+MAX_CONCURRENT_JOBS = int(os.getenv("INGEST_MAX_JOBS", 2))
+
+ACTIVE_STATUSES = {"queued", "running"}
+RESUMABLE_STATUSES = {"failed", "cancelled", "interrupted"}
+
+
+class JobManager:
+    """
+    Runs ingest_folder as background jobs on a small thread pool.
+
+    Every job has a JSON record under JOBS_DIR with its status, progress and
+    stats, plus a `.done` file listing files checkpointed by ingest_folder.
+    Jobs that were running when the process died are marked "interrupted"
+    on startup and can be resumed from their last checkpoint.
+
+    While a job is queued or running, its process holds an flock on the
+    job's `.lock` file. Another manager (e.g. a second Streamlit instance)
+    only marks the job interrupted once that lock is free, i.e. its owner
+    is gone; until then the job is shown with the status its owner saved.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_JOBS,
+                 on_complete: Optional[Callable[[Dict[str, Any]], None]] = None):
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        self.on_complete = on_complete
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="ingest-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+        # Open lock files of the jobs this process has queued or running
+        self._claims: Dict[str, Any] = {}
+        self._load()
+
+    def _load(self):
+        """
+        (Re-)reads the job records, except those of jobs this process runs,
+        so jobs started or finished by other processes show up too.
+        """
+        for path in JOBS_DIR.glob("*.json"):
+            if path.stem in self._claims:
+                continue
+            job = self._read(path)
+            if job is not None:
+                self._jobs[job["id"]] = self._check_owner(job)
+
+    def _read(self, path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable job record {path}: {e}")
+            return None
+
+    def _lock_path(self, job_id: str):
+        return JOBS_DIR / f"{job_id}.lock"
+
+    def _claim(self, job_id: str) -> bool:
+        """Takes the job's lock for this process; False if a live process holds it."""
+        lock_file = open(self._lock_path(job_id), "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+        self._claims[job_id] = lock_file
+        return True
+
+    def _release(self, job_id: str):
+        lock_file = self._claims.pop(job_id, None)
+        if lock_file is not None:
+            # Closing the file drops the flock
+            lock_file.close()
+
+    def _owner_alive(self, job_id: str) -> bool:
+        if job_id in self._claims:
+            return True
+        if fcntl is None:
+            return False
+        with open(self._lock_path(job_id), "a+b") as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        return False
+
+    def _check_owner(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Marks an active job "interrupted" if no live process holds it."""
+        if job.get("status") in ACTIVE_STATUSES and not self._owner_alive(job["id"]):
+            # Left over from a process that exited mid-run
+            job["status"] = "interrupted"
+            write_json_atomic(JOBS_DIR / f"{job['id']}.json", job)
+        return job
+
+    def _save(self, job: Dict[str, Any]):
+        with self._lock:
+            record = dict(job)
+        write_json_atomic(JOBS_DIR / f"{job['id']}.json", record)
+
+    def _done_path(self, job_id: str):
+        return JOBS_DIR / f"{job_id}.done"
+
+    def _done_files(self, job_id: str) -> Set[str]:
+        try:
+            with open(self._done_path(job_id), "r", encoding="utf-8") as f:
+                return {line.rstrip("\n") for line in f if line.strip()}
+        except OSError:
+            return set()
+
+    def _active_job(self, codebase_name: str) -> Optional[Dict[str, Any]]:
+        for job in self._jobs.values():
+            if job["codebase"] == codebase_name and job["status"] in ACTIVE_STATUSES:
+                return job
+        return None
+
+    def submit(self, directory: str, codebase_name: str, workers: Optional[int] = None,
+               force: bool = False) -> Dict[str, Any]:
+        """
+        Queues an ingest job. A codebase has at most one active job; if one
+        exists it is returned instead of starting another.
+        """
+        with self._lock:
+            self._load()
+            active = self._active_job(codebase_name)
+            if active:
+                return dict(active)
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "codebase": codebase_name,
+                "directory": directory,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {"files": 0, "total_files": 0},
+                "stats": None,
+                "error": None,
+                "options": {"workers": workers, "force": force},
+            }
+            self._claim(job["id"])
+            self._jobs[job["id"]] = job
+            self._cancel_events[job["id"]] = threading.Event()
+        self._save(job)
+        self._executor.submit(self._run, job["id"], set())
+        return dict(job)
+
+    def resume(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restarts a failed, cancelled or interrupted job. Files checkpointed by
+        earlier attempts are skipped; without `force` the manifest already
+        skips them, so this mainly matters for forced re-ingests.
+        """
+        with self._lock:
+            self._load()
+            job = self._jobs.get(job_id)
+            if not job or job["status"] not in RESUMABLE_STATUSES or self._active_job(job["codebase"]):
+                return None
+            if not self._claim(job_id):
+                # Another process resumed it first
+                return None
+            job["status"] = "queued"
+            job["error"] = None
+            job["finished_at"] = None
+            self._cancel_events[job_id] = threading.Event()
+        self._save(job)
+        skip_files = self._done_files(job_id) if job["options"].get("force") else set()
+        self._executor.submit(self._run, job_id, skip_files)
+        return dict(job)
+
+    def cancel(self, job_id: str) -> bool:
+        """Asks a job to stop; it checkpoints what it finished and ends as "cancelled"."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            event = self._cancel_events.get(job_id)
+            if not job or job["status"] not in ACTIVE_STATUSES or event is None:
+                return False
+            event.set()
+            return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, codebase_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Jobs, newest first."""
+        with self._lock:
+            self._load()
+            jobs = [
+                dict(job) for job in self._jobs.values()
+                if codebase_name is None or job["codebase"] == codebase_name
+            ]
+        return sorted(jobs, key=lambda job: job["created_at"], reverse=True)
+
+    def _run(self, job_id: str, skip_files: Set[str]):
+        with self._lock:
+            job = self._jobs[job_id]
+            cancel = self._cancel_events[job_id]
+            if cancel.is_set():
+                job["status"] = "cancelled"
+                job["finished_at"] = time.time()
+            else:
+                job["status"] = "running"
+                job["started_at"] = time.time()
+        self._save(job)
+        if job["status"] == "cancelled":
+            with self._lock:
+                self._release(job_id)
+            return
+
+        def on_progress(stats: Dict[str, Any], total_files: int):
+            with self._lock:
+                job["progress"] = {
+                    "files": stats["files"],
+                    "total_files": total_files,
+                    "chunks": stats["chunks"],
+                    "upserted": stats["upserted"],
+                }
+            self._save(job)
+
+        def on_checkpoint(files: List[str]):
+            if files:
+                with open(self._done_path(job_id), "a", encoding="utf-8") as f:
+                    f.writelines(f"{file_path}\n" for file_path in files)
+
+        try:
+            stats = ingest_folder(
+                job["directory"],
+                job["codebase"],
+                workers=job["options"].get("workers"),
+                force=job["options"].get("force", False),
+                progress=on_progress,
+                cancel=cancel,
+                skip_files=skip_files,
+                checkpoint=on_checkpoint,
+            )
+            with self._lock:
+                job["stats"] = stats
+                job["status"] = "cancelled" if stats["cancelled"] else "completed"
+        except Exception as e:
+            print(f"Ingest job {job_id} failed: {e}")
+            with self._lock:
+                job["status"] = "failed"
+                job["error"] = str(e)
+        with self._lock:
+            job["finished_at"] = time.time()
+        self._save(job)
+        with self._lock:
+            self._release(job_id)
+        if job["status"] == "completed":
+            try:
+                os.remove(self._done_path(job_id))
+            except OSError:
+                pass
+        if self.on_complete:
+            try:
+                self.on_complete(dict(job))
+            except Exception as e:
+                print(f"Job completion callback failed for {job_id}: {e}")
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(on_complete: Optional[Callable[[Dict[str, Any]], None]] = None) -> JobManager:
+    """Process-wide job manager; `on_complete` only applies when it is first created."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(on_complete=on_complete)
+        return _manager
@@ -0,0 +1,262 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from manifest import content_hash, get_state_dir, write_json_atomic
+
+LEXICAL_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal-rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = 60
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+# Things in a query that are clearly code: `backticked`, snake_case, camelCase, calls
+CODE_LIKE_RE = re.compile(
+    r"`([^`]+)`|\b([A-Za-z_][A-Za-z0-9_]*(?:_[A-Za-z0-9_]+|[a-z][A-Z][A-Za-z0-9_]*))\b|\b([A-Za-z_][A-Za-z0-9_]*)\(\)"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits code or a query into lowercase lexical terms.
+
+    Every identifier is kept whole and also broken into its snake_case and
+    camelCase parts, so `processOrders` matches both "processorders" and
+    "orders".
+    """
+    terms = []
+    for identifier in IDENTIFIER_RE.findall(text):
+        lower = identifier.lower()
+        terms.append(lower)
+        parts = [p.lower() for chunk in identifier.split("_") for p in CAMEL_RE.findall(chunk)]
+        if len(parts) > 1:
+            terms.extend(p for p in parts if len(p) > 1)
+    return terms
+
+
+def bare_symbol(query: str) -> Optional[str]:
+    """The identifier a query consists of (e.g. `process_orders()`), or None for anything else."""
+    stripped = query.strip().strip("`").rstrip("()")
+    return stripped if IDENTIFIER_RE.fullmatch(stripped) else None
+
+
+def extract_symbols(query: str) -> List[str]:
+    """Returns identifiers in a query that look like code rather than prose."""
+    symbol = bare_symbol(query)
+    if symbol:
+        return [symbol]
+    symbols = []
+    for match in CODE_LIKE_RE.finditer(query):
+        text = next(group for group in match.groups() if group)
+        symbols.extend(IDENTIFIER_RE.findall(text))
+    return symbols
+
+
+def matches_filters(doc: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """Applies search filters to a block; file_path allows a partial match."""
+    if not filters:
+        return True
+    for key, value in filters.items():
+        if key == "file_path":
+            if value not in doc.get("file_path", ""):
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuses several ranked ID lists into one, scoring each ID by sum(1 / (k + rank))."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    Local BM25 index over identifiers and code tokens, plus a symbol table.
+
+    Blocks are stored by ID with their location, so hits can be served by
+    reading the code straight from disk instead of going to the vector store.
+    """
+
+    def __init__(self, codebase_name: str, path: Optional[Path] = None):
+        self.codebase_name = codebase_name
+        self.path = path or get_state_dir(codebase_name) / "lexical.json"
+        # block_id -> {file_path, name, type, ..., start_byte, end_byte, hash, length, terms: {term: tf}}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        # term -> {block_id: term frequency}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # exact symbol name -> block_ids
+        self.symbols: Dict[str, List[str]] = {}
+        # file_path -> block_ids
+        self.file_blocks: Dict[str, List[str]] = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, codebase_name: str, path: Optional[Path] = None) -> "LexicalIndex":
+        index = cls(codebase_name, path)
+        if index.path.exists():
+            try:
+                with open(index.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == LEXICAL_VERSION:
+                    for block_id, doc in data.get("docs", {}).items():
+                        index._add_doc(block_id, doc)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable lexical index {index.path}: {e}")
+        return index
+
+    def save(self):
+        with self._lock:
+            data = {"version": LEXICAL_VERSION, "docs": dict(self.docs)}
+        write_json_atomic(self.path, data)
+
+    def files(self) -> set:
+        with self._lock:
+            return set(self.file_blocks)
+
+    def _add_doc(self, block_id: str, doc: Dict[str, Any]):
+        self.docs[block_id] = doc
+        self.file_blocks.setdefault(doc["file_path"], []).append(block_id)
+        self.total_length += doc["length"]
+        for term, tf in doc["terms"].items():
+            self.postings.setdefault(term, {})[block_id] = tf
+        for name in doc["name"].split(", "):
+            self.symbols.setdefault(name, []).append(block_id)
+
+    def _remove_doc(self, block_id: str):
+        doc = self.docs.pop(block_id, None)
+        if not doc:
+            return
+        self.total_length -= doc["length"]
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(block_id, None)
+                if not posting:
+                    del self.postings[term]
+        for name in doc["name"].split(", "):
+            ids = self.symbols.get(name)
+            if ids and block_id in ids:
+                ids.remove(block_id)
+                if not ids:
+                    del self.symbols[name]
+
+    def update_file(self, file_path: str, chunks: Iterable[Dict[str, Any]]):
+        """Replaces every block of a file with the freshly extracted chunks."""
+        with self._lock:
+            self.remove_file(file_path)
+            for chunk in chunks:
+                self.add_chunk(chunk)
+
+    def add_chunk(self, chunk: Dict[str, Any]):
+        """Indexes one extracted chunk; only its terms and location are kept."""
+        terms = tokenize(chunk["name"]) + tokenize(chunk["code"])
+        with self._lock:
+            if chunk["id"] in self.docs:
+                return
+            self._add_doc(chunk["id"], {
+                "file_path": chunk["file_path"],
+                "name": chunk["name"],
+                "type": chunk["type"],
+                "node_type": chunk["type"],
+                "extension": chunk["extension"],
+                "start_byte": chunk["start_byte"],
+                "end_byte": chunk["end_byte"],
+                "start_line": chunk["start_line"],
+                "end_line": chunk["end_line"],
+                "hash": chunk["hash"],
+                "length": len(terms),
+                "terms": dict(Counter(terms)),
+            })
+
+    def remove_file(self, file_path: str):
+        with self._lock:
+            for block_id in self.file_blocks.pop(file_path, []):
+                self._remove_doc(block_id)
+
+    def load_code(self, block_id: str) -> Optional[str]:
+        """
+        Reads a block's code from disk.
+
+        Returns None if the file changed since it was indexed (the block hash
+        no longer matches), so callers can fall back to the vector store.
+        """
+        doc = self.docs.get(block_id)
+        if not doc:
+            return None
+        try:
+            with open(doc["file_path"], "rb") as f:
+                f.seek(doc["start_byte"])
+                code_bytes = f.read(doc["end_byte"] - doc["start_byte"])
+        except OSError:
+            return None
+        if content_hash(code_bytes) != doc["hash"]:
+            return None
+        return code_bytes.decode("utf-8", errors="ignore")
+
+    def lookup_symbols(self, symbols: List[str], filters: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Block IDs whose name is exactly one of `symbols`, in the order of `symbols`."""
+        with self._lock:
+            ids = []
+            for symbol in symbols:
+                for block_id in self.symbols.get(symbol, []):
+                    if block_id not in ids and matches_filters(self.docs[block_id], filters):
+                        ids.append(block_id)
+            return ids
+
+    def search(self, query: str, top_k: int = 10,
+               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """Scores blocks against a query with BM25 and returns (block_id, score)."""
+        with self._lock:
+            num_docs = len(self.docs)
+            if not num_docs:
+                return []
+            avg_length = self.total_length / num_docs
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (num_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for block_id, tf in posting.items():
+                    length = self.docs[block_id]["length"]
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[block_id] = scores.get(block_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            if filters:
+                ranked = [item for item in ranked if matches_filters(self.docs[item[0]], filters)]
+            return ranked[:top_k]
+
+
+_indexes: Dict[str, Tuple[float, LexicalIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(codebase_name: str) -> LexicalIndex:
+    """
+    Returns the lexical index for a codebase, reloading it if it changed on disk.
+    """
+    path = get_state_dir(codebase_name) / "lexical.json"
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    with _indexes_lock:
+        cached = _indexes.get(codebase_name)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, LexicalIndex.load(codebase_name, path))
+            _indexes[codebase_name] = cached
+        return cached[1]
@@ -0,0 +1,137 @@
+"""
+Load test for the query service (server.py).
+
+Runs `--concurrency` clients, each with its own keep-alive connection,
+until `--requests` requests were sent, then reports latency percentiles,
+throughput and how many requests were shed with 503.
+
+    python server.py &
+    python load_test.py --codebase my_repo --concurrency 32 --requests 2000
+    python load_test.py --codebase my_repo --mode chat --concurrency 8 --requests 40
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from benchmark import latency_summary
+from service_client import QUERY_SERVICE_URL, QueryClient, ServiceError
+
+DEFAULT_QUERIES = (
+    "where is the configuration loaded",
+    "how are errors retried",
+    "parse command line arguments",
+    "database connection setup",
+    "authentication token validation",
+    "write results to a file",
+    "cache invalidation",
+    "main entry point",
+)
+DEFAULT_CHAT_MESSAGES = (
+    "What does this project do?",
+    "Where are requests handled?",
+    "How is configuration loaded?",
+)
+
+
+def run_load_test(url: str, codebase_name: str, mode: str, concurrency: int, total: int,
+                  queries: List[str], top_k: int = 5) -> Dict[str, Any]:
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    def record(status: str, seconds: Optional[float] = None):
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if seconds is not None:
+                latencies.append(seconds)
+
+    def worker(worker_id: int):
+        client = QueryClient(url)
+        session_id = None
+        try:
+            while True:
+                n = next(counter)
+                if n >= total:
+                    return
+                query = queries[n % len(queries)]
+                start = time.perf_counter()
+                try:
+                    if mode == "search":
+                        client.search(codebase_name, query, top_k=top_k)
+                    elif mode == "batch":
+                        client.search_many(codebase_name, [query, queries[(n + 1) % len(queries)]], top_k=top_k)
+                    else:
+                        if session_id is None:
+                            session_id = client.create_session(codebase_name)
+                        for _ in client.stream(session_id, query):
+                            pass
+                    record("ok", time.perf_counter() - start)
+                except ServiceError as e:
+                    record(str(e.status))
+                    if e.retry_after:
+                        time.sleep(e.retry_after)
+                except OSError as e:
+                    record(type(e).__name__)
+                    client.close()
+        finally:
+            if session_id is not None:
+                try:
+                    client.delete_session(session_id)
+                except (ServiceError, OSError):
+                    pass
+            client.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    summary = latency_summary(latencies)
+    # Throughput over wall time, not the sum of latencies
+    summary["qps"] = len(latencies) / elapsed if elapsed else 0.0
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": elapsed,
+        "statuses": statuses,
+        "rejected_fraction": statuses.get("503", 0) / total if total else 0.0,
+        **summary,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the query service.")
+    parser.add_argument("--url", default=QUERY_SERVICE_URL or "http://127.0.0.1:8765")
+    parser.add_argument("--codebase", required=True)
+    parser.add_argument("--mode", choices=("search", "batch", "chat"), default="search")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", help="File with one query (or chat message) per line")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = list(DEFAULT_CHAT_MESSAGES if args.mode == "chat" else DEFAULT_QUERIES)
+
+    print(f"Health: {json.dumps(QueryClient(args.url).health())}")
+    results = run_load_test(args.url, args.codebase, args.mode, args.concurrency, args.requests,
+                            queries, args.top_k)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
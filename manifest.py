@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so one writer at a time
+    fcntl = None
+
+STATE_DIR = Path(os.getenv("ENDEE_STATE_DIR", Path.home() / ".endee"))
+MANIFEST_VERSION = 1
+
+
+def get_state_dir(codebase_name: str) -> Path:
+    """Returns (and creates) the local state directory for a codebase."""
+    state_dir = STATE_DIR / codebase_name
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir
+
+
+_codebase_locks: Dict[str, threading.Lock] = {}
+_codebase_locks_guard = threading.Lock()
+
+
+@contextmanager
+def codebase_lock(codebase_name: str):
+    """
+    Exclusive lock, across threads and processes, on a codebase's manifest,
+    lexical and symbol indexes. Writers hold it from loading them until they
+    are saved, so an ingest job and the watcher never drop each other's updates.
+    """
+    with _codebase_locks_guard:
+        lock = _codebase_locks.setdefault(codebase_name, threading.Lock())
+    with lock, open(get_state_dir(codebase_name) / "ingest.lock", "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def is_indexed_codebase(codebase_name: str) -> bool:
+    """
+    Whether `codebase_name` is a plain name (no path separators) with
+    ingested state. Used to vet names that come from clients.
+    """
+    if not codebase_name or codebase_name in (".", "..") or "\0" in codebase_name:
+        return False
+    if any(sep and sep in codebase_name for sep in ("/", os.sep, os.altsep)):
+        return False
+    return (STATE_DIR / codebase_name / "manifest.json").is_file()
+
+
+def content_hash(data: bytes) -> str:
+    """Short, fast content hash used for files and code blocks."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def write_json_atomic(path: Path, data: Any):
+    """Writes JSON to a temp file and renames it over `path`."""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class Manifest:
+    """
+    Persistent record of what has been ingested for a codebase.
+
+    Maps each file path to its content hash, mtime, size and the IDs of the
+    blocks that were upserted for it, so re-ingestion can skip unchanged files
+    and delete vectors that no longer exist.
+    """
+
+    def __init__(self, codebase_name: str, path: Optional[Path] = None):
+        self.codebase_name = codebase_name
+        self.path = path or get_state_dir(codebase_name) / "manifest.json"
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, codebase_name: str, path: Optional[Path] = None) -> "Manifest":
+        manifest = cls(codebase_name, path)
+        if manifest.path.exists():
+            try:
+                with open(manifest.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    manifest.files = data.get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {manifest.path}: {e}")
+        return manifest
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self.files)
+
+    def save(self, files: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Persists the manifest, or an earlier snapshot() of it."""
+        data = {"version": MANIFEST_VERSION, "files": self.snapshot() if files is None else files}
+        write_json_atomic(self.path, data)
+
+    def get(self, file_path: str) -> Optional[Dict[str, Any]]:
+        return self.files.get(file_path)
+
+    def is_unchanged(self, file_path: str, stat: os.stat_result) -> bool:
+        """Cheap check: same mtime and size as the last successful ingest."""
+        entry = self.files.get(file_path)
+        return bool(
+            entry
+            and entry.get("mtime") == stat.st_mtime_ns
+            and entry.get("size") == stat.st_size
+        )
+
+    def update(self, file_path: str, file_hash: str, stat: os.stat_result, blocks: Dict[str, str]):
+        with self._lock:
+            self.files[file_path] = {
+                "hash": file_hash,
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "blocks": blocks,
+            }
+
+    def mark_failed(self, file_path: str, blocks: Dict[str, Optional[str]]):
+        """
+        Records a file whose upserts or deletes did not all go through. It no
+        longer looks unchanged, so the next run parses it again, upserts what
+        is missing and retries deleting `blocks` that are gone from it.
+        """
+        with self._lock:
+            self.files[file_path] = {"hash": None, "mtime": None, "size": None, "blocks": blocks}
+
+    def touch(self, file_path: str, stat: os.stat_result):
+        """Records a new mtime/size for a file whose content did not change."""
+        with self._lock:
+            entry = self.files.get(file_path)
+            if entry:
+                entry["mtime"] = stat.st_mtime_ns
+                entry["size"] = stat.st_size
+
+    def remove(self, file_path: str) -> List[str]:
+        """Forgets a file and returns the block IDs that belonged to it."""
+        with self._lock:
+            entry = self.files.pop(file_path, None)
+        return list(entry.get("blocks", {})) if entry else []
+
+    def missing_files(self, directory: str, present: Iterable[str]) -> List[str]:
+        """Files recorded under `directory` that are no longer present."""
+        prefix = os.path.join(directory, "")
+        present = set(present)
+        return [
+            path for path in self.files
+            if path.startswith(prefix) and path not in present
+        ]
+
+
+def index_version(codebase_name: str) -> int:
+    """
+    Changes whenever a codebase is (re-)ingested; derived from the manifest's
+    mtime, so it works across processes without extra bookkeeping.
+    """
+    try:
+        return os.stat(STATE_DIR / codebase_name / "manifest.json").st_mtime_ns
+    except OSError:
+        return 0
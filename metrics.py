@@ -0,0 +1,282 @@
+import atexit
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from manifest import STATE_DIR
+
+METRIC_PREFIX = "endee_"
+# Upper bounds in seconds; the last bucket is +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_FILE = Path(os.getenv("METRICS_FILE", STATE_DIR / "metrics.prom"))
+# Interface the /metrics endpoint listens on; 0.0.0.0 exposes it to the network
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if seen + count >= target and count:
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms for one process.
+
+    Worker processes drain() their registry and hand the snapshot back to
+    the parent, which merge()s it, so pool work shows up in one place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """Times a block into stage_seconds{stage=...}; exceptions are counted and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment("errors_total", stage=stage)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+    def timed(self, stage: str, **labels):
+        """Decorator form of span()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Picklable copy of every metric."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {
+                    key: (histogram.counts[:], histogram.count, histogram.sum)
+                    for key, histogram in self._histograms.items()
+                },
+            }
+
+    def drain(self) -> Dict[str, Any]:
+        """Returns a snapshot and resets counters and histograms."""
+        snapshot = self.snapshot()
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]):
+        with self._lock:
+            for key, value in snapshot["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (counts, count, total) in snapshot["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+                other = Histogram()
+                other.counts, other.count, other.sum = counts, count, total
+                histogram.merge(other)
+
+    def stage_histograms(self) -> Dict[str, Histogram]:
+        """stage_seconds aggregated per stage across all other labels."""
+        stages: Dict[str, Histogram] = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                if name != "stage_seconds":
+                    continue
+                stage = dict(labels).get("stage", "")
+                stages.setdefault(stage, Histogram()).merge(histogram)
+        return stages
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def gauge(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._gauges.get((name, _label_key(labels)), 0)
+
+    def export_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        snapshot = self.snapshot()
+        for kind, metrics in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            typed = set()
+            for (name, labels), value in sorted(metrics.items()):
+                full_name = METRIC_PREFIX + name
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    typed.add(full_name)
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+
+        typed = set()
+        for (name, labels), (counts, count, total) in sorted(snapshot["histograms"].items()):
+            full_name = METRIC_PREFIX + name
+            if full_name not in typed:
+                lines.append(f"# TYPE {full_name} histogram")
+                typed.add(full_name)
+            cumulative = 0
+            for bound, bucket_count in zip(list(DEFAULT_BUCKETS) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: Path = METRICS_FILE):
+        """Writes the Prometheus text export to a file (e.g. for node_exporter's textfile collector)."""
+        snapshot = self.snapshot()
+        if not any(snapshot.values()):
+            # A process that recorded nothing must not replace another one's file
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            tmp_path.write_text(self.export_prometheus(), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write metrics to {path}: {e}")
+
+
+registry = MetricsRegistry()
+increment = registry.increment
+set_gauge = registry.set_gauge
+observe = registry.observe
+span = registry.span
+timed = registry.timed
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+_write_at_exit = False
+
+
+def write_file_at_exit():
+    """
+    Writes METRICS_FILE when the process exits. Called by entry points (app,
+    server, watcher) rather than on import, so pool workers and the
+    forkserver, which import this module too, never write the file.
+    """
+    global _write_at_exit
+    with _server_lock:
+        if not _write_at_exit:
+            atexit.register(registry.write_file)
+            _write_at_exit = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.export_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Serves /metrics on a background thread. Uses METRICS_PORT when no port
+    is given and does nothing if neither is set. Listens on METRICS_HOST
+    (localhost by default). Safe to call repeatedly.
+    """
+    global _server
+    port = port or int(os.getenv("METRICS_PORT", 0))
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Could not start metrics server on {host}:{port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Serving metrics on http://{host}:{port}/metrics")
+        return _server
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from manifest import index_version
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 600))
+# Cosine similarity above which a cached query's results are reused
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", 0.95))
+# The semantic level scores every entry per lookup, so it is kept smaller than the exact level
+SEMANTIC_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SEMANTIC_SIZE", 256))
+
+
+def normalize_query(query: str) -> str:
+    """
+    Whitespace-insensitive form of a query for exact matching. Case is kept:
+    symbol lookups are case-sensitive, so `Parser` and `parser` can differ.
+    """
+    return " ".join(query.split())
+
+
+def _filters_key(filters: Optional[Dict[str, Any]], top_k: int) -> str:
+    return json.dumps([filters or {}, top_k], sort_keys=True, default=str)
+
+
+def _unit(vector: Sequence[float]) -> Optional[np.ndarray]:
+    unit = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(unit))
+    if not norm or not np.isfinite(norm):
+        return None
+    return unit / norm
+
+
+def _group_hash(codebase_name: str, filters_key: str) -> int:
+    # Only narrows the candidates; a hit's full key is compared afterwards
+    return hash((codebase_name, filters_key))
+
+
+def _copy_documents(documents: List[Document]) -> List[Document]:
+    # Callers annotate metadata (scores, ranks); never hand out the cached objects
+    return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in documents]
+
+
+class QueryCache:
+    """
+    Two-level cache of search results.
+
+    Level 1 is an exact match on (codebase, normalized query, filters, top_k).
+    Level 2 reuses the results of a cached query whose embedding is within
+    a cosine-similarity threshold of the new one (same codebase, filters and
+    top_k).
+
+    Entries expire after a TTL, are evicted LRU, and are dropped as soon as
+    the codebase's index version changes (i.e. it was re-ingested).
+
+    Level 2 keeps unit embeddings as rows of one matrix, so a lookup is a
+    single matrix-vector product masked to the entries of the same codebase,
+    filters and index version.
+    """
+
+    def __init__(self, capacity: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL,
+                 similarity: float = QUERY_CACHE_SIMILARITY,
+                 semantic_capacity: int = SEMANTIC_CACHE_SIZE):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.similarity = similarity
+        self.semantic_capacity = semantic_capacity
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # (codebase, query, filters) -> (version, expires_at, documents)
+        self._exact: "OrderedDict[Tuple[str, str, str], Tuple[int, float, List[Document]]]" = OrderedDict()
+        # (codebase, query, filters) -> matrix row, in LRU order
+        self._semantic: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+        # Per row: unit embedding, group hash, index version, expiry (0 = free), key and documents
+        self._vectors: Optional[np.ndarray] = None
+        rows = max(semantic_capacity, 0)
+        self._groups = np.zeros(rows, dtype=np.int64)
+        self._versions = np.zeros(rows, dtype=np.int64)
+        self._expires = np.zeros(rows, dtype=np.float64)
+        self._row_keys: List[Optional[Tuple[str, str, str]]] = [None] * rows
+        self._row_documents: List[Optional[List[Document]]] = [None] * rows
+        self._free_rows = list(range(rows - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def _fresh(self, version: int, expires_at: float, codebase_name: str) -> bool:
+        return expires_at > time.monotonic() and version == index_version(codebase_name)
+
+    def get(self, codebase_name: str, query: str, filters: Optional[Dict[str, Any]] = None,
+            top_k: int = 0) -> Optional[List[Document]]:
+        """Level 1 lookup. Does not count a miss, since level 2 may still hit."""
+        key = (codebase_name, normalize_query(query), _filters_key(filters, top_k))
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            version, expires_at, documents = entry
+            if not self._fresh(version, expires_at, codebase_name):
+                del self._exact[key]
+                return None
+            self._exact.move_to_end(key)
+            self.exact_hits += 1
+            return _copy_documents(documents)
+
+    def get_similar(self, codebase_name: str, query: str, embedding: Sequence[float],
+                    filters: Optional[Dict[str, Any]] = None,
+                    top_k: int = 0) -> Optional[List[Document]]:
+        """Level 2 lookup by embedding similarity; counts a miss if nothing is close enough."""
+        unit = _unit(embedding)
+        filters_key = _filters_key(filters, top_k)
+        version = index_version(codebase_name)
+        now = time.monotonic()
+        with self._lock:
+            best_key = None
+            if self._semantic:
+                live = self._expires > 0
+                same_group = live & (self._groups == _group_hash(codebase_name, filters_key))
+                stale = live & ((self._expires <= now) | (same_group & (self._versions != version)))
+                for row in np.flatnonzero(stale):
+                    self._free_row(int(row))
+                candidates = same_group & ~stale
+                if unit is not None and unit.shape[0] == self._vectors.shape[1] and candidates.any():
+                    scores = np.where(candidates, self._vectors @ unit, -np.inf)
+                    row = int(np.argmax(scores))
+                    key = self._row_keys[row]
+                    if scores[row] >= self.similarity and key[0] == codebase_name and key[2] == filters_key:
+                        best_key = key
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._semantic.move_to_end(best_key)
+            self.semantic_hits += 1
+            documents = self._row_documents[row]
+            # Promote to level 1 so the exact same query is cheap next time
+            self._put_exact((codebase_name, normalize_query(query), filters_key), version, documents)
+            return _copy_documents(documents)
+
+    def _free_row(self, row: int):
+        del self._semantic[self._row_keys[row]]
+        self._row_keys[row] = None
+        self._row_documents[row] = None
+        self._expires[row] = 0
+        self._free_rows.append(row)
+
+    def _put_semantic(self, key, version: int, unit: np.ndarray, documents: List[Document]):
+        if self._vectors is None:
+            self._vectors = np.zeros((self.semantic_capacity, unit.shape[0]), dtype=np.float32)
+        elif unit.shape[0] != self._vectors.shape[1]:
+            return
+        row = self._semantic.get(key)
+        if row is None:
+            if not self._free_rows:
+                self._free_row(next(iter(self._semantic.values())))
+            row = self._free_rows.pop()
+            self._semantic[key] = row
+        self._semantic.move_to_end(key)
+        self._vectors[row] = unit
+        self._groups[row] = _group_hash(key[0], key[2])
+        self._versions[row] = version
+        self._expires[row] = time.monotonic() + self.ttl
+        self._row_keys[row] = key
+        self._row_documents[row] = documents
+
+    def _put_exact(self, key, version: int, documents: List[Document]):
+        self._exact[key] = (version, time.monotonic() + self.ttl, documents)
+        self._exact.move_to_end(key)
+        while len(self._exact) > self.capacity:
+            self._exact.popitem(last=False)
+
+    def put(self, codebase_name: str, query: str, documents: List[Document],
+            filters: Optional[Dict[str, Any]] = None, top_k: int = 0,
+            embedding: Optional[Sequence[float]] = None):
+        if self.capacity <= 0 or not documents:
+            return
+        key = (codebase_name, normalize_query(query), _filters_key(filters, top_k))
+        version = index_version(codebase_name)
+        documents = _copy_documents(documents)
+        with self._lock:
+            self._put_exact(key, version, documents)
+            unit = _unit(embedding) if embedding is not None else None
+            if unit is not None and self.semantic_capacity > 0:
+                self._put_semantic(key, version, unit, documents)
+
+    def invalidate(self, codebase_name: Optional[str] = None):
+        """Drops every entry, or only those of one codebase."""
+        with self._lock:
+            for key in [key for key in self._exact if codebase_name is None or key[0] == codebase_name]:
+                del self._exact[key]
+            for key, row in list(self._semantic.items()):
+                if codebase_name is None or key[0] == codebase_name:
+                    self._free_row(row)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+_query_cache: Optional[QueryCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    """Returns the process-wide query-result cache. QUERY_CACHE_SIZE=0 disables it."""
+    global _query_cache
+    with _query_cache_lock:
+        if _query_cache is None:
+            _query_cache = QueryCache()
+        return _query_cache
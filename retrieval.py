@@ -1,14 +1,70 @@
+import inspect
+import json
 import os
-from typing import List, Any
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Sequence, Tuple, Union
 from dotenv import load_dotenv
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from endee import Endee
+import metrics
+from blob_store import get_blob_store
+from embeddings import EMBEDDING_MODEL
+from embedding_cache import get_embedding_cache
+from lexical_index import bare_symbol, extract_symbols, get_lexical_index, reciprocal_rank_fusion
+from query_cache import get_query_cache
+from tool_cache import get_tool_cache
+from vector_store import VECTOR_BACKEND, get_vector_store
 
 load_dotenv()
 
+# Searches of one search_many() call run concurrently on this many threads
+SEARCH_MANY_CONCURRENCY = int(os.getenv("SEARCH_MANY_CONCURRENCY", 8))
+# Upper bound on merged search_many() results
+SEARCH_MANY_MAX_RESULTS = 15
+# Pooled retrievers, one per (codebase, top_k); the least recently used is dropped beyond this
+RETRIEVER_POOL_SIZE = int(os.getenv("RETRIEVER_POOL_SIZE", 32))
+
+_shared_lock = threading.Lock()
+_search_executor: Optional[ThreadPoolExecutor] = None
+# Typed as Any: the SDKs are imported on first use to keep startup fast
+_shared_client: Any = None
+_shared_embeddings: Any = None
+
+
+def get_endee_client():
+    """
+    Returns the process-wide Endee client.
+
+    Every Index handle obtained from it shares the client's pooled HTTP
+    session, so reusing one client keeps connections warm across queries.
+    """
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            from endee import Endee
+            _shared_client = Endee()
+        return _shared_client
+
+
+def get_query_embeddings():
+    """Returns the process-wide query embedding model."""
+    global _shared_embeddings
+    with _shared_lock:
+        if _shared_embeddings is None:
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY not found in environment variables")
+            _shared_embeddings = GoogleGenerativeAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                google_api_key=api_key
+            )
+        return _shared_embeddings
+
+
 class EndeeRetriever(BaseRetriever):
     """Retriever for Endee Vector Store."""
     
@@ -21,55 +77,330 @@ class EndeeRetriever(BaseRetriever):
         super().__init__(**kwargs)
         self.index_name = index_name
         self.top_k = top_k
-        self.client = Endee()
-        
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-            
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
-            google_api_key=api_key
-        )
+        if self.client is None and VECTOR_BACKEND != "local":
+            self.client = get_endee_client()
+        if self.embeddings is None:
+            self.embeddings = get_query_embeddings()
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def _get_index(self):
+        """Returns the cached vector store handle, opening it on first use."""
+        if VECTOR_BACKEND == "local":
+            # Process-wide and reloaded when another process saves it
+            return get_vector_store(self.index_name)
+        with self._index_lock:
+            if self._index is None:
+                self._index = get_vector_store(self.index_name, client=self.client)
+            return self._index
+
+    def reset_index(self):
+        """Drops the cached index handle so the next search fetches a fresh one."""
+        with self._index_lock:
+            self._index = None
+
+    def _embed_query(self, query: str) -> List[float]:
+        """Embeds a query, going through the shared on-disk embedding cache."""
+        cache = get_embedding_cache()
+        # Queries are embedded with a different task type than documents
+        cache_model = f"{EMBEDDING_MODEL}:query"
+        if cache:
+            cached = cache.get(cache_model, query)
+            if cached is not None:
+                return cached
+
+        with metrics.span("embed_query"):
+            embedding = self.embeddings.embed_query(query)
+        if cache:
+            cache.put(cache_model, query, embedding)
+        return embedding
 
-    def search(self, query: str, filters: dict = None) -> List[Document]:
+    def _embed_queries(self, queries: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Embeds several queries, sending every cache miss in one batched
+        request when the embedding model supports query-typed batches.
+        Queries that could not be embedded get None.
+        """
+        cache = get_embedding_cache()
+        cache_model = f"{EMBEDDING_MODEL}:query"
+        embeddings: List[Optional[List[float]]] = [None] * len(queries)
+        missing = []
+        for i, query in enumerate(queries):
+            cached = cache.get(cache_model, query) if cache else None
+            if cached is not None:
+                embeddings[i] = cached
+            else:
+                missing.append(i)
+        if not missing:
+            return embeddings
+
+        texts = [queries[i] for i in missing]
+        try:
+            with metrics.span("embed_query_batch"):
+                embed_many = getattr(self.embeddings, "embed_documents", None)
+                if len(texts) > 1 and embed_many and "task_type" in inspect.signature(embed_many).parameters:
+                    vectors = embed_many(texts, task_type="RETRIEVAL_QUERY")
+                else:
+                    vectors = [self.embeddings.embed_query(text) for text in texts]
+        except Exception as e:
+            print(f"Error embedding queries: {e}")
+            metrics.increment("errors_total", stage="embed_query")
+            return embeddings
+        for i, vector in zip(missing, vectors):
+            embeddings[i] = vector
+            if cache:
+                cache.put(cache_model, queries[i], vector)
+        return embeddings
+
+    def _fast_path(self, lexical, query: str, filters: Optional[dict]) -> Optional[List[Document]]:
+        """
+        Answers from the exact query cache, or from the symbol table when the
+        whole query is one identifier. Symbols mentioned in a longer question
+        are ranked in _hybrid_search instead.
+        """
+        cache = get_query_cache()
+        cached = cache.get(self.index_name, query, filters, top_k=self.top_k)
+        if cached is not None:
+            metrics.increment("query_cache_hits_total", level="exact")
+            return cached
+
+        symbol = bare_symbol(query)
+        symbol_ids = lexical.lookup_symbols([symbol], filters) if symbol else []
+        if symbol_ids:
+            documents = self._lexical_documents(lexical, symbol_ids[: self.top_k])
+            if documents:
+                metrics.increment("symbol_fast_path_total")
+                cache.put(self.index_name, query, documents, filters, top_k=self.top_k)
+                return documents
+        return None
+
+    def _search_embedded(self, lexical, query: str, filters: Optional[dict],
+                         embedding: Optional[List[float]]) -> List[Document]:
+        """Semantic cache, then hybrid search; the result is cached."""
+        cache = get_query_cache()
+        if embedding is not None:
+            cached = cache.get_similar(self.index_name, query, embedding, filters, top_k=self.top_k)
+            if cached is not None:
+                metrics.increment("query_cache_hits_total", level="semantic")
+                return cached
+        metrics.increment("query_cache_misses_total")
+
+        documents = self._hybrid_search(lexical, query, filters, embedding)
+        cache.put(self.index_name, query, documents, filters, top_k=self.top_k, embedding=embedding)
+        return documents
+
+    def search(self, query: str, filters: dict = None, hydrate: bool = True) -> List[Document]:
         """
         Public method to search with optional filters.
+
+        Results are served from the query cache when the same query (or one
+        whose embedding is nearly identical) was answered since the last
+        ingest. A query that is just a known symbol (e.g. `process_orders`) is
+        answered from the local lexical index without any network call.
+        Everything else runs BM25 and vector search and merges them, together
+        with exact matches for any symbols it mentions, with reciprocal-rank
+        fusion.
+
+        Code is read from the blob store only for the documents returned;
+        with hydrate=False their page_content stays empty for the caller to
+        fill with hydrate(), e.g. with only the first few lines.
+        """
+        with metrics.span("retrieve"):
+            lexical = get_lexical_index(self.index_name)
+            documents = self._fast_path(lexical, query, filters)
+            if documents is None:
+                try:
+                    embedding = self._embed_query(query)
+                except Exception as e:
+                    print(f"Error embedding query: {e}")
+                    metrics.increment("errors_total", stage="embed_query")
+                    embedding = None
+                documents = self._search_embedded(lexical, query, filters, embedding)
+        return self.hydrate(documents) if hydrate else documents
+
+    def search_many(self, queries: Sequence[str],
+                    filters: Union[None, dict, Sequence[Optional[dict]]] = None,
+                    max_results: Optional[int] = None, hydrate: bool = True) -> List[Document]:
+        """
+        Runs several searches as one: cache and symbol hits are answered
+        first, every remaining query is embedded in a single batched request,
+        and their hybrid searches run concurrently.
+
+        `filters` is one filter dict for all queries or one per query.
+        Results are merged with reciprocal-rank fusion and deduplicated by
+        block; each document lists the queries it matched in
+        metadata["matched_queries"]. `hydrate` works as in search().
+        """
+        if filters is None or isinstance(filters, dict):
+            filters = [filters] * len(queries)
+        if len(filters) != len(queries):
+            raise ValueError("filters must be a single dict or one per query")
+        # Identical (query, filters) pairs are searched once
+        requests: List[Tuple[str, Optional[dict]]] = []
+        seen = set()
+        for query, query_filters in zip(queries, filters):
+            key = (query, json.dumps(query_filters or {}, sort_keys=True, default=str))
+            if key not in seen:
+                seen.add(key)
+                requests.append((query, query_filters or None))
+
+        with metrics.span("retrieve_many"):
+            metrics.increment("search_many_queries_total", len(requests))
+            lexical = get_lexical_index(self.index_name)
+            results: List[Optional[List[Document]]] = [
+                self._fast_path(lexical, query, query_filters) for query, query_filters in requests
+            ]
+            pending = [i for i, documents in enumerate(results) if documents is None]
+            if pending:
+                embeddings = self._embed_queries([requests[i][0] for i in pending])
+                searches = [
+                    _get_search_executor().submit(
+                        self._search_embedded, lexical, requests[i][0], requests[i][1], embedding
+                    )
+                    for i, embedding in zip(pending, embeddings)
+                ]
+                for i, future in zip(pending, searches):
+                    results[i] = future.result()
+
+        by_id: Dict[str, Document] = {}
+        matched: Dict[str, List[str]] = {}
+        rankings = []
+        for (query, _), documents in zip(requests, results):
+            ranking = []
+            for doc in documents or []:
+                block_id = doc.metadata.get("id") or f"{doc.metadata.get('file_path')}::{doc.metadata.get('name')}"
+                by_id.setdefault(block_id, doc)
+                matched.setdefault(block_id, []).append(query)
+                ranking.append(block_id)
+            rankings.append(ranking)
+
+        merged = []
+        for block_id, score in reciprocal_rank_fusion(rankings)[: max_results or SEARCH_MANY_MAX_RESULTS]:
+            doc = by_id[block_id]
+            metadata = dict(doc.metadata, multi_rrf_score=score, matched_queries=matched[block_id])
+            merged.append(Document(page_content=doc.page_content, metadata=metadata))
+        return self.hydrate(merged) if hydrate else merged
+
+    def hydrate(self, documents: List[Document], max_lines: Optional[int] = None) -> List[Document]:
+        """
+        Fills in the code of documents returned with hydrate=False, from the
+        blob store (or the source file for blocks indexed before it existed).
+        With max_lines only the first lines are decoded into page_content and
+        metadata["total_lines"] has the block's full length. Documents whose
+        code cannot be found are dropped. The inputs, which may be shared
+        with the query cache, are not modified.
+        """
+        blobs = get_blob_store(self.index_name)
+        lexical = None
+        hydrated = []
+        with metrics.span("hydrate"):
+            for doc in documents:
+                if doc.page_content:
+                    hydrated.append(doc)
+                    continue
+                block_id = doc.metadata.get("id")
+                block_hash = doc.metadata.get("hash")
+                code = blobs.get_lines(block_hash, 0, max_lines) if block_hash else None
+                total_lines = blobs.line_count(block_hash) if code is not None else None
+                if code is None:
+                    lexical = lexical or get_lexical_index(self.index_name)
+                    code = lexical.load_code(block_id) if block_id else None
+                    if not code:
+                        # File changed since indexing and its code is not stored
+                        continue
+                    total_lines = code.count("\n") + 1
+                    if max_lines is not None:
+                        code = "\n".join(code.split("\n", max_lines)[:max_lines])
+                metadata = dict(doc.metadata, total_lines=total_lines)
+                hydrated.append(Document(page_content=code, metadata=metadata))
+        return hydrated
+
+    def _hybrid_search(self, lexical, query: str, filters: Optional[dict],
+                       embedding: Optional[List[float]]) -> List[Document]:
+        """
+        BM25, vector search and exact matches for symbols named in the query,
+        fused with reciprocal-rank fusion.
         """
-        return self._search_internal(query, filters)
+        candidates = self.top_k * 2
+        with metrics.span("lexical_search"):
+            lexical_hits = lexical.search(query, top_k=candidates, filters=filters)
+            symbol_ids = lexical.lookup_symbols(extract_symbols(query), filters)[:candidates]
+        vector_docs = self._search_internal(query, filters, top_k=candidates, embedding=embedding)
+        if lexical.docs:
+            # The lexical index holds every current block; other hits are stale vectors
+            vector_docs = [doc for doc in vector_docs if doc.metadata.get("id") in lexical.docs]
+        if not lexical_hits and not symbol_ids:
+            return vector_docs[: self.top_k]
+
+        vector_by_id = {doc.metadata.get("id"): doc for doc in vector_docs}
+        fused = reciprocal_rank_fusion([
+            [doc.metadata.get("id") for doc in vector_docs],
+            [block_id for block_id, _ in lexical_hits],
+            symbol_ids,
+        ])
+
+        documents = []
+        for block_id, rrf_score in fused:
+            doc = vector_by_id.get(block_id)
+            if doc is None:
+                lexical_docs = self._lexical_documents(lexical, [block_id])
+                if not lexical_docs:
+                    continue
+                doc = lexical_docs[0]
+            doc.metadata["rrf_score"] = rrf_score
+            documents.append(doc)
+            if len(documents) >= self.top_k:
+                break
+        return documents
+
+    def _lexical_documents(self, lexical, block_ids: List[str]) -> List[Document]:
+        """Builds unhydrated Documents for lexical hits; hydrate() reads their code."""
+        documents = []
+        for block_id in block_ids:
+            doc = lexical.docs.get(block_id)
+            if not doc:
+                continue
+            metadata = {
+                key: doc[key]
+                for key in ("name", "type", "file_path", "node_type", "extension", "start_line", "end_line", "hash")
+            }
+            metadata["id"] = block_id
+            metadata["source"] = "lexical"
+            documents.append(Document(page_content="", metadata=metadata))
+        return documents
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: CallbackManagerForRetrieverRun = None
     ) -> List[Document]:
         """Get documents relevant to the query (standard interface)."""
-        return self._search_internal(query)
+        return self.search(query)
 
-    def _search_internal(self, query: str, filters: dict = None) -> List[Document]:
-        """Internal search logic."""
+    def _search_internal(self, query: str, filters: dict = None, top_k: Optional[int] = None,
+                         embedding: Optional[List[float]] = None) -> List[Document]:
+        """Internal search logic (vector search only)."""
         try:
-            embedding = self.embeddings.embed_query(query)
+            if embedding is None:
+                embedding = self._embed_query(query)
             
-            index = self.client.get_index(self.index_name)
+            index = self._get_index()
             if not index:
                 print(f"Warning: Index '{self.index_name}' not found.")
                 return []
                 
-            search_args = {
-                "query": embedding, 
-                "top_k": self.top_k
-            }
-            if filters:
-                search_args["filter"] = filters
-
-            results = index.search(**search_args)
+            with metrics.span("vector_search", backend=VECTOR_BACKEND):
+                results = index.search(embedding, top_k or self.top_k, filter=filters)
             
             documents = []
             for match in results:
                 if isinstance(match, dict):
                     meta = match.get("meta", {})
                     content = meta.get("code", "")
-                    score = match.get("score", 0.0)
+                    score = match.get("score", match.get("similarity", 0.0))
                     metadata = {k: v for k, v in meta.items() if k != "code"}
+                    # file_path / node_type live in the filter fields
+                    for k, v in (match.get("filter") or {}).items():
+                        metadata.setdefault(k, v)
+                    metadata["id"] = match.get("id")
                     metadata["score"] = score
                 else:
                     meta = getattr(match, "meta", {})
@@ -86,16 +417,64 @@ class EndeeRetriever(BaseRetriever):
                     metadata = meta.copy()
                     if "code" in metadata:
                         del metadata["code"]
+                    for k, v in (getattr(match, "filter", None) or {}).items():
+                        metadata.setdefault(k, v)
+                    metadata["id"] = getattr(match, "id", None)
                     metadata["score"] = score
 
-                if content:
+                # Current records carry a blob hash instead of the code
+                if content or metadata.get("hash"):
                      documents.append(Document(page_content=content, metadata=metadata))
             
             return documents
             
         except Exception as e:
             print(f"Error during retrieval: {e}")
+            metrics.increment("errors_total", stage="vector_search")
+            # The handle may be stale (e.g. index recreated); refetch next time
+            self.reset_index()
             return []
 
+def _get_search_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by every retriever's search_many() calls."""
+    global _search_executor
+    with _shared_lock:
+        if _search_executor is None:
+            _search_executor = ThreadPoolExecutor(
+                max_workers=SEARCH_MANY_CONCURRENCY, thread_name_prefix="search"
+            )
+        return _search_executor
+
+
+_retriever_pool: "OrderedDict[Tuple[str, int], EndeeRetriever]" = OrderedDict()
+_retriever_pool_lock = threading.Lock()
+
+
 def get_retriever(codebase_name: str, top_k: int = 5):
-    return EndeeRetriever(index_name=codebase_name, top_k=top_k)
+    """
+    Returns a long-lived retriever for a codebase.
+
+    Retrievers are pooled per (codebase, top_k) and share one Endee client and
+    embedding model, so repeated tool calls skip client setup and the index
+    lookup. At most RETRIEVER_POOL_SIZE are kept.
+    """
+    key = (codebase_name, top_k)
+    with _retriever_pool_lock:
+        retriever = _retriever_pool.get(key)
+        if retriever is None:
+            retriever = EndeeRetriever(index_name=codebase_name, top_k=top_k)
+            _retriever_pool[key] = retriever
+            while len(_retriever_pool) > RETRIEVER_POOL_SIZE:
+                _retriever_pool.popitem(last=False)
+        else:
+            _retriever_pool.move_to_end(key)
+        return retriever
+
+
+def invalidate_retriever(codebase_name: str):
+    """Drops pooled retrievers and cached results for a codebase, e.g. after it was re-ingested."""
+    with _retriever_pool_lock:
+        for key in [key for key in _retriever_pool if key[0] == codebase_name]:
+            del _retriever_pool[key]
+    get_query_cache().invalidate(codebase_name)
+    get_tool_cache().invalidate(codebase_name)
@@ -0,0 +1,571 @@
+"""
+Headless query service: the retriever and the agent behind a local HTTP API.
+
+    python server.py --port 8765
+    python server.py --unix /tmp/endee.sock
+
+Endpoints (JSON bodies and responses):
+    GET    /health                       queue depths and session count
+    GET    /metrics                      Prometheus text
+    POST   /search                       {codebase, query | queries, filters?, top_k?}
+    POST   /sessions                     {codebase} -> {session_id}
+    GET    /sessions/<id>                the session's messages
+    DELETE /sessions/<id>
+    POST   /sessions/<id>/messages       {message, stream?}; with stream, NDJSON events
+
+Blocking work runs on bounded thread pools. A request that finds a pool's
+workers and queue full gets 503 with Retry-After instead of piling up.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+import metrics
+from manifest import is_indexed_codebase
+
+load_dotenv()
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8765))
+# Concurrent agent turns; each holds a thread for the whole ReAct loop
+SERVER_AGENT_WORKERS = int(os.getenv("SERVER_AGENT_WORKERS", 4))
+SERVER_SEARCH_WORKERS = int(os.getenv("SERVER_SEARCH_WORKERS", 8))
+# Requests allowed to wait for a worker, per pool, before new ones get 503
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", 64))
+SERVER_MAX_SESSIONS = int(os.getenv("SERVER_MAX_SESSIONS", 1000))
+# Compiled agents kept, one per codebase; the least recently used is dropped beyond this
+SERVER_MAX_AGENTS = int(os.getenv("SERVER_MAX_AGENTS", 16))
+# Idle sessions are dropped after this many seconds
+SERVER_SESSION_TTL = float(os.getenv("SERVER_SESSION_TTL", 3600))
+MAX_BODY_BYTES = 1024 * 1024
+MAX_SEARCH_TOP_K = 50
+RETRY_AFTER_SECONDS = 1
+ROUTES = ("health", "metrics", "search", "sessions")
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Overloaded(HTTPError):
+    def __init__(self, pool: str):
+        super().__init__(503, f"The {pool} pool is at capacity, retry later",
+                         {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+class WorkerPool:
+    """
+    Thread pool with admission control: at most `workers` jobs run and at
+    most `max_queue` wait; anything beyond that is rejected immediately.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int = SERVER_MAX_QUEUE):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"server-{name}")
+
+    def _admit(self):
+        if self.active + self.waiting >= self.workers + self.max_queue:
+            metrics.increment("server_rejected_total", pool=self.name)
+            raise Overloaded(self.name)
+        self.waiting += 1
+        metrics.set_gauge("server_queue_depth", self.waiting, pool=self.name)
+
+    async def _acquire(self):
+        self._admit()
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("server_queue_depth", self.waiting, pool=self.name)
+        self.active += 1
+        metrics.observe("server_queue_seconds", time.perf_counter() - start, pool=self.name)
+
+    def _release(self):
+        self.active -= 1
+        self._slots.release()
+
+    async def run(self, func: Callable, *args):
+        """Runs func(*args) on the pool once a worker is free."""
+        await self._acquire()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._release()
+
+    async def stream(self, iterator_factory: Callable, cancelled: threading.Event):
+        """
+        Runs a blocking generator on the pool and yields its items as they
+        are produced. Setting `cancelled` stops it at the next item.
+        """
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for item in iterator_factory():
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+                    if cancelled.is_set():
+                        break
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+            # Frees the slot only once the worker thread has actually stopped
+            future.add_done_callback(lambda _: self._release())
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.workers, "active": self.active, "waiting": self.waiting,
+                "max_queue": self.max_queue}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Session:
+    """One conversation: its codebase, its messages and a lock so turns run one at a time."""
+
+    def __init__(self, codebase_name: str):
+        self.id = uuid.uuid4().hex
+        self.codebase_name = codebase_name
+        self.messages: List[BaseMessage] = []
+        # Only ever acquired without blocking, so it never stalls the event loop
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "codebase": self.codebase_name,
+            "messages": [
+                {"role": "user" if isinstance(m, HumanMessage) else "assistant", "content": m.content}
+                for m in self.messages
+            ],
+        }
+
+
+def _document_dict(doc) -> Dict[str, Any]:
+    return {"content": doc.page_content, "metadata": doc.metadata}
+
+
+class QueryService:
+    """
+    Routes requests to the retriever and the agent. Agents are built once
+    per codebase; a compiled agent holds no conversation state, so one is
+    shared by every session of that codebase. At most SERVER_MAX_AGENTS
+    are kept.
+    """
+
+    def __init__(self, agent_workers: int = SERVER_AGENT_WORKERS,
+                 search_workers: int = SERVER_SEARCH_WORKERS, max_queue: int = SERVER_MAX_QUEUE,
+                 max_sessions: int = SERVER_MAX_SESSIONS, session_ttl: float = SERVER_SESSION_TTL,
+                 agent_factory: Optional[Callable[[str], Any]] = None):
+        self.agent_pool = WorkerPool("agent", agent_workers, max_queue)
+        self.search_pool = WorkerPool("search", search_workers, max_queue)
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.sessions: Dict[str, Session] = {}
+        self._agent_factory = agent_factory
+        self._agents: "OrderedDict[str, Any]" = OrderedDict()
+        self._agents_lock = threading.Lock()
+
+    def _get_agent(self, codebase_name: str):
+        with self._agents_lock:
+            agent = self._agents.get(codebase_name)
+            if agent is None:
+                if self._agent_factory is None:
+                    from agent import get_agent
+                    self._agent_factory = get_agent
+                agent = self._agents[codebase_name] = self._agent_factory(codebase_name)
+                while len(self._agents) > SERVER_MAX_AGENTS:
+                    self._agents.popitem(last=False)
+            else:
+                self._agents.move_to_end(codebase_name)
+            return agent
+
+    def _expire_sessions(self):
+        cutoff = time.monotonic() - self.session_ttl
+        for session_id in [s.id for s in self.sessions.values() if s.last_used < cutoff and not s.lock.locked()]:
+            del self.sessions[session_id]
+        metrics.set_gauge("server_sessions", len(self.sessions))
+
+    def _session(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"Unknown session {session_id}")
+        session.last_used = time.monotonic()
+        return session
+
+    # --- handlers ---
+
+    async def health(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "sessions": len(self.sessions),
+            "pools": {"agent": self.agent_pool.stats(), "search": self.search_pool.stats()},
+        }
+
+    async def search(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        from retrieval import get_retriever
+
+        codebase_name = _codebase(body)
+        top_k = body.get("top_k", 5)
+        if not isinstance(top_k, int) or not 0 < top_k <= MAX_SEARCH_TOP_K:
+            raise HTTPError(400, f"top_k must be an integer between 1 and {MAX_SEARCH_TOP_K}")
+        filters = body.get("filters")
+        retriever = get_retriever(codebase_name, top_k=top_k)
+        if "queries" in body:
+            queries = body["queries"]
+            if not isinstance(queries, list) or not queries or not all(isinstance(q, str) for q in queries):
+                raise HTTPError(400, "'queries' must be a non-empty list of strings")
+            docs = await self.search_pool.run(retriever.search_many, queries, filters)
+        else:
+            docs = await self.search_pool.run(retriever.search, _require(body, "query", str), filters)
+        return {"results": [_document_dict(doc) for doc in docs]}
+
+    async def create_session(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self._expire_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "Too many open sessions", {"Retry-After": str(RETRY_AFTER_SECONDS)})
+        session = Session(_codebase(body))
+        self.sessions[session.id] = session
+        metrics.set_gauge("server_sessions", len(self.sessions))
+        return 201, {"session_id": session.id, "codebase": session.codebase_name}
+
+    async def get_session(self, body: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        return self._session(session_id).to_dict()
+
+    async def delete_session(self, body: Dict[str, Any], session_id: str) -> Tuple[int, None]:
+        self._session(session_id)
+        del self.sessions[session_id]
+        metrics.set_gauge("server_sessions", len(self.sessions))
+        return 204, None
+
+    def chat(self, body: Dict[str, Any], session_id: str):
+        """
+        Starts one agent turn and returns an async iterator of (event, data)
+        pairs in the order stream_agent produces them. The request is
+        validated here; the turn is recorded in the session once it finishes.
+        """
+        session = self._session(session_id)
+        text = _require(body, "message", str)
+        # Taken here rather than in _turn, so a second request cannot pass before the turn starts
+        if not session.lock.acquire(blocking=False):
+            raise HTTPError(409, "A message is already being answered in this session")
+        return self._turn(session, text)
+
+    async def _turn(self, session: Session, text: str):
+        """Runs a turn whose session lock chat() already holds, and releases it."""
+        try:
+            from agent import stream_agent
+
+            messages = session.messages + [HumanMessage(content=text)]
+            agent = await self.agent_pool.run(self._get_agent, session.codebase_name)
+            answer = ""
+            final = None
+            events = self.agent_pool.stream(lambda: stream_agent(agent, messages), threading.Event())
+            try:
+                async for event, data in events:
+                    if event == "token":
+                        answer += data["text"]
+                    elif event == "tool_call":
+                        # Text streamed before a tool call is intermediate reasoning
+                        answer = ""
+                    elif event == "final":
+                        final = data["message"].content
+                        data = {"content": final}
+                    yield event, data
+            finally:
+                # Stops the agent thread at its next event if the client went away
+                await events.aclose()
+            session.messages = messages + [AIMessage(content=final or answer)]
+            session.last_used = time.monotonic()
+        finally:
+            session.lock.release()
+
+    def shutdown(self):
+        self.agent_pool.shutdown()
+        self.search_pool.shutdown()
+
+
+def _require(body: Dict[str, Any], field: str, kind: type):
+    value = body.get(field)
+    if not isinstance(value, kind) or (kind is str and not value):
+        raise HTTPError(400, f"'{field}' is required")
+    return value
+
+
+def _codebase(body: Dict[str, Any]) -> str:
+    """The request's codebase, which must be one that was ingested; it names a state directory."""
+    codebase_name = _require(body, "codebase", str)
+    if not is_indexed_codebase(codebase_name):
+        raise HTTPError(404, f"Unknown codebase {codebase_name!r}")
+    return codebase_name
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Reads one HTTP/1.1 request; None when the client closed the connection."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), urlsplit(target).path, headers, body
+
+
+def _head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool,
+                   headers: Optional[Dict[str, str]] = None, content_type: str = "application/json"):
+    if payload is None:
+        body = b""
+    elif isinstance(payload, str):
+        body = payload.encode("utf-8")
+    else:
+        body = json.dumps(payload, default=str).encode("utf-8")
+    head = {
+        "Content-Type": content_type,
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+        **(headers or {}),
+    }
+    writer.write(_head(status, head) + body)
+    await writer.drain()
+
+
+class QueryServer:
+    """asyncio HTTP/1.1 front end (TCP or Unix socket) for a QueryService."""
+
+    def __init__(self, service: Optional[QueryService] = None):
+        self.service = service or QueryService()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _route(self, method: str, path: str) -> Tuple[Callable, Tuple[str, ...]]:
+        parts = [part for part in path.split("/") if part]
+        service = self.service
+        routes = {
+            ("GET", ("health",)): service.health,
+            ("POST", ("search",)): service.search,
+            ("POST", ("sessions",)): service.create_session,
+        }
+        if len(parts) == 2 and parts[0] == "sessions":
+            routes[("GET", tuple(parts))] = service.get_session
+            routes[("DELETE", tuple(parts))] = service.delete_session
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+            routes[("POST", tuple(parts))] = service.chat
+        handler = routes.get((method, tuple(parts)))
+        if handler is None:
+            if any(key[1] == tuple(parts) for key in routes):
+                raise HTTPError(405, f"{method} not allowed on {path}")
+            raise HTTPError(404, f"No route for {path}")
+        return handler, tuple(parts[1:2]) if len(parts) > 1 else ()
+
+    async def _stream(self, writer: asyncio.StreamWriter, events, keep_alive: bool):
+        """
+        Writes (event, data) pairs as chunked NDJSON. The first event is
+        awaited before the headers, so queueing and startup errors still get
+        a proper status code.
+        """
+        try:
+            first = await events.__anext__()
+        except StopAsyncIteration:
+            first = None
+        head = {
+            "Content-Type": "application/x-ndjson",
+            "Transfer-Encoding": "chunked",
+            "Connection": "keep-alive" if keep_alive else "close",
+        }
+        writer.write(_head(200, head))
+
+        def chunk(payload: Dict[str, Any]) -> bytes:
+            line = json.dumps(payload, default=str).encode("utf-8") + b"\n"
+            return f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n"
+
+        try:
+            if first is not None:
+                writer.write(chunk({"event": first[0], **first[1]}))
+                async for event, data in events:
+                    writer.write(chunk({"event": event, **data}))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            # Headers are already out; report the failure in-band
+            print(f"Error during streamed agent turn: {e}")
+            metrics.increment("errors_total", stage="server_request")
+            writer.write(chunk({"event": "error", "error": str(e)}))
+        finally:
+            await events.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], raw_body: bytes,
+                      writer: asyncio.StreamWriter, keep_alive: bool):
+        if method == "GET" and path == "/metrics":
+            await _respond(writer, 200, metrics.registry.export_prometheus(), keep_alive,
+                           content_type="text/plain; version=0.0.4")
+            return
+        handler, args = self._route(method, path)
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+
+        if handler == self.service.chat:
+            events = handler(body, *args)
+            if body.get("stream"):
+                await self._stream(writer, events, keep_alive)
+                return
+            answer = None
+            tool_calls = []
+            async for event, data in events:
+                if event == "tool_call":
+                    tool_calls.append({"name": data["name"], "args": data["args"]})
+                elif event == "final":
+                    answer = data["content"]
+            await _respond(writer, 200, {"answer": answer, "tool_calls": tool_calls}, keep_alive)
+            return
+
+        result = await handler(body, *args)
+        status, payload = result if isinstance(result, tuple) else (200, result)
+        await _respond(writer, status, payload, keep_alive)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    await _respond(writer, e.status, {"error": str(e)}, False, e.headers)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                route = path.strip("/").split("/")[0]
+                if route not in ROUTES:
+                    # Keeps the metric's label set bounded
+                    route = "other"
+                with metrics.span("server_request", route=route):
+                    try:
+                        await self._handle(method, path, headers, body, writer, keep_alive)
+                    except HTTPError as e:
+                        await _respond(writer, e.status, {"error": str(e)}, keep_alive, e.headers)
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        raise
+                    except Exception as e:
+                        print(f"Error handling {method} {path}: {e}")
+                        metrics.increment("errors_total", stage="server_request")
+                        await _respond(writer, 500, {"error": str(e)}, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host: str = SERVER_HOST, port: int = SERVER_PORT,
+                    unix_path: Optional[str] = None) -> asyncio.AbstractServer:
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self._server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+            print(f"Serving queries on unix:{unix_path}")
+        else:
+            self._server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+            bound = self._server.sockets[0].getsockname()
+            print(f"Serving queries on http://{bound[0]}:{bound[1]}")
+        return self._server
+
+    async def serve_forever(self, **kwargs):
+        server = await self.start(**kwargs)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.service.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve codebase search and the agent over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--unix", help="Listen on this Unix socket instead of TCP")
+    args = parser.parse_args()
+
+    metrics.write_file_at_exit()
+    try:
+        asyncio.run(QueryServer().serve_forever(host=args.host, port=args.port, unix_path=args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
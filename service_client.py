@@ -0,0 +1,140 @@
+import http.client
+import json
+import os
+import socket
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# http://host:port or unix:///path/to/socket
+QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL", "")
+QUERY_SERVICE_TIMEOUT = float(os.getenv("QUERY_SERVICE_TIMEOUT", 300))
+
+
+class ServiceError(Exception):
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class QueryClient:
+    """
+    Blocking client for the query service in server.py. Keeps one
+    keep-alive connection, so use one client per thread.
+    """
+
+    def __init__(self, url: Optional[str] = None, timeout: float = QUERY_SERVICE_TIMEOUT):
+        self.url = url or QUERY_SERVICE_URL
+        if not self.url:
+            raise ValueError("No query service URL given and QUERY_SERVICE_URL is not set")
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            parts = urlsplit(self.url)
+            if parts.scheme == "unix":
+                self._conn = _UnixConnection(parts.path, self.timeout)
+            else:
+                self._conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _send(self, method: str, path: str, payload: Optional[Dict[str, Any]]) -> http.client.HTTPResponse:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connect()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _error(response: http.client.HTTPResponse, raw: bytes) -> ServiceError:
+        try:
+            message = json.loads(raw).get("error", "")
+        except ValueError:
+            message = raw.decode("utf-8", errors="replace")
+        retry_after = response.getheader("Retry-After")
+        return ServiceError(response.status, message, float(retry_after) if retry_after else None)
+
+    def request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Any:
+        response = self._send(method, path, payload)
+        raw = response.read()
+        if response.status >= 400:
+            raise self._error(response, raw)
+        return json.loads(raw) if raw else None
+
+    def health(self) -> Dict[str, Any]:
+        return self.request("GET", "/health")
+
+    def search(self, codebase_name: str, query: str, filters: Optional[Dict[str, Any]] = None,
+               top_k: int = 5) -> List[Dict[str, Any]]:
+        payload = {"codebase": codebase_name, "query": query, "top_k": top_k}
+        if filters:
+            payload["filters"] = filters
+        return self.request("POST", "/search", payload)["results"]
+
+    def search_many(self, codebase_name: str, queries: List[str], filters: Optional[Any] = None,
+                    top_k: int = 5) -> List[Dict[str, Any]]:
+        payload = {"codebase": codebase_name, "queries": queries, "top_k": top_k}
+        if filters:
+            payload["filters"] = filters
+        return self.request("POST", "/search", payload)["results"]
+
+    def create_session(self, codebase_name: str) -> str:
+        return self.request("POST", "/sessions", {"codebase": codebase_name})["session_id"]
+
+    def get_session(self, session_id: str) -> Dict[str, Any]:
+        return self.request("GET", f"/sessions/{session_id}")
+
+    def delete_session(self, session_id: str):
+        self.request("DELETE", f"/sessions/{session_id}")
+
+    def ask(self, session_id: str, message: str) -> Dict[str, Any]:
+        """Runs one agent turn and returns {answer, tool_calls}."""
+        return self.request("POST", f"/sessions/{session_id}/messages", {"message": message})
+
+    def stream(self, session_id: str, message: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Runs one agent turn, yielding stream_agent-style (event, data) pairs;
+        "final" carries {"content"} instead of a message object.
+        """
+        response = self._send("POST", f"/sessions/{session_id}/messages",
+                              {"message": message, "stream": True})
+        if response.status >= 400:
+            raise self._error(response, response.read())
+        try:
+            for line in iter(response.readline, b""):
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                event = data.pop("event")
+                if event == "error":
+                    raise ServiceError(500, data.get("error", ""))
+                yield event, data
+        finally:
+            # An abandoned stream leaves unread data on the connection
+            if not response.isclosed():
+                self.close()
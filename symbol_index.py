@@ -0,0 +1,299 @@
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from manifest import get_state_dir, write_json_atomic
+
+SYMBOLS_VERSION = 1
+
+# Call node type -> field holding the called expression
+CALL_NODE_TYPES = {
+    "python": {"call": "function"},
+    "javascript": {"call_expression": "function", "new_expression": "constructor"},
+    "java": {"method_invocation": "name", "object_creation_expression": "type"},
+    "cpp": {"call_expression": "function"},
+    "go": {"call_expression": "function"},
+    "rust": {"call_expression": "function", "macro_invocation": "macro"},
+    "zig": {"call_expression": "function"},
+    "bash": {"command": "name"},
+}
+
+IMPORT_NODE_TYPES = {
+    "python": {"import_statement", "import_from_statement"},
+    "javascript": {"import_statement"},
+    "java": {"import_declaration"},
+    "cpp": {"preproc_include"},
+    "go": {"import_declaration"},
+    "rust": {"use_declaration"},
+}
+
+# Definitions that open a new caller scope for call edges
+FUNCTION_NODE_TYPES = {
+    "function_definition",
+    "function_declaration",
+    "generator_function_declaration",
+    "method_definition",
+    "method_declaration",
+    "constructor_declaration",
+    "function_item",
+}
+
+IDENTIFIER_NODE_TYPES = {
+    "identifier",
+    "type_identifier",
+    "field_identifier",
+    "property_identifier",
+}
+
+MODULE_SCOPE = "<module>"
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def extract_file_symbols(
+    root_node,
+    content,
+    language: str,
+    definition_types: Set[str],
+    container_types: Set[str],
+    name_of: Callable[[Any, Any], str],
+) -> Dict[str, Any]:
+    """
+    Walks a syntax tree once and records definitions, references, imports
+    and call edges for a file.
+
+    `name_of` is the same node-naming function used for chunking, so symbol
+    names line up with block names in the other indexes.
+    """
+    call_types = CALL_NODE_TYPES.get(language, {})
+    import_types = IMPORT_NODE_TYPES.get(language, set())
+
+    def text(node) -> str:
+        return content[node.start_byte : node.end_byte].decode("utf-8", errors="ignore")
+
+    definitions = []
+    references: Dict[str, List[int]] = {}
+    imports = []
+    calls = []
+    definition_name_bytes = set()
+
+    # Iterative walk; each entry carries the enclosing function and container
+    stack: List[Tuple[Any, Optional[str], Optional[str]]] = [(root_node, None, None)]
+    while stack:
+        node, function, container = stack.pop()
+        node_type = node.type
+        line = node.start_point[0] + 1
+
+        if node_type in definition_types:
+            name = name_of(node, content)
+            name_node = node.child_by_field_name("name")
+            if name_node is not None:
+                definition_name_bytes.add(name_node.start_byte)
+            definitions.append({
+                "name": name,
+                "kind": node_type,
+                "line": line,
+                "end_line": node.end_point[0] + 1,
+                "container": container,
+            })
+            if node_type in container_types:
+                container = name
+            elif node_type in FUNCTION_NODE_TYPES:
+                function = name
+        elif node_type in import_types:
+            statement = text(node)
+            imports.append({
+                "text": statement.splitlines()[0][:200] if statement else "",
+                "names": sorted(set(IDENTIFIER_RE.findall(statement))),
+                "line": line,
+            })
+            continue
+        elif node_type in call_types:
+            callee_node = node.child_by_field_name(call_types[node_type])
+            if callee_node is not None:
+                # obj.method / ns::func / self.helper -> the last identifier
+                identifiers = IDENTIFIER_RE.findall(text(callee_node))
+                if identifiers:
+                    calls.append({
+                        "caller": function or MODULE_SCOPE,
+                        "container": container,
+                        "callee": identifiers[-1],
+                        "line": line,
+                    })
+        elif node_type in IDENTIFIER_NODE_TYPES and node.start_byte not in definition_name_bytes:
+            lines = references.setdefault(text(node), [])
+            if not lines or lines[-1] != line:
+                lines.append(line)
+
+        for i in range(node.child_count - 1, -1, -1):
+            stack.append((node.child(i), function, container))
+
+    return {
+        "definitions": definitions,
+        "references": references,
+        "imports": imports,
+        "calls": calls,
+    }
+
+
+class SymbolIndex:
+    """
+    Persistent symbol table and call graph for a codebase.
+
+    Per-file records from extract_file_symbols are stored as-is; inverted
+    maps keyed by symbol name give O(1) lookups of definitions, references,
+    callers and callees.
+    """
+
+    def __init__(self, codebase_name: str, path: Optional[Path] = None):
+        self.codebase_name = codebase_name
+        self.path = path or get_state_dir(codebase_name) / "symbols.json"
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # name -> {file_path: [entries]}
+        self.definitions: Dict[str, Dict[str, list]] = {}
+        self.references: Dict[str, Dict[str, list]] = {}
+        self.callers: Dict[str, Dict[str, list]] = {}
+        self.callees: Dict[str, Dict[str, list]] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, codebase_name: str, path: Optional[Path] = None) -> "SymbolIndex":
+        index = cls(codebase_name, path)
+        if index.path.exists():
+            try:
+                with open(index.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == SYMBOLS_VERSION:
+                    for file_path, record in data.get("files", {}).items():
+                        index.update_file(file_path, record)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable symbol index {index.path}: {e}")
+        return index
+
+    def save(self):
+        with self._lock:
+            data = {"version": SYMBOLS_VERSION, "files": dict(self.files)}
+        write_json_atomic(self.path, data)
+
+    def _inverted(self, file_path: str, record: Dict[str, Any]):
+        """Yields (map, name, entry) for every inverted-map entry of a file record."""
+        for definition in record["definitions"]:
+            yield self.definitions, definition["name"], definition
+        for name, lines in record["references"].items():
+            yield self.references, name, {"lines": lines, "kind": "reference"}
+        for imported in record["imports"]:
+            for name in imported["names"]:
+                yield self.references, name, {"lines": [imported["line"]], "kind": "import", "text": imported["text"]}
+        for call in record["calls"]:
+            yield self.callers, call["callee"], call
+            yield self.callees, call["caller"], call
+
+    def update_file(self, file_path: str, record: Dict[str, Any]):
+        with self._lock:
+            self.remove_file(file_path)
+            self.files[file_path] = record
+            for mapping, name, entry in self._inverted(file_path, record):
+                mapping.setdefault(name, {}).setdefault(file_path, []).append(entry)
+
+    def remove_file(self, file_path: str):
+        with self._lock:
+            record = self.files.pop(file_path, None)
+            if not record:
+                return
+            for mapping, name, _ in self._inverted(file_path, record):
+                by_file = mapping.get(name)
+                if by_file is not None:
+                    by_file.pop(file_path, None)
+                    if not by_file:
+                        del mapping[name]
+
+    @staticmethod
+    def _split_qualified(symbol: str) -> Tuple[Optional[str], str]:
+        """'Class.method' / 'ns::func' -> ('Class', 'method')."""
+        parts = [part for part in re.split(r"\.|::", symbol.strip().rstrip("()")) if part]
+        if len(parts) > 1:
+            return parts[-2], parts[-1]
+        return None, parts[-1] if parts else ""
+
+    def find_definitions(self, symbol: str) -> List[Dict[str, Any]]:
+        container, name = self._split_qualified(symbol)
+        with self._lock:
+            results = []
+            for file_path, entries in self.definitions.get(name, {}).items():
+                for entry in entries:
+                    if container and entry.get("container") != container:
+                        continue
+                    results.append(dict(entry, file_path=file_path))
+            return results
+
+    def find_references(self, symbol: str) -> List[Dict[str, Any]]:
+        _, name = self._split_qualified(symbol)
+        with self._lock:
+            results = []
+            call_sites = self.callers.get(name, {})
+            for file_path, entries in self.references.get(name, {}).items():
+                # Identifiers at a call site are reported once, as the call
+                call_lines = {call["line"] for call in call_sites.get(file_path, [])}
+                for entry in entries:
+                    lines = [line for line in entry["lines"] if entry["kind"] != "reference" or line not in call_lines]
+                    if lines:
+                        results.append(dict(entry, lines=lines, file_path=file_path))
+            for file_path, entries in call_sites.items():
+                for call in entries:
+                    results.append({
+                        "file_path": file_path,
+                        "lines": [call["line"]],
+                        "kind": "call",
+                        "caller": call["caller"],
+                    })
+            return results
+
+    def call_graph(self, symbol: str, depth: int = 1, direction: str = "both") -> Dict[str, Any]:
+        """
+        Returns caller and/or callee edges around a symbol, up to `depth` hops.
+
+        Edges are (caller, callee, file_path, line) tuples.
+        """
+        _, name = self._split_qualified(symbol)
+        graph: Dict[str, Any] = {"symbol": name, "callers": [], "callees": []}
+        with self._lock:
+            for key, mapping in (("callers", self.callers), ("callees", self.callees)):
+                if direction not in ("both", key):
+                    continue
+                seen = {name}
+                frontier = [name]
+                for _ in range(max(depth, 1)):
+                    next_frontier = []
+                    for current in frontier:
+                        for file_path, calls in mapping.get(current, {}).items():
+                            for call in calls:
+                                graph[key].append((call["caller"], call["callee"], file_path, call["line"]))
+                                other = call["caller"] if key == "callers" else call["callee"]
+                                if other not in seen:
+                                    seen.add(other)
+                                    next_frontier.append(other)
+                    frontier = next_frontier
+        return graph
+
+
+_indexes: Dict[str, Tuple[int, SymbolIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_symbol_index(codebase_name: str) -> SymbolIndex:
+    """
+    Returns the symbol index for a codebase, reloading it if it changed on disk.
+    """
+    path = get_state_dir(codebase_name) / "symbols.json"
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    with _indexes_lock:
+        cached = _indexes.get(codebase_name)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, SymbolIndex.load(codebase_name, path))
+            _indexes[codebase_name] = cached
+        return cached[1]
@@ -0,0 +1,136 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import metrics
+from manifest import index_version
+
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", 512))
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", 600))
+
+CacheKey = Tuple[str, str, str]
+
+
+def _args_key(args: Dict[str, Any]) -> str:
+    return json.dumps(args, sort_keys=True, default=str)
+
+
+class ToolCache:
+    """
+    Size-bounded LRU cache of agent tool results.
+
+    Entries are keyed by (codebase, tool, arguments) and remember the version
+    they were computed against: the codebase's index version by default, or
+    whatever a tool's version function returns (e.g. directory mtimes for a
+    tree listing). A lookup against a different version is a miss, so
+    re-ingestion and filesystem changes invalidate entries without any
+    explicit bookkeeping. Entries also expire after a TTL.
+    """
+
+    def __init__(self, capacity: int = TOOL_CACHE_SIZE, ttl: float = TOOL_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # tool -> [hits, misses]
+        self._by_tool: Dict[str, list] = {}
+        # key -> (version, expires_at, result)
+        self._entries: "OrderedDict[CacheKey, Tuple[Hashable, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, tool: str, hit: bool):
+        counts = self._by_tool.setdefault(tool, [0, 0])
+        if hit:
+            self.hits += 1
+            counts[0] += 1
+        else:
+            self.misses += 1
+            counts[1] += 1
+        metrics.increment("tool_cache_hits_total" if hit else "tool_cache_misses_total", tool=tool)
+
+    def get(self, codebase_name: str, tool: str, args: Dict[str, Any], version: Hashable) -> Optional[Any]:
+        """Returns the cached result or None; counts a hit or a miss."""
+        key = (codebase_name, tool, _args_key(args))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != version or entry[1] <= time.monotonic()):
+                del self._entries[key]
+                entry = None
+            self._count(tool, entry is not None)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, codebase_name: str, tool: str, args: Dict[str, Any], version: Hashable, result: Any):
+        if self.capacity <= 0 or result is None:
+            return
+        key = (codebase_name, tool, _args_key(args))
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def cached(self, codebase_name: str, tool: str,
+               version: Optional[Callable[..., Hashable]] = None):
+        """
+        Decorator that serves a function's result from the cache.
+
+        `version` receives the call's arguments (defaults applied) and returns
+        the version to key on; it defaults to the codebase's index version.
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                arguments = dict(bound.arguments)
+                current = version(**arguments) if version else index_version(codebase_name)
+                result = self.get(codebase_name, tool, arguments, current)
+                if result is None:
+                    result = func(*args, **kwargs)
+                    self.put(codebase_name, tool, arguments, current, result)
+                return result
+            return wrapper
+        return decorator
+
+    def invalidate(self, codebase_name: Optional[str] = None):
+        """Drops every entry, or only those of one codebase."""
+        with self._lock:
+            for key in [key for key in self._entries if codebase_name is None or key[0] == codebase_name]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "by_tool": {
+                    tool: {"hits": hits, "misses": misses}
+                    for tool, (hits, misses) in sorted(self._by_tool.items())
+                },
+            }
+
+
+_tool_cache: Optional[ToolCache] = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> ToolCache:
+    """Returns the process-wide tool-result cache. TOOL_CACHE_SIZE=0 disables it."""
+    global _tool_cache
+    with _tool_cache_lock:
+        if _tool_cache is None:
+            _tool_cache = ToolCache()
+        return _tool_cache
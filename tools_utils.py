@@ -1,38 +1,58 @@
-from typing import Optional
-from functools import lru_cache
-from seedir.folderstructure import listdir_fullpath
-import pathlib
+import os
+from typing import Optional, Tuple
 import seedir as sd
+from file_discovery import DEFAULT_EXCLUDES, IGNORE_FILE_NAME, FileDiscovery
+from tool_cache import get_tool_cache
 
-@lru_cache(maxsize=20)
-def get_directory_diag(directory: str, depth: Optional[int] = 3):
-    """Creates a directory diagnostic using seedir."""
-    excluded_patterns = get_excluded_patterns()
-    diag_string = sd.seedir(
-        directory,
-        style="lines",
-        depthlimit=depth,
-        exclude_list=excluded_patterns,
-    )
-    return diag_string
-
-def get_excluded_patterns(gitignore_name: str = ".gitignore") -> list:
+def directory_version(directory: str, depth: Optional[int] = 3) -> Tuple[int, int]:
     """
-    Reads patterns from .gitignore and adds common system exclusions.
+    Cheap fingerprint of a directory tree down to `depth`: the newest mtime
+    of every listed directory (and its .gitignore) plus their count. Adding,
+    removing or renaming an entry changes a directory's mtime.
     """
-    gitignore_path = pathlib.Path(gitignore_name)
-    exclude_list = {".git", "__pycache__", ".venv", ".DS_Store"}
-
-    if gitignore_path.exists():
+    newest = 0
+    count = 0
+    stack = [(directory, 0)]
+    while stack:
+        path, level = stack.pop()
+        for candidate in (path, os.path.join(path, IGNORE_FILE_NAME)):
+            try:
+                newest = max(newest, os.stat(candidate).st_mtime_ns)
+            except OSError:
+                pass
+        count += 1
+        if depth is not None and level + 1 >= depth:
+            continue
         try:
-            with gitignore_path.open("r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith("#") or line.startswith("!"):
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name in DEFAULT_EXCLUDES or entry.name.startswith("."):
                         continue
-                    pattern = line.rstrip("/")
-                    exclude_list.add(pattern)
-        except (PermissionError, IOError):
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, level + 1))
+        except OSError:
             pass
+    return newest, count
 
-    return list(exclude_list)
+def get_directory_diag(directory: str, depth: Optional[int] = 3):
+    """
+    Creates a directory diagnostic using seedir, hiding whatever file
+    discovery would skip (nested .gitignore rules, vendored folders, hidden
+    entries). Results are cached until the tree changes.
+    """
+    directory = os.path.abspath(directory)
+    cache = get_tool_cache()
+    args = {"directory": directory, "depth": depth}
+    version = directory_version(directory, depth)
+    diag_string = cache.get("", "directory_tree", args, version)
+    if diag_string is None:
+        discovery = FileDiscovery(directory, max_file_size=None, skip_binary=False)
+        diag_string = sd.seedir(
+            directory,
+            style="lines",
+            depthlimit=depth,
+            mask=lambda path: not discovery.is_excluded(path),
+            printout=False,
+        )
+        cache.put("", "directory_tree", args, version, diag_string)
+    return diag_string
@@ -1,14 +1,10 @@
+import importlib
+import threading
+from typing import Dict, Literal
+
 from tree_sitter import Language, Parser
-from typing import Literal
 
-import tree_sitter_bash as tsbash
-import tree_sitter_cpp as tscpp
-import tree_sitter_go as tsgo
-import tree_sitter_java as tsjava
-import tree_sitter_javascript as tsjavascript
-import tree_sitter_python as tspython
-import tree_sitter_rust as tsrust
-import tree_sitter_zig as tszig
+import metrics
 
 LanguageName = Literal[
     "bash",
@@ -21,38 +17,72 @@ LanguageName = Literal[
     "zig",
 ]
 
-LANGUAGES = {
-    "bash": Language(tsbash.language()),
-    "cpp": Language(tscpp.language()),
-    "go": Language(tsgo.language()),
-    "java": Language(tsjava.language()),
-    "javascript": Language(tsjavascript.language()),
-    "python": Language(tspython.language()),
-    "rust": Language(tsrust.language()),
-    "zig": Language(tszig.language()),
+# Grammar packages are imported on first use; most runs only need a few
+GRAMMAR_MODULES: Dict[str, str] = {
+    "bash": "tree_sitter_bash",
+    "cpp": "tree_sitter_cpp",
+    "go": "tree_sitter_go",
+    "java": "tree_sitter_java",
+    "javascript": "tree_sitter_javascript",
+    "python": "tree_sitter_python",
+    "rust": "tree_sitter_rust",
+    "zig": "tree_sitter_zig",
 }
 
+_languages: Dict[str, Language] = {}
+_languages_lock = threading.Lock()
+# Parsers are not thread-safe, so each thread (and each pool worker) keeps its own
+_parsers = threading.local()
+
+
+def get_language(language: str) -> Language:
+    """Loads a grammar the first time it is needed and caches it for the process."""
+    if language not in GRAMMAR_MODULES:
+        raise ValueError(f"Unsupported language: {language}")
+    cached = _languages.get(language)
+    if cached is not None:
+        return cached
+    with _languages_lock:
+        if language not in _languages:
+            module = importlib.import_module(GRAMMAR_MODULES[language])
+            _languages[language] = Language(module.language())
+        return _languages[language]
+
+
+def get_parser(language: str) -> Parser:
+    """Returns this thread's reusable Parser for a language."""
+    parsers = getattr(_parsers, "by_language", None)
+    if parsers is None:
+        parsers = _parsers.by_language = {}
+    parser = parsers.get(language)
+    if parser is None:
+        parser = parsers[language] = Parser(get_language(language))
+    return parser
+
 
 class TreeSitter:
     """A wrapper around the tree-sitter parser."""
 
     def __init__(self, language: LanguageName = "python"):
         """Initializes the parser with a specific language."""
-        self._parser = Parser(LANGUAGES[language])
+        self.language = language
+        self._parser = get_parser(language)
 
     def set_language(self, language: LanguageName):
         """Sets the language of the parser.
 
-        This creates a new parser object for the specified language.
+        Switches to this thread's cached parser for the specified language.
         """
-        if language in LANGUAGES:
-            del self._parser
-            self._parser = Parser(LANGUAGES[language])
-        else:
-            raise ValueError(f"Unsupported language: {language}")
+        self._parser = get_parser(language)
+        self.language = language
 
     def parse(self, file_path: str):
         """Parses the given file and returns the Syntax Tree."""
         with open(file_path, "rb") as f:
             code_bytes = f.read()
-        return self._parser.parse(code_bytes)
+        return self.parse_bytes(code_bytes)
+
+    def parse_bytes(self, content):
+        """Parses already-loaded source (bytes or an mmap) and returns the Syntax Tree."""
+        with metrics.span("parse", language=self.language):
+            return self._parser.parse(content)
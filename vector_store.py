@@ -0,0 +1,645 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings import EMBEDDING_DIMENSION
+from manifest import get_state_dir, write_json_atomic
+
+# "endee" (remote service) or "local" (in-process, memory-mapped)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "endee").lower()
+LOCAL_STORE_VERSION = 1
+# Brute force is exact and fast enough below this many vectors
+LOCAL_IVF_MIN_VECTORS = int(os.getenv("LOCAL_IVF_MIN_VECTORS", 20_000))
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", 8))
+IVF_KMEANS_ITERATIONS = 10
+INITIAL_CAPACITY = 1024
+# First-pass representation kept in memory: "none" (float32), "int8" or "pq".
+# Full-precision vectors stay on disk and only the shortlist is read back.
+LOCAL_VECTOR_COMPRESSION = os.getenv("LOCAL_VECTOR_COMPRESSION", "none").lower()
+# Leading dimensions scored in the first pass (0 = all); text-embedding-004
+# supports truncated (elastic) output dimensions
+LOCAL_SEARCH_DIMENSION = int(os.getenv("LOCAL_SEARCH_DIMENSION", 0))
+# Reduced first passes rerank top_k * this many candidates at full precision
+LOCAL_RERANK_FACTOR = int(os.getenv("LOCAL_RERANK_FACTOR", 8))
+LOCAL_PQ_SUBVECTORS = int(os.getenv("LOCAL_PQ_SUBVECTORS", 96))
+# PQ codebooks are trained once the store has this many vectors; smaller
+# stores are searched exactly
+LOCAL_PQ_MIN_VECTORS = int(os.getenv("LOCAL_PQ_MIN_VECTORS", 1024))
+PQ_CENTROIDS = 256
+PQ_TRAIN_SAMPLE = PQ_CENTROIDS * 40
+# Rows scored per step, which bounds the temporaries of a first pass
+SCORE_BLOCK_ROWS = 4096
+COMPRESSION_MODES = ("none", "int8", "pq")
+
+
+class VectorStore:
+    """
+    What ingestion and retrieval need from a vector index.
+
+    Items use the Endee upsert shape ({id, vector, meta, filter}) and search
+    results come back as {id, similarity, meta, filter} dicts.
+    """
+
+    def upsert(self, items: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def search(self, query: List[float], top_k: int,
+               filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete(self, ids: Iterable[str]) -> Tuple[int, List[str]]:
+        """Returns how many vectors were removed and the IDs that could not be deleted."""
+        raise NotImplementedError
+
+    def delete_file(self, file_path: str) -> bool:
+        """Removes every vector whose file_path is exactly `file_path`; False if that failed."""
+        raise NotImplementedError
+
+    def save(self):
+        """Persists pending writes; a no-op for remote backends."""
+
+
+class EndeeVectorStore(VectorStore):
+    """Adapter over a remote Endee index."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, items: List[Dict[str, Any]]):
+        self.index.upsert(items)
+
+    def search(self, query: List[float], top_k: int,
+               filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        query_args = {"vector": query, "top_k": top_k}
+        if filter:
+            # Endee takes a list of {field: {operator: value}} conditions
+            query_args["filter"] = [
+                {field: condition if isinstance(condition, dict) else {"$eq": condition}}
+                for field, condition in filter.items()
+            ]
+        return [
+            {
+                "id": hit["id"],
+                "similarity": hit.get("similarity", 0.0),
+                "meta": hit.get("meta") or {},
+                "filter": hit.get("filter") or {},
+            }
+            for hit in self.index.query(**query_args)
+        ]
+
+    def delete(self, ids: Iterable[str]) -> Tuple[int, List[str]]:
+        deleted = 0
+        failed = []
+        for block_id in ids:
+            try:
+                self.index.delete_vector(block_id)
+                deleted += 1
+            except Exception as e:
+                print(f"Error deleting stale block {block_id}: {e}")
+                failed.append(block_id)
+        return deleted, failed
+
+    def delete_file(self, file_path: str) -> bool:
+        try:
+            self.index.delete_with_filter([{"file_path": {"$eq": file_path}}])
+            return True
+        except Exception as e:
+            print(f"Error deleting the vectors of {file_path}: {e}")
+            return False
+
+
+def _filter_matches(field: str, value: Any, condition: Any) -> bool:
+    """Endee-style condition: a plain value, {"$eq": v} or {"$in": [...]}."""
+    if isinstance(condition, dict):
+        if "$in" in condition:
+            return value in condition["$in"]
+        condition = condition.get("$eq")
+    if field == "file_path" and isinstance(value, str) and isinstance(condition, str):
+        # Same partial-match semantics as the lexical index
+        return condition in value
+    return value == condition
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index over a memory-mapped float32 matrix.
+
+    Vectors are stored L2-normalized, so cosine top-k is one matrix-vector
+    product plus argpartition. Each filter field is kept as a column of
+    integer value codes; a filter becomes a boolean mask over rows via
+    np.isin. Above LOCAL_IVF_MIN_VECTORS an IVF (k-means) index is built
+    lazily and searches probe only the LOCAL_IVF_NPROBE closest lists.
+
+    With compression (int8 or product quantization) and/or a reduced search
+    dimension, the first pass scores compact in-memory codes instead, and
+    only the top_k * rerank_factor best candidates are read back from the
+    full-precision matrix on disk and reranked exactly.
+    """
+
+    def __init__(self, directory: Path, dimension: int = EMBEDDING_DIMENSION,
+                 compression: Optional[str] = None, search_dimension: Optional[int] = None,
+                 rerank_factor: Optional[int] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dimension = dimension
+        self.compression = (compression or LOCAL_VECTOR_COMPRESSION).lower()
+        if self.compression not in COMPRESSION_MODES:
+            print(f"Unknown vector compression '{self.compression}', storing float32 codes.")
+            self.compression = "none"
+        search_dimension = LOCAL_SEARCH_DIMENSION if search_dimension is None else search_dimension
+        self.search_dimension = min(search_dimension or dimension, dimension)
+        self.rerank_factor = max(1, LOCAL_RERANK_FACTOR if rerank_factor is None else rerank_factor)
+        # Largest subvector count up to LOCAL_PQ_SUBVECTORS that divides the search dimension
+        self.pq_subvectors = next(
+            m for m in range(min(LOCAL_PQ_SUBVECTORS, self.search_dimension), 0, -1)
+            if self.search_dimension % m == 0
+        )
+        self._vectors_path = self.directory / "vectors.f32"
+        self._state_path = self.directory / "state.json"
+        self._codes_path = self.directory / "codes.npz"
+        self._lock = threading.RLock()
+
+        # Row-aligned; deleted rows hold None and are reused
+        self.ids: List[Optional[str]] = []
+        self.meta: List[Optional[Dict[str, Any]]] = []
+        self.filters: List[Optional[Dict[str, Any]]] = []
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        # field -> (value -> code, codes per row; -1 = missing)
+        self._columns: Dict[str, Tuple[Dict[Any, int], np.ndarray]] = {}
+        self._ivf: Optional[Tuple[np.ndarray, np.ndarray, int]] = None
+        # First-pass codes per row (truncated float32, int8 or PQ uint8) and
+        # the int8 scales; None when searches score the full matrix
+        self._codes: Optional[np.ndarray] = None
+        self._scales = np.zeros(0, dtype=np.float32)
+        # (PQ codebooks [subvectors, PQ_CENTROIDS, sub-dimension], vectors trained on)
+        self._pq: Optional[Tuple[np.ndarray, int]] = None
+        # Bumped on every save, so codes can be matched to their state file
+        self._generation = 0
+        self.dirty = False
+        # mtime of the state file this instance last loaded or wrote
+        self.state_mtime = 0
+
+        self._capacity = 0
+        self._matrix: Optional[np.memmap] = None
+        self._live = np.zeros(0, dtype=bool)
+        self._load()
+
+    def count(self) -> int:
+        return len(self._rows)
+
+    @property
+    def reduced(self) -> bool:
+        """Whether searches score compact codes first and rerank at full precision."""
+        return self.compression != "none" or self.search_dimension < self.dimension
+
+    @property
+    def compressed(self) -> bool:
+        """
+        Whether the first pass currently scores compact codes. PQ needs
+        LOCAL_PQ_MIN_VECTORS vectors to train; smaller stores score float32.
+        """
+        return self._codes is not None
+
+    def footprint(self) -> Dict[str, Any]:
+        """Bytes per vector scanned by a search's first pass vs. kept on disk."""
+        full = self.dimension * 4
+        first_pass = full
+        if self._codes is not None:
+            first_pass = self._codes.shape[1] * self._codes.itemsize
+            if self.compression == "int8":
+                first_pass += self._scales.itemsize
+        return {
+            "vectors": self.count(),
+            "first_pass_bytes_per_vector": first_pass,
+            "full_bytes_per_vector": full,
+            "first_pass_mb": first_pass * self.count() / 2**20,
+        }
+
+    def _load(self):
+        state = {}
+        if self._state_path.exists():
+            try:
+                self.state_mtime = os.stat(self._state_path).st_mtime_ns
+                with open(self._state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("version") != LOCAL_STORE_VERSION or state.get("dimension") != self.dimension:
+                    state = {}
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable local vector store {self._state_path}: {e}")
+                state = {}
+        self._generation = state.get("generation", 0)
+
+        ids = state.get("ids", [])
+        self._resize(max(INITIAL_CAPACITY, len(ids)))
+        for row, block_id in enumerate(ids):
+            self.ids.append(block_id)
+            self.meta.append(state["meta"][row])
+            self.filters.append(state["filter"][row])
+            if block_id is None:
+                self._free.append(row)
+            else:
+                self._rows[block_id] = row
+                self._live[row] = True
+                self._set_columns(row, state["filter"][row])
+        if self.reduced:
+            self._load_codes()
+
+    def _codes_layout(self) -> str:
+        layout = f"{self.compression}:{self.search_dimension}"
+        return f"{layout}:{self.pq_subvectors}" if self.compression == "pq" else layout
+
+    def _load_codes(self):
+        rows = len(self.ids)
+        if self._codes_path.exists():
+            try:
+                with np.load(self._codes_path) as data:
+                    if (str(data["layout"]) == self._codes_layout()
+                            and int(data["generation"]) == self._generation
+                            and len(data["codes"]) == rows):
+                        codes = data["codes"]
+                        self._codes = np.zeros((self._capacity,) + codes.shape[1:], dtype=codes.dtype)
+                        self._codes[:rows] = codes
+                        self._scales[:rows] = data["scales"]
+                        if "codebooks" in data:
+                            self._pq = (data["codebooks"], int(data["trained_on"]))
+                        return
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable vector codes {self._codes_path}: {e}")
+        # Missing or stale (e.g. the settings changed): rebuild from the full
+        # vectors. PQ codebooks are retrained by the next search instead.
+        if self._codes is not None:
+            self._encode_rows(0, rows)
+
+    def _resize(self, capacity: int):
+        """Grows the memory-mapped matrix and the per-row arrays to `capacity` rows."""
+        size = capacity * self.dimension * 4
+        with open(self._vectors_path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(capacity, self.dimension))
+
+        live = np.zeros(capacity, dtype=bool)
+        live[: len(self._live)] = self._live
+        self._live = live
+        for field, (values, codes) in self._columns.items():
+            grown = np.full(capacity, -1, dtype=np.int32)
+            grown[: len(codes)] = codes
+            self._columns[field] = (values, grown)
+        if self._ivf is not None:
+            centroids, assignments, built_at = self._ivf
+            grown = np.full(capacity, -1, dtype=np.int32)
+            grown[: len(assignments)] = assignments
+            self._ivf = (centroids, grown, built_at)
+        if self._codes is None and self.reduced and self.compression != "pq":
+            dtype = np.int8 if self.compression == "int8" else np.float32
+            self._codes = np.zeros((0, self.search_dimension), dtype=dtype)
+        if self._codes is not None:
+            grown = np.zeros((capacity,) + self._codes.shape[1:], dtype=self._codes.dtype)
+            grown[: len(self._codes)] = self._codes
+            self._codes = grown
+        scales = np.ones(capacity, dtype=np.float32)
+        scales[: len(self._scales)] = self._scales
+        self._scales = scales
+        self._capacity = capacity
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """First-pass codes and scales for a batch of normalized full vectors."""
+        part = vectors[:, : self.search_dimension]
+        if self.search_dimension < self.dimension:
+            norms = np.linalg.norm(part, axis=1, keepdims=True)
+            part = part / np.where(norms > 0, norms, 1.0)
+        scales = np.ones(len(part), dtype=np.float32)
+        if self.compression == "int8":
+            # Symmetric per-vector scale, so a score is one int8 dot product times the scale
+            scales = (np.abs(part).max(axis=1) / 127).astype(np.float32)
+            scales[scales == 0] = 1.0
+            return np.rint(part / scales[:, None]).astype(np.int8), scales
+        if self.compression == "pq":
+            codebooks = self._pq[0]
+            subvectors, _, sub_dimension = codebooks.shape
+            # Nearest centroid by L2: argmax of x.c - |c|^2 / 2
+            half_norms = 0.5 * (codebooks ** 2).sum(axis=2)
+            codes = np.empty((len(part), subvectors), dtype=np.uint8)
+            for j in range(subvectors):
+                sub = part[:, j * sub_dimension : (j + 1) * sub_dimension]
+                codes[:, j] = np.argmax(sub @ codebooks[j].T - half_norms[j], axis=1)
+            return codes, scales
+        return part.astype(np.float32), scales
+
+    def _encode_rows(self, start: int, end: int):
+        for block in range(start, end, SCORE_BLOCK_ROWS):
+            block_end = min(end, block + SCORE_BLOCK_ROWS)
+            codes, scales = self._encode(np.asarray(self._matrix[block:block_end]))
+            self._codes[block:block_end] = codes
+            self._scales[block:block_end] = scales
+
+    def _train_pq(self, rows: int):
+        """k-means codebooks per subvector over a sample of the live vectors, then encodes every row."""
+        live_rows = np.flatnonzero(self._live[:rows])
+        rng = np.random.default_rng(0)
+        sample = rng.choice(live_rows, size=min(len(live_rows), PQ_TRAIN_SAMPLE), replace=False)
+        data = np.asarray(self._matrix[np.sort(sample)])[:, : self.search_dimension]
+        if self.search_dimension < self.dimension:
+            norms = np.linalg.norm(data, axis=1, keepdims=True)
+            data = data / np.where(norms > 0, norms, 1.0)
+
+        sub_dimension = self.search_dimension // self.pq_subvectors
+        codebooks = np.empty((self.pq_subvectors, PQ_CENTROIDS, sub_dimension), dtype=np.float32)
+        for j in range(self.pq_subvectors):
+            sub = data[:, j * sub_dimension : (j + 1) * sub_dimension]
+            centroids = sub[rng.choice(len(sub), size=PQ_CENTROIDS, replace=False)].copy()
+            for _ in range(IVF_KMEANS_ITERATIONS):
+                assignment = np.argmax(sub @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+                counts = np.bincount(assignment, minlength=PQ_CENTROIDS)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sub)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebooks[j] = centroids
+
+        self._pq = (codebooks, len(live_rows))
+        self._codes = np.zeros((self._capacity, self.pq_subvectors), dtype=np.uint8)
+        self._encode_rows(0, rows)
+
+    def _set_columns(self, row: int, filter_fields: Optional[Dict[str, Any]]):
+        for codes in self._columns.values():
+            codes[1][row] = -1
+        for field, value in (filter_fields or {}).items():
+            if field not in self._columns:
+                self._columns[field] = ({}, np.full(self._capacity, -1, dtype=np.int32))
+            values, codes = self._columns[field]
+            key = json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+            codes[row] = values.setdefault(key, len(values))
+
+    def upsert(self, items: List[Dict[str, Any]]):
+        with self._lock:
+            written: List[int] = []
+            for item in items:
+                vector = np.asarray(item["vector"], dtype=np.float32)
+                if vector.shape != (self.dimension,):
+                    print(f"Skipping {item['id']}: expected {self.dimension} dimensions, got {vector.shape}")
+                    continue
+                norm = float(np.linalg.norm(vector))
+                if norm:
+                    vector = vector / norm
+
+                row = self._rows.get(item["id"])
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = len(self.ids)
+                        if row >= self._capacity:
+                            self._resize(self._capacity * 2)
+                        self.ids.append(None)
+                        self.meta.append(None)
+                        self.filters.append(None)
+                    self._rows[item["id"]] = row
+
+                self._matrix[row] = vector
+                self.ids[row] = item["id"]
+                self.meta[row] = item.get("meta", {})
+                self.filters[row] = item.get("filter", {})
+                self._live[row] = True
+                self._set_columns(row, self.filters[row])
+                if self._ivf is not None:
+                    self._ivf[1][row] = int(np.argmax(self._ivf[0] @ vector))
+                written.append(row)
+            if written and self._codes is not None:
+                codes, scales = self._encode(np.asarray(self._matrix[written]))
+                self._codes[written] = codes
+                self._scales[written] = scales
+            self.dirty = True
+
+    def delete(self, ids: Iterable[str]) -> Tuple[int, List[str]]:
+        deleted = 0
+        with self._lock:
+            for block_id in ids:
+                row = self._rows.pop(block_id, None)
+                if row is None:
+                    continue
+                self.ids[row] = None
+                self.meta[row] = None
+                self.filters[row] = None
+                self._live[row] = False
+                self._free.append(row)
+                deleted += 1
+            if deleted:
+                self.dirty = True
+        return deleted, []
+
+    def delete_file(self, file_path: str) -> bool:
+        with self._lock:
+            ids = [
+                block_id for block_id, row in self._rows.items()
+                if (self.filters[row] or {}).get("file_path") == file_path
+            ]
+        self.delete(ids)
+        return True
+
+    def _filter_mask(self, filter: Optional[Dict[str, Any]], rows: int) -> np.ndarray:
+        mask = self._live[:rows].copy()
+        for field, condition in (filter or {}).items():
+            column = self._columns.get(field)
+            if column is None:
+                return np.zeros(rows, dtype=bool)
+            values, codes = column
+            matching = [code for value, code in values.items() if _filter_matches(field, value, condition)]
+            mask &= np.isin(codes[:rows], matching)
+        return mask
+
+    def _build_ivf(self, rows: int):
+        """Spherical k-means over a sample of the live vectors."""
+        live_rows = np.flatnonzero(self._live[:rows])
+        nlist = int(min(4096, max(16, np.sqrt(len(live_rows)))))
+        rng = np.random.default_rng(0)
+        sample = rng.choice(live_rows, size=min(len(live_rows), nlist * 64), replace=False)
+        data = np.asarray(self._matrix[np.sort(sample)])
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = data[assignment == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assignments = np.full(self._capacity, -1, dtype=np.int32)
+        for start in range(0, rows, 8192):
+            block = np.asarray(self._matrix[start : min(rows, start + 8192)])
+            assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        self._ivf = (centroids, assignments, len(live_rows))
+
+    def _approximate_scores(self, candidates: np.ndarray, q: np.ndarray, rows: int) -> np.ndarray:
+        """First-pass scores of candidate rows from their codes."""
+        part = q[: self.search_dimension]
+        norm = float(np.linalg.norm(part))
+        if norm:
+            part = part / norm
+        if self.compression == "pq":
+            codebooks = self._pq[0]
+            subvectors, _, sub_dimension = codebooks.shape
+            # Per-subvector dot products with every centroid; a score is a sum of lookups
+            table = np.einsum("mkd,md->mk", codebooks, part.reshape(subvectors, sub_dimension))
+
+        scores = np.empty(len(candidates), dtype=np.float32)
+        contiguous = len(candidates) == rows
+        for start in range(0, len(candidates), SCORE_BLOCK_ROWS):
+            end = min(len(candidates), start + SCORE_BLOCK_ROWS)
+            index = slice(start, end) if contiguous else candidates[start:end]
+            codes = self._codes[index]
+            if self.compression == "pq":
+                # One gather per subvector is much cheaper than a 2-D fancy index
+                block = np.zeros(end - start, dtype=np.float32)
+                for j in range(len(table)):
+                    block += table[j].take(codes[:, j])
+                scores[start:end] = block
+            else:
+                scores[start:end] = (codes.astype(np.float32, copy=False) @ part) * self._scales[index]
+        return scores
+
+    def search(self, query: List[float], top_k: int,
+               filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        q = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if norm:
+            q = q / norm
+
+        with self._lock:
+            rows = len(self.ids)
+            if not self._rows or top_k <= 0:
+                return []
+            mask = self._filter_mask(filter, rows)
+
+            if self.compression == "pq" and len(self._rows) >= max(LOCAL_PQ_MIN_VECTORS, PQ_CENTROIDS):
+                # Retrain once the store has doubled since the last training
+                if self._pq is None or len(self._rows) > 2 * self._pq[1]:
+                    self._train_pq(rows)
+
+            if len(self._rows) >= LOCAL_IVF_MIN_VECTORS:
+                # Rebuild once the store has doubled since the last build
+                if self._ivf is None or len(self._rows) > 2 * self._ivf[2]:
+                    self._build_ivf(rows)
+                centroids, assignments, _ = self._ivf
+                probes = np.argsort(centroids @ q)[-LOCAL_IVF_NPROBE:]
+                probed = mask & np.isin(assignments[:rows], probes)
+                if probed.sum() >= top_k:
+                    mask = probed
+
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            if self._codes is not None:
+                approximate = self._approximate_scores(candidates, q, rows)
+                shortlist = min(len(candidates), top_k * self.rerank_factor)
+                best = np.argpartition(-approximate, shortlist - 1)[:shortlist]
+                # Sorted rows keep the reads from the on-disk matrix sequential
+                candidates = np.sort(candidates[best])
+                scores = self._matrix[candidates] @ q
+            elif len(candidates) == rows:
+                scores = self._matrix[:rows] @ q
+            else:
+                scores = self._matrix[candidates] @ q
+
+            k = min(top_k, len(candidates))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            results = []
+            for position in best:
+                row = int(candidates[position])
+                results.append({
+                    "id": self.ids[row],
+                    "similarity": float(scores[position]),
+                    "meta": dict(self.meta[row]),
+                    "filter": dict(self.filters[row]),
+                })
+            return results
+
+    def _save_codes(self):
+        rows = len(self.ids)
+        arrays = {"codes": self._codes[:rows], "scales": self._scales[:rows]}
+        if self._pq is not None:
+            arrays["codebooks"] = self._pq[0]
+            arrays["trained_on"] = np.int64(self._pq[1])
+        temp_path = self._codes_path.with_suffix(".tmp.npz")
+        np.savez(temp_path, layout=np.array(self._codes_layout()),
+                 generation=np.int64(self._generation), **arrays)
+        os.replace(temp_path, self._codes_path)
+
+    def save(self):
+        with self._lock:
+            self._matrix.flush()
+            self._generation += 1
+            if self._codes is not None:
+                # Written first; a crash before the state file leaves them stale, not wrong
+                self._save_codes()
+            data = {
+                "version": LOCAL_STORE_VERSION,
+                "dimension": self.dimension,
+                "generation": self._generation,
+                "ids": list(self.ids),
+                "meta": list(self.meta),
+                "filter": list(self.filters),
+            }
+            self.dirty = False
+            write_json_atomic(self._state_path, data)
+            self.state_mtime = os.stat(self._state_path).st_mtime_ns
+
+
+_local_stores: Dict[str, LocalVectorStore] = {}
+_local_stores_lock = threading.Lock()
+
+
+def get_local_store(codebase_name: str) -> LocalVectorStore:
+    """
+    Returns the process-wide local store for a codebase, reloading it if
+    another process saved a newer version (and there are no unsaved writes).
+    """
+    directory = get_state_dir(codebase_name) / "vectors"
+    try:
+        mtime = os.stat(directory / "state.json").st_mtime_ns
+    except OSError:
+        mtime = 0
+    with _local_stores_lock:
+        store = _local_stores.get(codebase_name)
+        if store is None or (store.state_mtime != mtime and not store.dirty):
+            store = LocalVectorStore(directory)
+            _local_stores[codebase_name] = store
+        return store
+
+
+def get_vector_store(codebase_name: str, client=None, create: bool = False) -> Optional[VectorStore]:
+    """
+    Opens the configured vector store backend for a codebase.
+
+    With the Endee backend, `client` is used to look the index up (and to
+    create it when `create` is set); None is returned if it is unavailable.
+    """
+    if VECTOR_BACKEND == "local":
+        return get_local_store(codebase_name)
+
+    if client is None:
+        print("Endee client not initialized (missing key?).")
+        return None
+    try:
+        return EndeeVectorStore(client.get_index(codebase_name))
+    except Exception:
+        if not create:
+            return None
+        print(f"Index '{codebase_name}' not found. Creating it...")
+        try:
+            return EndeeVectorStore(
+                client.create_index(codebase_name, dimension=EMBEDDING_DIMENSION, space_type="cosine")
+            )
+        except Exception as create_error:
+            print(f"Failed to create index: {create_error}")
+            return None
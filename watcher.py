@@ -0,0 +1,304 @@
+import argparse
+import bisect
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from blob_store import get_blob_store
+from ingestion_utils import (
+    _get_or_create_index,
+    ingest_file,
+    ingest_folder,
+    remove_file,
+    source_file_discovery,
+)
+from lexical_index import LexicalIndex
+from manifest import Manifest, codebase_lock, index_version
+from symbol_index import SymbolIndex
+
+# A burst of events is processed once no new event arrived for this long...
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", 1.0))
+# ...or once its oldest event is this old, so constant saving still gets indexed
+WATCH_MAX_DELAY_SECONDS = float(os.getenv("WATCH_MAX_DELAY_SECONDS", 10.0))
+
+
+class CodebaseWatcher:
+    """
+    Keeps a codebase index fresh by re-ingesting files as they change.
+
+    Filesystem events (inotify on Linux, via watchdog) are collected per path
+    and debounced; each batch goes through ingest_file / remove_file with a
+    shared manifest, lexical and symbol index, which are saved once per batch.
+    Events for excluded or ignored paths (.git, node_modules, .gitignore)
+    are dropped as they arrive, unless something under them is indexed.
+    """
+
+    def __init__(self, directory: str, codebase_name: str,
+                 debounce: float = WATCH_DEBOUNCE_SECONDS,
+                 max_delay: float = WATCH_MAX_DELAY_SECONDS,
+                 on_update: Optional[Callable[[Dict[str, int]], None]] = None):
+        self.directory = os.path.abspath(directory)
+        self.codebase_name = codebase_name
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.on_update = on_update
+        self._discovery = source_file_discovery(self.directory)
+        # path -> (first event time, last event time)
+        self._pending: Dict[str, List[float]] = {}
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+        self._version = None
+        self._manifest: Optional[Manifest] = None
+        self._lexical: Optional[LexicalIndex] = None
+        self._symbols: Optional[SymbolIndex] = None
+        # Sorted paths of every indexed file, for prefix lookups; guarded by _condition
+        self._known: List[str] = []
+
+    def start(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+        self._load_state()
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in ("opened", "closed_no_write"):
+                    return
+                if event.is_directory and event.event_type == "modified":
+                    # Fired for the parent of every created/deleted entry
+                    return
+                watcher.notify(os.fsdecode(event.src_path))
+                dest_path = getattr(event, "dest_path", "")
+                if dest_path:
+                    watcher.notify(os.fsdecode(dest_path))
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.directory, recursive=True)
+        self._observer.start()
+        self._thread = threading.Thread(target=self._run, name=f"watch-{self.codebase_name}", daemon=True)
+        self._thread.start()
+        print(f"Watching {self.directory} for changes to '{self.codebase_name}'")
+
+    def stop(self):
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _indexed_under(self, path: str) -> List[str]:
+        """Indexed files at or under `path`; callers hold _condition."""
+        prefix = os.path.join(path, "")
+        start = bisect.bisect_left(self._known, path)
+        found = []
+        if start < len(self._known) and self._known[start] == path:
+            found.append(path)
+        start = bisect.bisect_left(self._known, prefix, lo=start)
+        for file_path in self._known[start:]:
+            if not file_path.startswith(prefix):
+                break
+            found.append(file_path)
+        return found
+
+    def _relevant(self, path: str) -> bool:
+        """Whether a change to `path` can affect the index."""
+        with self._condition:
+            if self._indexed_under(path):
+                # Covers deletions, and files that became ignored
+                return True
+        if self._discovery.is_excluded(path):
+            return False
+        return os.path.isdir(path) or self._discovery.accepts(path)
+
+    def notify(self, path: str):
+        """Records a change to a path (file or directory)."""
+        path = os.path.abspath(path)
+        if not self._relevant(path):
+            metrics.increment("watch_events_ignored_total")
+            return
+        now = time.monotonic()
+        with self._condition:
+            times = self._pending.get(path)
+            if times is None:
+                self._pending[path] = [now, now]
+            else:
+                times[1] = now
+            self._condition.notify()
+
+    def _take_ready(self) -> List[str]:
+        """Waits for a batch that is quiet (or old) enough, then removes and returns it."""
+        with self._condition:
+            while not self._stopped.is_set():
+                if self._pending:
+                    now = time.monotonic()
+                    first = min(times[0] for times in self._pending.values())
+                    last = max(times[1] for times in self._pending.values())
+                    wait = min(last + self.debounce, first + self.max_delay) - now
+                    if wait <= 0:
+                        paths = list(self._pending)
+                        self._pending.clear()
+                        return paths
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+            return []
+
+    def _run(self):
+        while not self._stopped.is_set():
+            paths = self._take_ready()
+            if not paths:
+                continue
+            try:
+                self.process(paths)
+            except Exception as e:
+                print(f"Error updating '{self.codebase_name}' from file changes: {e}")
+                metrics.increment("errors_total", stage="watch_update")
+
+    def _load_state(self):
+        # Reload if someone else (e.g. a full ingest) saved since our last batch;
+        # callers hold the codebase lock
+        if self._manifest is None or index_version(self.codebase_name) != self._version:
+            self._manifest = Manifest.load(self.codebase_name)
+            self._lexical = LexicalIndex.load(self.codebase_name)
+            self._symbols = SymbolIndex.load(self.codebase_name)
+            known = sorted(set(self._manifest.files) | self._lexical.files() | set(self._symbols.files))
+            with self._condition:
+                self._known = known
+
+    def _update_known(self, files: Dict[str, bool]):
+        with self._condition:
+            for file_path, exists in files.items():
+                i = bisect.bisect_left(self._known, file_path)
+                present = i < len(self._known) and self._known[i] == file_path
+                if exists and not present:
+                    self._known.insert(i, file_path)
+                elif not exists and present:
+                    del self._known[i]
+
+    def _expand(self, paths: List[str]) -> Dict[str, bool]:
+        """Maps changed paths to the source files they affect -> whether each still exists."""
+        files: Dict[str, bool] = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            # Anything indexed at or under the path (covers deleted and moved-away directories)
+            with self._condition:
+                indexed = self._indexed_under(path)
+            for file_path in indexed:
+                files[file_path] = self._discovery.accepts(file_path)
+            if os.path.isdir(path):
+                # A directory created or moved in reports no events for its contents
+                if not self._discovery.is_excluded(path):
+                    for file_path in self._discovery.walk(start=path):
+                        files[file_path] = True
+            elif self._discovery.accepts(path):
+                files[path] = True
+        return files
+
+    def process(self, paths: List[str]) -> Dict[str, int]:
+        """Re-ingests or removes the files behind a batch of changed paths."""
+        start = time.perf_counter()
+        # Held from load to save, so this batch and an ingest job never drop each other's updates
+        with codebase_lock(self.codebase_name), metrics.span("watch_update"):
+            self._load_state()
+            files = self._expand(paths)
+            stats = {"events": len(paths), "updated": 0, "removed": 0}
+            for file_path, exists in sorted(files.items()):
+                try:
+                    if exists:
+                        ingest_file(
+                            file_path, self.codebase_name, manifest=self._manifest,
+                            lexical=self._lexical, symbols=self._symbols,
+                        )
+                        stats["updated"] += 1
+                    else:
+                        remove_file(
+                            file_path, self.codebase_name, manifest=self._manifest,
+                            lexical=self._lexical, symbols=self._symbols,
+                        )
+                        stats["removed"] += 1
+                except OSError as e:
+                    # Deleted or replaced again while we were reading it; the next event covers it
+                    print(f"Skipping {file_path}: {e}")
+            self._update_known(files)
+            if files:
+                get_blob_store(self.codebase_name).save()
+                index = _get_or_create_index(self.codebase_name)
+                # Vectors are persisted before the manifest that records them
+                if index:
+                    index.save()
+                self._manifest.save()
+                self._lexical.save()
+                self._symbols.save()
+                self._version = index_version(self.codebase_name)
+        metrics.increment("watch_files_total", stats["updated"], action="update")
+        metrics.increment("watch_files_total", stats["removed"], action="remove")
+        if files:
+            print(
+                f"Updated '{self.codebase_name}' in {time.perf_counter() - start:.2f}s: "
+                f"{stats['updated']} files re-ingested, {stats['removed']} removed"
+            )
+            if self.on_update:
+                self.on_update(stats)
+        return stats
+
+
+_watchers: Dict[str, CodebaseWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def start_watching(directory: str, codebase_name: str,
+                   on_update: Optional[Callable[[Dict[str, int]], None]] = None) -> CodebaseWatcher:
+    """Starts (or returns the running) watcher for a codebase."""
+    with _watchers_lock:
+        watcher = _watchers.get(codebase_name)
+        if watcher is not None and watcher.running and watcher.directory == os.path.abspath(directory):
+            return watcher
+        if watcher is not None:
+            watcher.stop()
+        watcher = CodebaseWatcher(directory, codebase_name, on_update=on_update)
+        watcher.start()
+        _watchers[codebase_name] = watcher
+        return watcher
+
+
+def stop_watching(codebase_name: str):
+    with _watchers_lock:
+        watcher = _watchers.pop(codebase_name, None)
+    if watcher is not None:
+        watcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a codebase index up to date as files change.")
+    parser.add_argument("directory")
+    parser.add_argument("codebase_name")
+    parser.add_argument("--no-initial-sync", action="store_true",
+                        help="Skip the incremental ingest that catches up on changes made while not watching")
+    args = parser.parse_args()
+
+    metrics.write_file_at_exit()
+    if not args.no_initial_sync:
+        ingest_folder(args.directory, args.codebase_name)
+    watcher = CodebaseWatcher(args.directory, args.codebase_name)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()